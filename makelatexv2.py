@@ -1,6 +1,13 @@
 import json
 from pathlib import Path
 import argparse
+import sys
+
+SCRIPTS_DIR = Path(__file__).resolve().parent / "scripts"
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from texescape import latex_escape_plain
 
 # =========================
 # Helpers
@@ -10,19 +17,7 @@ def latex_escape(s: str) -> str:
     # NOTE:
     #  - Backslash is kept as-is (makedocjsonv2 already converts \0 -> \textbackslash 0)
     #  - $ is kept as-is so you can embed math if needed
-    if s is None:
-        return ""
-    rep = {
-        "&": r"\&",
-        "%": r"\%",
-        "#": r"\#",
-        "_": r"\_",
-        "{": r"\{",
-        "}": r"\}",
-        "~": r"\textasciitilde{}",
-        "^": r"\textasciicircum{}",
-    }
-    return "".join(rep.get(ch, ch) for ch in str(s))
+    return latex_escape_plain(s)
 
 
 def _opt_kv(before=None, after=None) -> str:
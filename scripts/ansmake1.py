@@ -13,6 +13,8 @@ import re
 import sys
 import json
 
+from exam_utils import replace_if_changed
+
 # 現在の場所
 # curdir = Path(__file__).parent.parent
 
@@ -204,17 +206,23 @@ def make_pdf(kaito,outfile, max_rows_per_page, version=None):
     # ✅ 文書生成
     # outfile=str(curdir / "output" / subject / (f"{subject}_{kaito[0]['title']}解答用紙.pdf"))
     # outfile=str(curdir / "output" / subject / (f"{subject}_{kaito[0]['title']}解答用紙.pdf"))
+    # invariant: 作成日時は SOURCE_DATE_EPOCH（無ければ 2000-01-01）、/ID は中身から作る
+    # → 同じ内容なら同じバイト列になるので、前回と同じなら outfile を書き換えない
+    outfile = Path(outfile)
+    tmpfile = outfile.with_name(outfile.name + ".tmp")
     doc = SimpleDocTemplate(
-        str(outfile), 
+        str(tmpfile), 
         leftMargin=45, 
         pagesize=A4, 
         topMargin=10*mm, 
-        bottomMargin=20*mm
+        bottomMargin=20*mm,
+        invariant=1,
         )
 
     #doc.build(story) 
     try:
         doc.build(story)
+        return replace_if_changed(tmpfile, outfile)
     except Exception as e:
         print("build中にエラー:", e)
         for i, item in enumerate(story):
@@ -224,4 +232,5 @@ def make_pdf(kaito,outfile, max_rows_per_page, version=None):
                 print(f"→ story[{i}] でエラー: {e2}")
                 print(item)
                 break
+        tmpfile.unlink(missing_ok=True)
     
\ No newline at end of file
@@ -0,0 +1,895 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+
+examtools の各処理の速度を、合成データで計測する補助スクリプト。
+Excel/slideinfo などの実データは使わない。
+
+実行例:
+    python scripts/benchmark.py validate --questions 1000 5000 10000
+    python scripts/benchmark.py shuffle --questions 2000 --choices 5 --versions 1 9
+    python scripts/benchmark.py json --elements 10000
+    python scripts/benchmark.py conv --versions 2
+    python scripts/benchmark.py contract --elements 10000 50000
+    python scripts/benchmark.py model --elements 10000 50000
+    python scripts/benchmark.py escape --random 20000
+    python scripts/benchmark.py preamble --elements 200
+    python scripts/benchmark.py preamble --body work/latex/A/<sheet>_A_body.tex --images <exam_dir>/images
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import json
+import random
+import re
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable
+
+
+# ============================================================
+# 共通
+# ============================================================
+def timeit(func: Callable[[], Any], repeat: int = 3) -> float:
+    """func を repeat 回実行し、最速の秒数を返す。"""
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def print_row(label: str, *values: Any) -> None:
+    print(f"{label:<28}" + "".join(f"{str(v):>14}" for v in values))
+
+
+# ============================================================
+# validate: qid / orderB の全体チェック
+# ============================================================
+def make_question_sheet(n_questions: int, *, dup_every: int = 0):
+    """
+    b_question〜e_question を n_questions 個並べた Worksheet を作る。
+    dup_every > 0 のとき、その間隔で qid / orderB を重複させる。
+    """
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append(["b_exam"])
+    ws.append(["qpattern", "A,B"])
+    ws.append(["e_exam"])
+    for i in range(1, n_questions + 1):
+        qno = i - 1 if dup_every and i % dup_every == 0 else i
+        ws.append(["b_question", "項目", f"Q{qno:05d}", n_questions + 1 - qno])
+        ws.append(["question", f"問題文 {i}"])
+        ws.append(["e_question"])
+    return ws
+
+
+def _naive_question_columns(ws, errors: list[dict[str, Any]]) -> None:
+    """比較用：旧実装と同じ ws.cell + list.count による O(n^2) チェック。"""
+    qids: list[str] = []
+    orders: list[int] = []
+    for row_no in range(1, ws.max_row + 1):
+        if str(ws.cell(row_no, 1).value or "").strip() != "b_question":
+            continue
+        qids.append(str(ws.cell(row_no, 3).value).strip())
+        orders.append(int(str(ws.cell(row_no, 4).value).strip()))
+    for qid in sorted({x for x in qids if qids.count(x) > 1}):
+        errors.append({"row": 1, "message": f"qid が重複しています: {qid}"})
+    for ob in sorted({x for x in orders if orders.count(x) > 1}):
+        errors.append({"row": 1, "message": f"orderB が重複しています: {ob}"})
+
+
+def bench_validate(args: argparse.Namespace) -> None:
+    from validate_excel import validate_question_columns
+
+    print_row("questions", "naive[s]", "linear[s]", "errors")
+    for n in args.questions:
+        ws = make_question_sheet(n, dup_every=args.dup_every)
+
+        naive = timeit(lambda: _naive_question_columns(ws, []), args.repeat)
+
+        errors: list[dict[str, Any]] = []
+
+        def run_linear() -> None:
+            errors.clear()
+            validate_question_columns(ws, errors, make_b=True)
+
+        linear = timeit(run_linear, args.repeat)
+
+        print_row(str(n), f"{naive:.4f}", f"{linear:.4f}", len(errors))
+
+
+# ============================================================
+# shuffle: 版別の選択肢シャッフル
+# ============================================================
+def make_choice_sheet(n_questions: int, n_choices: int):
+    """k 択の select と #select 解答を持つ大問を n_questions 個並べた Worksheet を作る。"""
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for i in range(1, n_questions + 1):
+        ws.append(["b_question", "項目", f"Q{i:05d}", i])
+        ws.append(["question", f"問題文 {i}"])
+        ws.append(["b_select", "normal"])
+        for c in range(1, n_choices + 1):
+            ws.append(["select", f"選択肢 {c}"])
+        ws.append(["e_select"])
+        ws.append(["b_answer", "#select"])
+        ws.append(["answer", (i % n_choices) + 1, 2])
+        ws.append(["e_answer"])
+        ws.append(["e_question"])
+    return ws
+
+
+MIXED_CHOICES = (4, 3, 4, 8, 4, 5, 6, 4, 7, 9, 2, 4)
+
+
+def make_mixed_choice_sheet(n_questions: int) -> tuple[Any, set[int]]:
+    """
+    択数の違う select / subselect を混ぜた Worksheet と、4択グループ（とその解答）の行番号を返す。
+    大問ごとに択数を MIXED_CHOICES から順に選び、2問に1問は4択の小問も付ける。
+    """
+    import openpyxl
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    rows4: set[int] = set()
+
+    def add_group(kind: str, answer_tag: str, k: int, i: int) -> None:
+        ws.append([f"b_{kind}", "normal"])
+        start = ws.max_row + 1
+        for c in range(1, k + 1):
+            ws.append([kind, f"選択肢 {c}"])
+        ws.append([f"e_{kind}"])
+        ws.append([f"b_{answer_tag}", "#select"])
+        ws.append([answer_tag, (i % k) + 1, 2])
+        if k == 4:
+            rows4.update(range(start, start + k))
+            rows4.add(ws.max_row)
+        ws.append([f"e_{answer_tag}"])
+
+    for i in range(1, n_questions + 1):
+        ws.append(["b_question", "項目", f"Q{i:05d}", i])
+        ws.append(["question", f"問題文 {i}"])
+        add_group("select", "answer", MIXED_CHOICES[i % len(MIXED_CHOICES)], i)
+        if i % 2:
+            ws.append(["b_subquest"])
+            add_group("subselect", "subanswer", MIXED_CHOICES[(i // 2) % len(MIXED_CHOICES)], i)
+            ws.append(["e_subquest"])
+        ws.append(["e_question"])
+    return ws, rows4
+
+
+_LEGACY_PATTERNS = [[2, 3, 4, 1], [3, 4, 1, 2]]
+
+
+def _legacy_fill_shuffle_b(ws) -> dict[int, Any]:
+    """
+    比較用：一般化前の fill_shuffle_for_sheet（B版・4択だけ、PATTERNS の交互）。
+    シートは書き換えず、G列に書いたはずの値を 行番号 -> 値 で返す。
+    """
+    from validate_excel import convert_answers, format_answer_numbers, norm_tag, parse_answer_numbers
+
+    out: dict[int, Any] = {}
+    counters = {"select": 0, "subselect": 0}
+    rows: dict[str, list[int]] = {"select": [], "subselect": []}
+    current: dict[str, list[int] | None] = {"select": None, "subselect": None}
+
+    def flush(kind: str) -> None:
+        if not rows[kind]:
+            return
+        if len(rows[kind]) != 4:
+            # 4行でないグループは警告して飛ばしていた（通し番号は進めない）
+            rows[kind] = []
+            current[kind] = None
+            return
+        pattern = _LEGACY_PATTERNS[counters[kind] % len(_LEGACY_PATTERNS)]
+        for row_no, value in zip(rows[kind], pattern):
+            out[row_no] = value
+        current[kind] = pattern
+        counters[kind] += 1
+        rows[kind] = []
+
+    in_block = {"select": False, "subselect": False}
+    is_select = {"answer": False, "subanswer": False}
+    in_answer = {"answer": False, "subanswer": False}
+    for row_no, row in enumerate(ws.iter_rows(max_col=2, values_only=True), start=1):
+        tag = norm_tag(row[0])
+        value_b = row[1] if len(row) > 1 else None
+        if tag in ("b_question", "e_question", "b_subquest"):
+            flush("select")
+            flush("subselect")
+            kind = "subselect" if tag == "b_subquest" else "select"
+            in_block[kind] = tag != "e_question"
+            current[kind] = None
+            if tag == "e_question":
+                in_answer["answer"] = is_select["answer"] = False
+            continue
+        if tag == "e_subquest":
+            flush("subselect")
+            in_block["subselect"] = False
+            in_answer["subanswer"] = is_select["subanswer"] = False
+            current["subselect"] = None
+            continue
+        if tag in rows:
+            if tag == "subselect":
+                flush("select")
+            if in_block[tag]:
+                rows[tag].append(row_no)
+                # 旧実装は4行たまった時点で1グループとして確定していた
+                if len(rows[tag]) == 4:
+                    flush(tag)
+            continue
+        flush("select")
+        flush("subselect")
+        if tag in ("b_answer", "b_subanswer"):
+            in_answer[tag[2:]] = True
+            is_select[tag[2:]] = value_b is not None and str(value_b).strip() == "#select"
+        elif tag in ("e_answer", "e_subanswer"):
+            in_answer[tag[2:]] = is_select[tag[2:]] = False
+        elif tag in in_answer and in_answer[tag] and is_select[tag]:
+            pattern = current["select" if tag == "answer" else "subselect"]
+            old_answers = parse_answer_numbers(value_b) if pattern else []
+            if old_answers:
+                out[row_no] = format_answer_numbers(convert_answers(old_answers, pattern))
+    return out
+
+
+def bench_shuffle(args: argparse.Namespace) -> None:
+    from exam_utils import shuffle_column
+    from validate_excel import fill_shuffle_for_sheet
+
+    letters = [chr(ord("B") + i) for i in range(25)]
+    ws = make_choice_sheet(args.questions, args.choices)
+
+    print_row("versions", "time[s]", "groups")
+    for n in args.versions:
+        versions = letters[:n]
+        stats: dict[str, int] = {}
+
+        def run() -> None:
+            stats.update(fill_shuffle_for_sheet(ws, versions, seed=args.seed))
+
+        elapsed = timeit(run, args.repeat)
+        print_row(",".join(versions) if n <= 3 else f"B..{versions[-1]}", f"{elapsed:.4f}", stats.get("question_choice_groups", 0))
+
+    # 択数が混ざったシートで、4択グループのB版が旧実装（PATTERNS の交互）と同じ並びになるか
+    ws, rows4 = make_mixed_choice_sheet(args.questions)
+    legacy = _legacy_fill_shuffle_b(ws)
+    fill_shuffle_for_sheet(ws, ["B"])
+    col = shuffle_column("B")
+    diff = [row_no for row_no in sorted(rows4) if ws.cell(row_no, col).value != legacy.get(row_no)]
+    print(f"mixed k vs PATTERNS (B, 4択): rows={len(rows4)} same={not diff}" + (f" first={diff[:8]}" if diff else ""))
+
+
+# ============================================================
+# json: make_json の normalize / validate
+# ============================================================
+def make_exam_document(n_elements: int, *, versions: int = 2) -> dict[str, Any]:
+    """
+    make_json の出力と同じ形の文書を作る。1版あたり約 n_elements 個の要素を持つ。
+    数式・旧形式（items / inline(n) / vspace.value）を混ぜ、normalize にも仕事をさせる。
+    """
+    def src(row: int) -> dict[str, Any]:
+        return {"sheet": "bench", "row": row}
+
+    doc: dict[str, Any] = {"versionmode": "multi", "versions": []}
+    for vi in range(versions):
+        questions: list[dict[str, Any]] = []
+        count = 0
+        row = 1
+        while count < n_elements:
+            body: list[dict[str, Any]] = [
+                {"type": "text", "value": rf"式 \(x_{{{row}}}^2\) と \[\frac{{a}}{{b}}\] を求めよ。", "tag": "question", "src": src(row)},
+                {
+                    "type": "choices",
+                    "style": "inline(4)" if row % 2 else "normal",
+                    "items": [
+                        {"label": f"({c})", "text": rf"\(y={c}\)", "tag": "select", "src": src(row + c)}
+                        for c in range(1, 5)
+                    ],
+                    "tag": "b_select",
+                    "src": src(row),
+                },
+                {"type": "code", "lines": ["int a = 0;", "a++;"], "linenumber": True, "tag": "b_code", "src": src(row + 5)},
+                {"type": "multiline", "values": ["行1", r"行2 \(z\)"], "tag": "b_multiline", "src": src(row + 6)},
+                {"type": "vspace", "value": 10, "tag": "vspace", "src": src(row + 7)},
+            ]
+            questions.append({"qid": f"Q{row:05d}", "score": 5, "body": body})
+            count += len(body) + 4
+            row += 10
+        doc["versions"].append({
+            "version": chr(ord("A") + vi),
+            "questions": questions,
+            "metainfo": {"type": "metainfo", "hash": "bench"},
+        })
+    return doc
+
+
+def _legacy_protect_math_segments(obj: Any, mapping: dict, counter: list) -> None:
+    """旧 make_json.protect_math_segments（文書全体を再帰で走査して数式を退避する）"""
+    from make_json import _protect_math_segments_in_str
+
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj) if isinstance(obj, list) else ()
+    for k, v in list(items):
+        if isinstance(v, str):
+            obj[k] = _protect_math_segments_in_str(v, mapping, counter)
+        else:
+            _legacy_protect_math_segments(v, mapping, counter)
+
+
+def _legacy_restore_math_segments(obj: Any, mapping: dict) -> None:
+    """旧 make_json.restore_math_segments"""
+    from make_json import _restore_math_segments_in_str
+
+    items = obj.items() if isinstance(obj, dict) else enumerate(obj) if isinstance(obj, list) else ()
+    for k, v in list(items):
+        if isinstance(v, str):
+            obj[k] = _restore_math_segments_in_str(v, mapping)
+        else:
+            _legacy_restore_math_segments(v, mapping)
+
+
+def bench_json(args: argparse.Namespace) -> None:
+    from contract import normalize_document, validate_document
+    from make_json import normalize_and_validate_json
+
+    def four_walks(doc: dict[str, Any]) -> list[Any]:
+        mapping: dict[str, str] = {}
+        _legacy_protect_math_segments(doc, mapping, [0])
+        p1 = normalize_document(doc)
+        _legacy_restore_math_segments(doc, mapping)
+        return p1 + validate_document(doc, strict=True, warn_unknown_keys=True)
+
+    print_row("elements/version", "4 walks[s]", "fused[s]", "same")
+    for n in args.elements:
+        base = make_exam_document(n, versions=args.versions)
+
+        d1, d2 = copy.deepcopy(base), copy.deepcopy(base)
+        same = four_walks(d1) == normalize_and_validate_json(d2) and json.dumps(d1) == json.dumps(d2)
+
+        copies = [copy.deepcopy(base) for _ in range(max(1, args.repeat))]
+        old = timeit(lambda: four_walks(copies.pop()), len(copies))
+        copies = [copy.deepcopy(base) for _ in range(max(1, args.repeat))]
+        new = timeit(lambda: normalize_and_validate_json(copies.pop()), len(copies))
+
+        print_row(str(n), f"{old:.4f}", f"{new:.4f}", same)
+
+
+# ============================================================
+# contract: validate_document
+# ============================================================
+def _legacy_validate_element(elem: dict[str, Any], strict: bool, warn_unknown_keys: bool) -> list[Any]:
+    """比較用：コンパイル前の validate_element（要素ごとに集合を作り、型で分岐する）。"""
+    from contract import (
+        COMMON_META_REQUIRED, CONTRACT, META_TYPES_NO_SRC, Problem,
+        _STYLE_INLINE_RE, _as_int, _is_non_empty_list, element_loc, loc_from_src,
+    )
+
+    problems: list[Any] = []
+    etype = elem.get("type")
+    loc = element_loc(elem)
+    if not isinstance(etype, str) or not etype:
+        return [Problem("ERROR", loc, "missing or invalid element type")]
+    spec = CONTRACT.get(etype)
+    if spec is None:
+        return [Problem("ERROR" if strict else "WARN", loc, f"unknown element type: '{etype}'")]
+    if spec.require_meta and etype not in META_TYPES_NO_SRC:
+        for k in COMMON_META_REQUIRED:
+            if k not in elem:
+                problems.append(Problem("ERROR" if strict else "WARN", loc, f"{etype}: missing meta key: {k}"))
+    for k in spec.required:
+        if k not in elem:
+            problems.append(Problem("ERROR", loc, f"{etype}: missing required key: {k}"))
+    if warn_unknown_keys and spec.warn_unknown_keys:
+        allowed = set(spec.required) | set(spec.optional) | {"tag", "src"}
+        for k in elem.keys():
+            if k not in allowed:
+                problems.append(Problem("ERROR" if strict else "WARN", loc, f"{etype}: unknown key: {k}"))
+    if etype in ("text", "sline"):
+        if "value" in elem and not isinstance(elem["value"], str):
+            problems.append(Problem("ERROR", loc, f"{etype}: value must be string"))
+    if etype == "choices":
+        style = elem.get("style")
+        if style not in ("normal", "inline") and not (isinstance(style, str) and _STYLE_INLINE_RE.match(style)):
+            problems.append(Problem("ERROR", loc, "choices: style must be 'normal' or 'inline'"))
+        values = elem.get("values")
+        if not _is_non_empty_list(values):
+            problems.append(Problem("ERROR", loc, "choices: values must be non-empty list"))
+        else:
+            for idx, opt in enumerate(values):
+                opt_loc = loc_from_src(opt["src"]) if isinstance(opt, dict) and "src" in opt else loc
+                if not isinstance(opt, dict):
+                    problems.append(Problem("ERROR", opt_loc, f"choices: option[{idx}] must be object"))
+                    continue
+                if "text" not in opt or not isinstance(opt.get("text"), str) or not opt.get("text"):
+                    problems.append(Problem("ERROR", opt_loc, f"choices: option[{idx}] missing text"))
+                if strict and ("label" not in opt or not isinstance(opt.get("label"), str) or not opt.get("label")):
+                    problems.append(Problem("ERROR", opt_loc, f"choices: option[{idx}] missing label"))
+                if "src" not in opt:
+                    problems.append(Problem("WARN", opt_loc, f"choices: option[{idx}] missing src"))
+        if "sep" in elem and _as_int(elem["sep"]) is None:
+            problems.append(Problem("ERROR", loc, "choices: sep must be int"))
+    for t, key in (("code", "lines"), ("multiline", "values"), ("preline", "values")):
+        if etype == t:
+            vals = elem.get(key)
+            if not _is_non_empty_list(vals):
+                problems.append(Problem("ERROR", loc, f"{t}: {key} must be non-empty list"))
+            else:
+                bad = [i for i, v in enumerate(vals) if not isinstance(v, str)]
+                if bad:
+                    problems.append(Problem("ERROR", loc, f"{t}: {key}[{bad[0]}] is not string"))
+    if etype == "code" and "linenumber" in elem and not isinstance(elem["linenumber"], bool):
+        problems.append(Problem("ERROR", loc, "code: linenumber must be boolean"))
+    if etype == "premise" and not isinstance(elem.get("content"), list):
+        problems.append(Problem("ERROR", loc, "premise: content must be list"))
+    if etype == "image":
+        if elem.get("path") is not None and not isinstance(elem.get("path"), str):
+            problems.append(Problem("ERROR", loc, "image: path must be string"))
+        if "width" in elem and not isinstance(elem["width"], (int, float)):
+            problems.append(Problem("ERROR", loc, "image: width must be number"))
+    if etype == "vspace" and "value_mm" in elem and _as_int(elem["value_mm"]) is None:
+        problems.append(Problem("ERROR", loc, "vspace: value_mm must be int"))
+    return problems
+
+
+def _legacy_validate_document(doc: Any, strict: bool, warn_unknown_keys: bool) -> list[Any]:
+    """比較用：再帰で走査する旧 validate_document（例外は送出しない）。"""
+    problems: list[Any] = []
+
+    def walk(node: Any) -> None:
+        if isinstance(node, dict):
+            if "type" in node:
+                problems.extend(_legacy_validate_element(node, strict, warn_unknown_keys))
+            for v in node.values():
+                walk(v)
+        elif isinstance(node, list):
+            for it in node:
+                walk(it)
+
+    walk(doc)
+    return problems
+
+
+def bench_contract(args: argparse.Namespace) -> None:
+    from contract import ContractError, normalize_document, validate_document
+
+    def compiled(doc: Any, **kw: Any) -> list[Any]:
+        try:
+            return validate_document(doc, strict=args.strict, warn_unknown_keys=True, **kw)
+        except ContractError as e:
+            return [str(e)]
+
+    print_row("elements/version", "legacy[s]", "compiled[s]", "fail_fast[s]", "problems", "same")
+    for n in args.elements:
+        doc = make_exam_document(n, versions=args.versions)
+        normalize_document(doc)
+        # 一部の要素を壊して Problem を出させる（fail_fast は最初の ERROR で止まる）
+        questions = doc["versions"][-1]["questions"]
+        for q in questions[len(questions) // 2::max(1, len(questions) // 10)]:
+            q["body"][0]["bogus"] = 1
+
+        legacy_ps = _legacy_validate_document(doc, args.strict, True)
+        try:
+            new_ps = validate_document(doc, strict=args.strict, warn_unknown_keys=True)
+        except ContractError as e:
+            same = str(e) == "\n".join(str(p) for p in legacy_ps if p.level == "ERROR")
+        else:
+            same = [str(p) for p in new_ps] == [str(p) for p in legacy_ps]
+
+        legacy = timeit(lambda: _legacy_validate_document(doc, args.strict, True), args.repeat)
+        new = timeit(lambda: compiled(doc), args.repeat)
+        fast = timeit(lambda: compiled(doc, fail_fast=True), args.repeat)
+
+        print_row(str(n), f"{legacy:.4f}", f"{new:.4f}", f"{fast:.4f}", len(legacy_ps), same)
+
+
+# ============================================================
+# model: exam_model（dict と型付きモデルのメモリ・LaTeX 生成時間）
+# ============================================================
+def make_render_block(n_elements: int) -> dict[str, Any]:
+    """make_exam_document を normalize し、レンダラが読む形（question/content/subquestions）の1版にする。"""
+    from contract import normalize_document
+
+    doc = make_exam_document(n_elements, versions=1)
+    normalize_document(doc)
+    block = doc["versions"][0]
+    questions: list[dict[str, Any]] = [{"type": "cover", "title": "bench", "notes": ["注意1", "注意2"], "tag": "b_exam"}]
+    for i, q in enumerate(block["questions"], start=1):
+        body = q["body"]
+        questions.append({
+            "qid": q["qid"],
+            "number": i,
+            "question": body[0]["value"],
+            "content": body[1:],
+            "subquestions": [{"number": 1, "question": "小問", "content": body[2:4], "tag": "b_subquestion"}],
+            "tag": "b_question",
+            "src": body[0]["src"],
+        })
+    block["questions"] = questions
+    return block
+
+
+def _traced_size(build: Callable[[], Any]) -> tuple[Any, int]:
+    tracemalloc.start()
+    try:
+        obj = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return obj, size
+
+
+def bench_model(args: argparse.Namespace) -> None:
+    from exam_model import build_exam_version
+    from make_latex import generate_version_tex, render_version_tex
+
+    print_row("elements/version", "dict[MB]", "model[MB]", "build[s]", "render[s]", "dict->tex[s]")
+    for n in args.elements:
+        raw = json.dumps(make_render_block(n), ensure_ascii=False)
+
+        _, dict_size = _traced_size(lambda: json.loads(raw))
+        # モデルだけを残す（読み込んだ dict は build 後に捨てる）
+        ev, model_size = _traced_size(lambda: build_exam_version(json.loads(raw)))
+
+        block = json.loads(raw)
+        data = {"versions": [block]}
+        build = timeit(lambda: build_exam_version(block), args.repeat)
+        render = timeit(lambda: render_version_tex(ev, include_cover=True), args.repeat)
+        full = timeit(lambda: generate_version_tex(data, "A", include_cover=True), args.repeat)
+
+        print_row(str(n), f"{dict_size / 2**20:.2f}", f"{model_size / 2**20:.2f}", f"{build:.4f}", f"{render:.4f}", f"{full:.4f}")
+
+
+# ============================================================
+# conv: conv_text（セル文字列の変換）
+# ============================================================
+EXAMTOOLS_ROOT = Path(__file__).resolve().parent.parent
+
+_LEGACY_BACKSLASH_DIGIT_RE = re.compile(r"\\(?=\d)")
+_LEGACY_BACKSLASH_IN_QUOTES_RE = re.compile(r"(?<=[\'\"])\\(?=[A-Za-z0-9])")
+_LEGACY_RAW_TEX_RE = re.compile(r"\[\[(.+?)\]\]", re.DOTALL)
+
+
+def _legacy_escape_tex_outside_inline_math(s: str) -> str:
+    """比較用：texconv 導入前の1文字ずつ走査する実装。"""
+    out = []
+    i = 0
+    in_math = False
+    end_token = None
+    while i < len(s):
+        if not in_math:
+            if s.startswith(r"\(", i) or s.startswith(r"\[", i):
+                in_math = True
+                end_token = r"\)" if s[i + 1] == "(" else r"\]"
+                out.append(s[i:i + 2])
+                i += 2
+                continue
+            ch = s[i]
+            out.append({"{": r"\{", "}": r"\}", "&": r"\&"}.get(ch, ch))
+            i += 1
+        else:
+            if s.startswith(end_token, i):
+                in_math = False
+                out.append(end_token)
+                i += 2
+                continue
+            out.append(s[i])
+            i += 1
+    return "".join(out)
+
+
+def _legacy_conv_text(v) -> str:
+    """比較用：texconv 導入前の conv_text。"""
+    if v is None:
+        return ""
+    s = str(v).strip()
+    if s == "":
+        return ""
+
+    def plain(seg: str) -> str:
+        seg = seg.replace("\x00", r"\textbackslash 0")
+        seg = _LEGACY_BACKSLASH_IN_QUOTES_RE.sub(r"\\textbackslash ", seg)
+        seg = _LEGACY_BACKSLASH_DIGIT_RE.sub(r"\\textbackslash ", seg)
+        return _legacy_escape_tex_outside_inline_math(seg)
+
+    out = []
+    last = 0
+    for m in _LEGACY_RAW_TEX_RE.finditer(s):
+        out.append(plain(s[last:m.start()]))
+        out.append(f"[[{m.group(1)}]]")
+        last = m.end()
+    out.append(plain(s[last:]))
+    return "".join(out)
+
+
+def load_cell_corpus(paths: list[Path]) -> list[Any]:
+    """サンプルExcelの全シートから、A列にタグがある行の B列以降の値を集める。"""
+    import openpyxl
+
+    corpus: list[Any] = []
+    for path in paths:
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        for ws in wb.worksheets:
+            for row in ws.iter_rows(values_only=True):
+                if not row or not row[0]:
+                    continue
+                corpus.extend(v for v in row[1:] if isinstance(v, str))
+        wb.close()
+    return corpus
+
+
+def bench_conv(args: argparse.Namespace) -> None:
+    import texconv
+
+    paths = [Path(p) for p in args.excel] if args.excel else sorted(
+        [EXAMTOOLS_ROOT / "input" / "試験問題.xlsx", *(EXAMTOOLS_ROOT / "testwork").glob("*.xlsx")]
+    )
+    corpus = load_cell_corpus([p for p in paths if p.exists()])
+
+    # make_json は版ごとに全セルを変換するので、版の数だけ繰り返す
+    cells = corpus * args.versions
+    same = all(_legacy_conv_text(v) == texconv.conv_text(v) for v in corpus)
+
+    def run_new_cold() -> None:
+        texconv._conv_text_str.cache_clear()
+        for v in cells:
+            texconv.conv_text(v)
+
+    def run_new_warm() -> None:
+        for v in cells:
+            texconv.conv_text(v)
+
+    legacy = timeit(lambda: [_legacy_conv_text(v) for v in cells], args.repeat)
+    cold = timeit(run_new_cold, args.repeat)
+    warm = timeit(run_new_warm, args.repeat)
+    info = texconv._conv_text_str.cache_info()
+
+    print(f"corpus: {len(corpus)} cells x {args.versions} versions, unique {len(set(corpus))}, same={same}")
+    print_row("implementation", "time[s]", "speedup")
+    print_row("legacy", f"{legacy:.4f}", "1.0x")
+    print_row("texconv (memo cleared)", f"{cold:.4f}", f"{legacy / cold:.1f}x")
+    print_row("texconv (memo warm)", f"{warm:.4f}", f"{legacy / warm:.1f}x")
+    print(f"memo: {info.currsize}/{info.maxsize}")
+
+
+# ============================================================
+# escape: texescape（旧実装3つとの差分テストと速度）
+# ============================================================
+_LEGACY_LATEX_REP = {"&": r"\&", "%": r"\%", "#": r"\#", "_": r"\_", "{": r"\{", "}": r"\}"}
+
+
+def _legacy_latex_escape_core(text: str) -> str:
+    """比較用：texescape 導入前の make_latex._latex_escape_core（1文字ずつ走査）。"""
+    out: list[str] = []
+    i = 0
+    in_math = False
+    end_token: str | None = None
+    while i < len(text):
+        if not in_math:
+            if text.startswith(r"\(", i) or text.startswith(r"\[", i):
+                in_math = True
+                end_token = r"\)" if text[i + 1] == "(" else r"\]"
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            ch = text[i]
+            prev = text[i - 1] if i > 0 else ""
+            if ch in _LEGACY_LATEX_REP:
+                out.append(ch if prev == "\\" else _LEGACY_LATEX_REP[ch])
+            elif ch == "~":
+                out.append(ch if prev == "\\" else r"\textasciitilde{}")
+            elif ch == "^":
+                out.append(ch if prev == "\\" else r"\textasciicircum{}")
+            else:
+                out.append(ch)
+            i += 1
+        else:
+            if end_token and text.startswith(end_token, i):
+                in_math = False
+                out.append(end_token)
+                i += 2
+                end_token = None
+                continue
+            out.append(text[i])
+            i += 1
+    return "".join(out)
+
+
+def _legacy_latex_escape(s: Any) -> str:
+    """比較用：texescape 導入前の make_latex.latex_escape。"""
+    if s is None:
+        return ""
+    text = str(s)
+    out = []
+    last = 0
+    for m in _LEGACY_RAW_TEX_RE.finditer(text):
+        out.append(_legacy_latex_escape_core(text[last:m.start()]))
+        out.append(m.group(1))
+        last = m.end()
+    out.append(_legacy_latex_escape_core(text[last:]))
+    return "".join(out)
+
+
+def _legacy_latex_escape_plain(s: Any) -> str:
+    """比較用：texescape 導入前の makelatexv2.latex_escape。"""
+    if s is None:
+        return ""
+    rep = dict(_LEGACY_LATEX_REP, **{"~": r"\textasciitilde{}", "^": r"\textasciicircum{}"})
+    return "".join(rep.get(ch, ch) for ch in str(s))
+
+
+def random_tex_strings(n: int, *, seed: int = 0) -> list[str]:
+    """数式の開き閉じ・エスケープ済み文字・[[ ]] が偏って出る乱数文字列。"""
+    rng = random.Random(seed)
+    pieces = ["a", "あ", " ", "\\", "(", ")", "[", "]", "\\(", "\\)", "\\[", "\\]", "[[", "]]",
+              "{", "}", "&", "%", "#", "_", "~", "^", "\\{", "\\_", "\\\\", "x^2", "\n"]
+    return ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 30))) for _ in range(n)]
+
+
+def bench_escape(args: argparse.Namespace) -> None:
+    import texescape
+
+    paths = sorted([EXAMTOOLS_ROOT / "input" / "試験問題.xlsx", *(EXAMTOOLS_ROOT / "testwork").glob("*.xlsx")])
+    corpus = load_cell_corpus([p for p in paths if p.exists()])
+    # 本文に出てくるのは conv_text 後の文字列
+    from texconv import conv_text
+    corpus = [conv_text(v) for v in corpus] + random_tex_strings(args.random)
+
+    cases = [
+        ("make_latex.latex_escape", _legacy_latex_escape, texescape.latex_escape),
+        ("texconv escape {}&", _legacy_escape_tex_outside_inline_math, texescape.escape_tex_outside_inline_math),
+        ("makelatexv2.latex_escape", _legacy_latex_escape_plain, texescape.latex_escape_plain),
+    ]
+    total = sum(len(v) for v in corpus)
+    print(f"corpus: {len(corpus)} strings, {total} chars")
+    print_row("escaper", "legacy[s]", "texescape[s]", "speedup", "diffs")
+    for name, legacy_fn, new_fn in cases:
+        diffs = sum(1 for v in corpus if legacy_fn(v) != new_fn(v))
+        legacy = timeit(lambda: [legacy_fn(v) for v in corpus], args.repeat)
+        new = timeit(lambda: [new_fn(v) for v in corpus], args.repeat)
+        print_row(name, f"{legacy:.4f}", f"{new:.4f}", f"{legacy / new:.1f}x", diffs)
+
+
+# ============================================================
+# preamble: 機能ごとのプリアンブル（make_pdf の \ExamFeatures）でのコンパイル時間
+# ============================================================
+def _lualatex_seconds(tex_path: Path, env: dict[str, str], repeat: int) -> float | None:
+    """lualatex 1回分の最速の秒数。失敗したら None。"""
+    import subprocess
+
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        t0 = time.perf_counter()
+        r = subprocess.run(
+            ["lualatex", "-interaction=nonstopmode", "-halt-on-error", tex_path.name],
+            cwd=str(tex_path.parent),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if r.returncode != 0:
+            return None
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench_preamble(args: argparse.Namespace) -> None:
+    import os
+    import shutil
+    import tempfile
+
+    from exam_model import FEATURES, build_exam_version, exam_features
+    from make_latex import render_version_tex
+    from make_pdf import get_body_tex_features, latex_env, merge_main_tex
+
+    if shutil.which("lualatex") is None:
+        print("lualatex が見つからないので計測できません。")
+        return
+
+    env = latex_env()
+    if args.body:
+        # make_latex が書いた body.tex（q/ の断片はそのフォルダから TEXINPUTS で読む）
+        body_path = Path(args.body).resolve()
+        body_text = body_path.read_text(encoding="utf-8")
+        body_features = get_body_tex_features(body_path)
+        env["TEXINPUTS"] = os.pathsep.join([str(body_path.parent), env["TEXINPUTS"]])
+    else:
+        ev = build_exam_version(make_render_block(args.elements))
+        body_text = render_version_tex(ev, include_cover=True)
+        body_features = exam_features(ev)
+    graphicspath = (Path(args.images).resolve().as_posix() + "/") if args.images else "./"
+
+    sets: list[tuple[str, tuple[str, ...] | None]] = [("(全部)", None), ("(なし)", ())]
+    sets += [(f, (f,)) for f in FEATURES]
+    if body_features is not None:
+        sets.append((f"body: {','.join(body_features) or '-'}", body_features))
+
+    print(f"body の機能: {','.join(body_features) if body_features is not None else '不明（全部読む）'}")
+    print_row("features", "empty[s]", "body[s]")
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(tmp)
+        (work / "bench_body.tex").write_text(body_text, encoding="utf-8")
+        for label, features in sets:
+            empty = work / "empty.tex"
+            empty.write_text(merge_main_tex("", graphicspath, "", features), encoding="utf-8")
+            t_empty = _lualatex_seconds(empty, env, args.repeat)
+
+            # body が使う機能が全部入っている組み合わせだけ body 込みで計測する
+            t_body = None
+            if features is None or (body_features is not None and set(body_features) <= set(features)):
+                full = work / "full.tex"
+                full.write_text(merge_main_tex(r"\input{bench_body.tex}", graphicspath, "", features), encoding="utf-8")
+                t_body = _lualatex_seconds(full, env, args.repeat)
+
+            print_row(
+                label,
+                "失敗" if t_empty is None else f"{t_empty:.3f}",
+                "-" if t_body is None else f"{t_body:.3f}",
+            )
+
+
+# ============================================================
+# main
+# ============================================================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="examtools の処理速度を合成データで計測します。")
+    parser.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数（最速値を表示）")
+    sub = parser.add_subparsers(dest="target", required=True)
+
+    p = sub.add_parser("validate", help="validate_question_columns（qid/orderB チェック）")
+    p.add_argument("--questions", type=int, nargs="+", default=[1000, 5000, 10000])
+    p.add_argument("--dup-every", type=int, default=50, help="この間隔で qid/orderB を重複させる（0で重複なし）")
+    p.set_defaults(func=bench_validate)
+
+    p = sub.add_parser("shuffle", help="fill_shuffle_for_sheet（版別の選択肢シャッフル）")
+    p.add_argument("--questions", type=int, default=2000)
+    p.add_argument("--choices", type=int, default=5)
+    p.add_argument("--versions", type=int, nargs="+", default=[1, 9], help="A以外の版の数")
+    p.add_argument("--seed", default=None)
+    p.set_defaults(func=bench_shuffle)
+
+    p = sub.add_parser("json", help="make_json の数式退避・normalize・validate（4回走査と1回走査）")
+    p.add_argument("--elements", type=int, nargs="+", default=[1000, 10000])
+    p.add_argument("--versions", type=int, default=2)
+    p.set_defaults(func=bench_json)
+
+    p = sub.add_parser("contract", help="contract.validate_document（旧実装とコンパイル版の比較）")
+    p.add_argument("--elements", type=int, nargs="+", default=[10000, 50000])
+    p.add_argument("--versions", type=int, default=2)
+    p.add_argument("--no-strict", dest="strict", action="store_false", help="strict=False で計測する")
+    p.set_defaults(func=bench_contract)
+
+    p = sub.add_parser("model", help="exam_model（dict と型付きモデルのメモリ・LaTeX 生成時間）")
+    p.add_argument("--elements", type=int, nargs="+", default=[10000, 50000])
+    p.set_defaults(func=bench_model)
+
+    p = sub.add_parser("escape", help="texescape（旧実装3つとの差分テストと速度）")
+    p.add_argument("--random", type=int, default=20000, help="コーパスに足す乱数文字列の数")
+    p.set_defaults(func=bench_escape)
+
+    p = sub.add_parser("conv", help="conv_text（texconv と旧実装の比較）")
+    p.add_argument("--excel", nargs="*", default=None, help="コーパスに使うExcel（省略時は input/ と testwork/ のサンプル）")
+    p.add_argument("--versions", type=int, default=2, help="変換を繰り返す版の数")
+    p.set_defaults(func=bench_conv)
+
+    p = sub.add_parser("preamble", help="機能ごとのプリアンブル（code/premise/math/image/ruby）での lualatex 1回の時間")
+    p.add_argument("--body", default=None, help="make_latex が書いた body.tex（省略時は合成データの1版）")
+    p.add_argument("--elements", type=int, default=200, help="合成データの要素数（--body が無いとき）")
+    p.add_argument("--images", default=None, help="body の \\image が参照する画像フォルダ")
+    p.set_defaults(func=bench_preamble)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
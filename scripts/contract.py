@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import re
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 
 class ContractError(ValueError):
@@ -184,155 +184,294 @@ def normalize_document(doc: Any) -> List[Problem]:
 
 # -----------------------------------------------------------------------------
 # Validation
+#
+# CONTRACT is compiled once into one validator closure per type, with the
+# key sets precomputed as frozensets and the problem messages preformatted.
+# Validators append raw (level, src, message) tuples; `src` is _ELEM_LOC for
+# the element's own location, or an option's src. Problem objects (and the
+# location strings) are only built for elements that actually have problems.
 # -----------------------------------------------------------------------------
 
+_ELEM_LOC = object()
+
+_META_KEYS = frozenset(("tag", "src"))
+
+RawProblem = Tuple[str, Any, str]
+Validator = Callable[[Dict[str, Any], bool, bool, List[RawProblem]], None]
+
+
+def _check_text(etype: str, elem: Dict[str, Any], strict: bool, out: List[RawProblem]) -> None:
+    if "value" in elem and not isinstance(elem["value"], str):
+        out.append(("ERROR", _ELEM_LOC, f"{etype}: value must be string"))
+
+
+def _check_choices(etype: str, elem: Dict[str, Any], strict: bool, out: List[RawProblem]) -> None:
+    style = elem.get("style")
+    if style not in ("normal", "inline"):
+        # allow 'inline(8)' before normalization
+        if not (isinstance(style, str) and _STYLE_INLINE_RE.match(style)):
+            out.append(("ERROR", _ELEM_LOC, "choices: style must be 'normal' or 'inline'"))
+
+    values = elem.get("values")
+    if not _is_non_empty_list(values):
+        out.append(("ERROR", _ELEM_LOC, "choices: values must be non-empty list"))
+    else:
+        for idx, opt in enumerate(values):
+            if not isinstance(opt, dict):
+                out.append(("ERROR", _ELEM_LOC, f"choices: option[{idx}] must be object"))
+                continue
+            opt_src = opt["src"] if "src" in opt else _ELEM_LOC
+            text = opt.get("text")
+            if not isinstance(text, str) or not text:
+                out.append(("ERROR", opt_src, f"choices: option[{idx}] missing text"))
+            # label is recommended; in strict mode require it
+            if strict:
+                label = opt.get("label")
+                if not isinstance(label, str) or not label:
+                    out.append(("ERROR", opt_src, f"choices: option[{idx}] missing label"))
+            # meta on option is recommended; warn only
+            if opt_src is _ELEM_LOC:
+                out.append(("WARN", _ELEM_LOC, f"choices: option[{idx}] missing src"))
+
+    if "sep" in elem:
+        if _as_int(elem["sep"]) is None:
+            out.append(("ERROR", _ELEM_LOC, "choices: sep must be int"))
+
+
+def _check_string_list(key: str):
+    def check(etype: str, elem: Dict[str, Any], strict: bool, out: List[RawProblem]) -> None:
+        values = elem.get(key)
+        if not _is_non_empty_list(values):
+            out.append(("ERROR", _ELEM_LOC, f"{etype}: {key} must be non-empty list"))
+            return
+        for i, v in enumerate(values):
+            if not isinstance(v, str):
+                out.append(("ERROR", _ELEM_LOC, f"{etype}: {key}[{i}] is not string"))
+                return
+    return check
 
-def validate_element(elem: Dict[str, Any], strict: bool = False, warn_unknown_keys: bool = False) -> List[Problem]:
-    """Validate a single element against the contract.
 
-    Returns a list of Problem (WARN/ERROR). In strict mode, some WARN become ERROR.
-    """
-    problems: List[Problem] = []
-    etype = elem.get("type")
-    loc = element_loc(elem)
+_check_lines = _check_string_list("lines")
+_check_values = _check_string_list("values")
 
-    if not isinstance(etype, str) or not etype:
-        problems.append(Problem("ERROR", loc, "missing or invalid element type"))
-        return problems
-
-    spec = CONTRACT.get(etype)
-    if spec is None:
-        level = "ERROR" if strict else "WARN"
-        problems.append(Problem(level, loc, f"unknown element type: '{etype}'"))
-        return problems
-
-    # meta requirement
-    if spec.require_meta and etype not in META_TYPES_NO_SRC:
-        for k in COMMON_META_REQUIRED:
+
+def _check_code(etype: str, elem: Dict[str, Any], strict: bool, out: List[RawProblem]) -> None:
+    _check_lines(etype, elem, strict, out)
+    if "linenumber" in elem and not isinstance(elem["linenumber"], bool):
+        out.append(("ERROR", _ELEM_LOC, "code: linenumber must be boolean"))
+
+
+def _check_premise(etype: str, elem: Dict[str, Any], strict: bool, out: List[RawProblem]) -> None:
+    if not isinstance(elem.get("content"), list):
+        out.append(("ERROR", _ELEM_LOC, "premise: content must be list"))
+
+
+def _check_image(etype: str, elem: Dict[str, Any], strict: bool, out: List[RawProblem]) -> None:
+    path = elem.get("path")
+    if path is not None and not isinstance(path, str):
+        out.append(("ERROR", _ELEM_LOC, "image: path must be string"))
+    if "width" in elem and not isinstance(elem["width"], (int, float)):
+        out.append(("ERROR", _ELEM_LOC, "image: width must be number"))
+
+
+def _check_vspace(etype: str, elem: Dict[str, Any], strict: bool, out: List[RawProblem]) -> None:
+    if "value_mm" in elem:
+        if _as_int(elem["value_mm"]) is None:
+            out.append(("ERROR", _ELEM_LOC, "vspace: value_mm must be int"))
+
+
+# per-type constraints (beyond required/optional keys)
+TYPE_CHECKS: Dict[str, Callable[[str, Dict[str, Any], bool, List[RawProblem]], None]] = {
+    "text": _check_text,
+    "sline": _check_text,
+    "choices": _check_choices,
+    "code": _check_code,
+    "multiline": _check_values,
+    "preline": _check_values,
+    "premise": _check_premise,
+    "image": _check_image,
+    "vspace": _check_vspace,
+}
+
+
+def compile_spec(etype: str, spec: TypeSpec) -> Validator:
+    """Compile one TypeSpec into a validator closure."""
+    # same iteration order as the set itself, fixed once per process
+    meta_keys = tuple(COMMON_META_REQUIRED) if spec.require_meta and etype not in META_TYPES_NO_SRC else ()
+    meta_msgs = {k: f"{etype}: missing meta key: {k}" for k in meta_keys}
+    required = spec.required
+    required_msgs = {k: f"{etype}: missing required key: {k}" for k in required}
+    allowed = frozenset(spec.required) | frozenset(spec.optional) | _META_KEYS
+    check_unknown = spec.warn_unknown_keys
+    type_check = TYPE_CHECKS.get(etype)
+
+    def validate(elem: Dict[str, Any], strict: bool, warn_unknown_keys: bool, out: List[RawProblem]) -> None:
+        soft = "ERROR" if strict else "WARN"
+
+        # meta requirement
+        for k in meta_keys:
             if k not in elem:
-                problems.append(Problem("ERROR" if strict else "WARN", loc, f"{etype}: missing meta key: {k}"))
-
-    # required keys
-    for k in spec.required:
-        if k not in elem:
-            problems.append(Problem("ERROR", loc, f"{etype}: missing required key: {k}"))
-
-    # unknown keys
-    if warn_unknown_keys and spec.warn_unknown_keys:
-        allowed = set(spec.required) | set(spec.optional) | {"tag", "src"}
-        for k in elem.keys():
-            if k not in allowed:
-                level = "ERROR" if strict else "WARN"
-                problems.append(Problem(level, loc, f"{etype}: unknown key: {k}"))
-
-    # per-type constraints
-    if etype in ("text", "sline"):
-        if "value" in elem and not isinstance(elem["value"], str):
-            problems.append(Problem("ERROR", loc, f"{etype}: value must be string"))
+                out.append((soft, _ELEM_LOC, meta_msgs[k]))
 
-    if etype == "choices":
-        style = elem.get("style")
-        if style not in ("normal", "inline"):
-            # allow 'inline(8)' before normalization
-            if not (isinstance(style, str) and _STYLE_INLINE_RE.match(style)):
-                problems.append(Problem("ERROR", loc, "choices: style must be 'normal' or 'inline'"))
+        # required keys
+        for k in required:
+            if k not in elem:
+                out.append(("ERROR", _ELEM_LOC, required_msgs[k]))
 
-        values = elem.get("values")
-        if not _is_non_empty_list(values):
-            problems.append(Problem("ERROR", loc, "choices: values must be non-empty list"))
-        else:
-            for idx, opt in enumerate(values):
-                opt_loc = loc
-                if isinstance(opt, dict) and "src" in opt:
-                    opt_loc = loc_from_src(opt["src"])
-                if not isinstance(opt, dict):
-                    problems.append(Problem("ERROR", opt_loc, f"choices: option[{idx}] must be object"))
-                    continue
-                if "text" not in opt or not isinstance(opt.get("text"), str) or not opt.get("text"):
-                    problems.append(Problem("ERROR", opt_loc, f"choices: option[{idx}] missing text"))
-                # label is recommended; in strict mode require it
-                if strict:
-                    if "label" not in opt or not isinstance(opt.get("label"), str) or not opt.get("label"):
-                        problems.append(Problem("ERROR", opt_loc, f"choices: option[{idx}] missing label"))
-                # meta on option is recommended; warn only
-                if "src" not in opt:
-                    problems.append(Problem("WARN", opt_loc, f"choices: option[{idx}] missing src"))
-
-        if "sep" in elem:
-            if _as_int(elem["sep"]) is None:
-                problems.append(Problem("ERROR", loc, "choices: sep must be int"))
-
-    if etype == "code":
-        lines = elem.get("lines")
-        if not _is_non_empty_list(lines):
-            problems.append(Problem("ERROR", loc, "code: lines must be non-empty list"))
-        else:
-            bad = [i for i, s in enumerate(lines) if not isinstance(s, str)]
-            if bad:
-                problems.append(Problem("ERROR", loc, f"code: lines[{bad[0]}] is not string"))
-        if "linenumber" in elem and not isinstance(elem["linenumber"], bool):
-            problems.append(Problem("ERROR", loc, "code: linenumber must be boolean"))
-
-    if etype == "multiline":
-        values = elem.get("values")
-        if not _is_non_empty_list(values):
-            problems.append(Problem("ERROR", loc, "multiline: values must be non-empty list"))
-        else:
-            bad = [i for i, s in enumerate(values) if not isinstance(s, str)]
-            if bad:
-                problems.append(Problem("ERROR", loc, f"multiline: values[{bad[0]}] is not string"))
+        # unknown keys
+        if warn_unknown_keys and check_unknown and not allowed.issuperset(elem):
+            for k in elem:
+                if k not in allowed:
+                    out.append((soft, _ELEM_LOC, f"{etype}: unknown key: {k}"))
 
-    if etype == "preline":
-        values = elem.get("values")
-        if not _is_non_empty_list(values):
-            problems.append(Problem("ERROR", loc, "preline: values must be non-empty list"))
-        else:
-            bad = [i for i, s in enumerate(values) if not isinstance(s, str)]
-            if bad:
-                problems.append(Problem("ERROR", loc, f"preline: values[{bad[0]}] is not string"))
-
-    if etype == "premise":
-        content = elem.get("content")
-        if not isinstance(content, list):
-            problems.append(Problem("ERROR", loc, "premise: content must be list"))
-
-    if etype == "image":
-        path = elem.get("path")
-        if path is not None and not isinstance(path, str):
-            problems.append(Problem("ERROR", loc, "image: path must be string"))
-        if "width" in elem and not isinstance(elem["width"], (int, float)):
-            problems.append(Problem("ERROR", loc, "image: width must be number"))
+        if type_check is not None:
+            type_check(etype, elem, strict, out)
 
-    if etype == "vspace":
-        if "value_mm" in elem:
-            if _as_int(elem["value_mm"]) is None:
-                problems.append(Problem("ERROR", loc, "vspace: value_mm must be int"))
+    return validate
 
-    return problems
 
+_VALIDATORS: Dict[str, Validator] = {}
 
-def validate_document(doc: Any, strict: bool = False, warn_unknown_keys: bool = False) -> List[Problem]:
+
+def compile_contract() -> None:
+    """(Re)compile CONTRACT. Call again after changing CONTRACT at runtime."""
+    _VALIDATORS.clear()
+    for etype, spec in CONTRACT.items():
+        _VALIDATORS[etype] = compile_spec(etype, spec)
+
+
+compile_contract()
+
+
+def _to_problems(elem: Dict[str, Any], raw: List[RawProblem]) -> List[Problem]:
+    loc = element_loc(elem)
+    return [Problem(level, loc if src is _ELEM_LOC else loc_from_src(src), msg) for level, src, msg in raw]
+
+
+def validate_element(elem: Dict[str, Any], strict: bool = False, warn_unknown_keys: bool = False) -> List[Problem]:
+    """Validate a single element against the contract.
+
+    Returns a list of Problem (WARN/ERROR). In strict mode, some WARN become ERROR.
+    """
+    etype = elem.get("type")
+
+    if not isinstance(etype, str) or not etype:
+        return [Problem("ERROR", element_loc(elem), "missing or invalid element type")]
+
+    validator = _VALIDATORS.get(etype)
+    if validator is None:
+        spec = CONTRACT.get(etype)
+        if spec is None:
+            level = "ERROR" if strict else "WARN"
+            return [Problem(level, element_loc(elem), f"unknown element type: '{etype}'")]
+        validator = _VALIDATORS[etype] = compile_spec(etype, spec)
+
+    raw: List[RawProblem] = []
+    validator(elem, strict, warn_unknown_keys, raw)
+    if not raw:
+        return []
+    return _to_problems(elem, raw)
+
+
+def _raise_errors(problems: List[Problem]) -> None:
+    raise ContractError("\n".join(str(p) for p in problems if p.level == "ERROR"))
+
+
+def validate_document(
+    doc: Any,
+    strict: bool = False,
+    warn_unknown_keys: bool = False,
+    *,
+    fail_fast: bool = False,
+) -> List[Problem]:
     """Validate the whole JSON document.
 
-    - Walks recursively and validates every dict that has a 'type' key.
+    - Walks iteratively (pre-order) and validates every dict that has a 'type' key.
     - Returns all Problems.
     - Raises ContractError if any ERROR exists.
+    - fail_fast=True raises at the first element with an ERROR, reporting only
+      that element's errors.
     """
     problems: List[Problem] = []
 
-    def walk(node: Any) -> None:
+    stack: List[Any] = [doc]
+    while stack:
+        node = stack.pop()
         if isinstance(node, dict):
             if "type" in node:
-                problems.extend(validate_element(node, strict=strict, warn_unknown_keys=warn_unknown_keys))
-            for v in node.values():
-                walk(v)
+                found = validate_element(node, strict=strict, warn_unknown_keys=warn_unknown_keys)
+                if found:
+                    if fail_fast and any(p.level == "ERROR" for p in found):
+                        _raise_errors(found)
+                    problems.extend(found)
+            children = node.values()
         elif isinstance(node, list):
-            for it in node:
-                walk(it)
-
-    walk(doc)
+            children = node
+        else:
+            continue
+        stack.extend(reversed([v for v in children if isinstance(v, (dict, list))]))
 
-    has_error = any(p.level == "ERROR" for p in problems)
-    if has_error:
-        raise ContractError("\n".join(str(p) for p in problems if p.level == "ERROR"))
+    if any(p.level == "ERROR" for p in problems):
+        _raise_errors(problems)
     return problems
+
+
+# -----------------------------------------------------------------------------
+# Fused normalize + validate (single traversal)
+# -----------------------------------------------------------------------------
+
+
+def process_document(
+    doc: Any,
+    strict: bool = False,
+    warn_unknown_keys: bool = False,
+    *,
+    before_normalize: Optional[Callable[[Dict[str, Any]], None]] = None,
+    after_normalize: Optional[Callable[[Dict[str, Any]], None]] = None,
+    fail_fast: bool = False,
+) -> List[Problem]:
+    """Normalize and validate the whole JSON document in one traversal.
+
+    Equivalent to ``normalize_document(doc)`` followed by
+    ``validate_document(doc, strict, warn_unknown_keys)``, but each element is
+    normalized and validated while it is visited (pre-order, same order as the
+    two separate walks), so the tree is walked only once.
+
+    - before_normalize / after_normalize are called on each element around
+      normalize_element (e.g. to protect and restore math segments).
+    - Returns normalize Problems followed by validate Problems.
+    - Raises ContractError if any validation ERROR exists (fail_fast: at the
+      first element with an ERROR, as in validate_document).
+    """
+    norm_problems: List[Problem] = []
+    val_problems: List[Problem] = []
+
+    stack: List[Any] = [doc]
+    pop = stack.pop
+    push = stack.extend
+    while stack:
+        node = pop()
+        if isinstance(node, dict):
+            if "type" in node:
+                if before_normalize is not None:
+                    before_normalize(node)
+                normalize_element(node, norm_problems)
+                if after_normalize is not None:
+                    after_normalize(node)
+                found = validate_element(node, strict=strict, warn_unknown_keys=warn_unknown_keys)
+                if found:
+                    if fail_fast and any(p.level == "ERROR" for p in found):
+                        _raise_errors(found)
+                    val_problems.extend(found)
+            children = [v for v in node.values() if isinstance(v, (dict, list))]
+        elif isinstance(node, list):
+            children = [v for v in node if isinstance(v, (dict, list))]
+        else:
+            continue
+        # 逆順に積んで、元の再帰と同じ pre-order で訪問する
+        children.reverse()
+        push(children)
+
+    if any(p.level == "ERROR" for p in val_problems):
+        _raise_errors(val_problems)
+    return norm_problems + val_problems
@@ -0,0 +1,408 @@
+# scripts/exam_model.py
+"""
+試験 JSON（v2, canonical）の型付きモデル（make_latex.py / make_word.py 共通）。
+
+版ごとの questions を一度だけ走査して __slots__ 付き dataclass に変換する。
+  - 既定値の補完と型の強制（mm の int 化、linenumber の bool 化、
+    choices の sep / inline 判定、image の width など）はここで済ませる
+  - レンダラは .get の連鎖や _boolish / _get_mm を繰り返さず、属性を読むだけにする
+  - 要素ごとの dict より小さいので、大きな試験や問題バンクでもメモリが減る
+
+src はトレース用に JSON の dict をそのまま参照する（コピーしない）。
+
+exam_features は版が使っている機能（code / premise / math / image / ruby）を返す。
+make_latex が body.tex の冒頭に書き、make_pdf はそれを見て必要なプリアンブルだけを読む。
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Any, Iterable, Union
+
+
+# ============================================================
+# 要素
+# ============================================================
+@dataclass(slots=True)
+class Element:
+    type: str
+    tag: str = "?"
+    src: Any = None
+
+
+@dataclass(slots=True)
+class Text(Element):
+    """text / sline。value が無い旧形式は values（行のリスト）。"""
+    value: str | None = None
+    values: tuple[str, ...] = ()
+
+
+@dataclass(slots=True)
+class Lines(Element):
+    """multiline / preline"""
+    values: tuple[str, ...] = ()
+
+
+@dataclass(slots=True)
+class Code(Element):
+    lines: tuple[str, ...] = ()
+    linenumber: bool = False
+
+
+@dataclass(slots=True)
+class ChoiceItem:
+    label: str = ""
+    text: str = ""
+    tag: str = "?"
+    src: Any = None
+
+
+@dataclass(slots=True)
+class Choices(Element):
+    inline: bool = False
+    sep: int | None = None
+    options: tuple[ChoiceItem, ...] = ()
+
+
+@dataclass(slots=True)
+class Image(Element):
+    path: str = ""
+    # None は「指定なし/数値でない」。既定の幅はレンダラごとに決める
+    width: float | None = None
+
+
+@dataclass(slots=True)
+class VSpace(Element):
+    mm: int = 0
+
+
+@dataclass(slots=True)
+class PageBreak(Element):
+    pass
+
+
+@dataclass(slots=True)
+class Premise(Element):
+    title: str = ""
+    content: tuple["Node", ...] = ()
+
+
+@dataclass(slots=True)
+class Unknown(Element):
+    """未対応の type。Word では中身をそのまま表示するので元の dict を持つ。"""
+    data: dict[str, Any] | None = None
+
+
+@dataclass(slots=True)
+class Stray:
+    """content に紛れ込んだ dict 以外の値"""
+    value: Any
+
+
+# ============================================================
+# 問題・表紙・版
+# ============================================================
+@dataclass(slots=True)
+class Cover:
+    title: str = ""
+    subject: str = ""
+    fsyear: str = ""
+    notes: tuple[str, ...] = ()
+    tag: str = "?"
+    src: Any = None
+
+
+@dataclass(slots=True)
+class SubQuestion:
+    number: Any = ""
+    question: str = ""
+    content: tuple["Node", ...] = ()
+    tag: str = "?"
+    src: Any = None
+
+
+@dataclass(slots=True)
+class Question:
+    qid: Any = ""
+    number: Any = ""
+    question: str = ""
+    content: tuple["Node", ...] = ()
+    subquestions: tuple[Union[SubQuestion, VSpace, PageBreak], ...] = ()
+    tag: str = "?"
+    src: Any = None
+
+
+@dataclass(slots=True)
+class ExamVersion:
+    version: str
+    metainfo: dict[str, Any]
+    questions: tuple["TopNode", ...]
+
+
+Node = Union[Element, Stray]
+TopNode = Union[Cover, Question, Element]
+
+
+# ============================================================
+# 変換（dict -> モデル）
+# ============================================================
+def _str(v: Any) -> str:
+    return "" if v is None else str(v)
+
+
+def _as_mm(item: dict[str, Any], key_primary: str, key_fallback: str | None = None, default: int = 0) -> int:
+    """mm を int で読む。旧形式の float / 文字列も int に丸める。"""
+    v = item.get(key_primary)
+    if v is None and key_fallback:
+        v = item.get(key_fallback)
+    if v is None:
+        return default
+    try:
+        # "8", 8.0 なども許す
+        return int(round(float(v)))
+    except Exception:
+        return default
+
+
+def _boolish(x: Any) -> bool:
+    if isinstance(x, bool):
+        return x
+    if isinstance(x, (int, float)):
+        return x != 0
+    if isinstance(x, str):
+        return x.strip().lower() in ("1", "true", "yes", "y", "on")
+    return False
+
+
+def _str_tuple(v: Any) -> tuple[str, ...]:
+    if not isinstance(v, list):
+        return ()
+    return tuple(_str(x) for x in v)
+
+
+def _choice_item(v: Any) -> ChoiceItem:
+    if isinstance(v, dict):
+        return ChoiceItem(
+            label=_str(v.get("label", "")),
+            text=_str(v.get("text", "")),
+            tag=str(v.get("tag", "select")),
+            src=v.get("src", {}),
+        )
+    # 文字列だけの選択肢（旧形式）
+    return ChoiceItem(text=str(v))
+
+
+def _build_text(t: str, tag: str, src: Any, d: dict[str, Any]) -> Text:
+    value = d.get("value")
+    if isinstance(value, str):
+        return Text(t, tag, src, value=value)
+    return Text(t, tag, src, values=_str_tuple(d.get("values")))
+
+
+def _build_lines(t: str, tag: str, src: Any, d: dict[str, Any]) -> Lines:
+    return Lines(t, tag, src, values=_str_tuple(d.get("values")))
+
+
+def _build_code(t: str, tag: str, src: Any, d: dict[str, Any]) -> Code:
+    return Code(t, tag, src, lines=_str_tuple(d.get("lines")), linenumber=_boolish(d.get("linenumber")))
+
+
+def _build_choices(t: str, tag: str, src: Any, d: dict[str, Any]) -> Choices:
+    values = d.get("values")
+    options = tuple(_choice_item(v) for v in values) if isinstance(values, list) else ()
+
+    inline = d.get("style", "normal") == "inline"
+    sep = None
+    if inline:
+        # 旧名 space -> sep。数値にならなければ付けない（検証側で弾かれている）
+        raw = d.get("sep")
+        if raw is None:
+            raw = d.get("space")
+        if raw is not None:
+            try:
+                sep = int(round(float(raw)))
+            except Exception:
+                sep = None
+    return Choices(t, tag, src, inline=inline, sep=sep, options=options)
+
+
+def _build_image(t: str, tag: str, src: Any, d: dict[str, Any]) -> Image:
+    width = d.get("width")
+    try:
+        width = None if width is None else float(width)
+    except Exception:
+        width = None
+    return Image(t, tag, src, path=_str(d.get("path")), width=width)
+
+
+def _build_vspace(t: str, tag: str, src: Any, d: dict[str, Any]) -> VSpace:
+    return VSpace(t, tag, src, mm=_as_mm(d, "value_mm", key_fallback="value", default=0))
+
+
+def _build_pagebreak(t: str, tag: str, src: Any, d: dict[str, Any]) -> PageBreak:
+    return PageBreak(t, tag, src)
+
+
+def _build_premise(t: str, tag: str, src: Any, d: dict[str, Any]) -> Premise:
+    return Premise(t, tag, src, title=_str(d.get("title")), content=build_content(d.get("content")))
+
+
+_BUILDERS = {
+    "text": _build_text,
+    "sline": _build_text,
+    "multiline": _build_lines,
+    "preline": _build_lines,
+    "code": _build_code,
+    "choices": _build_choices,
+    "image": _build_image,
+    "subimage": _build_image,
+    "vspace": _build_vspace,
+    "pagebreak": _build_pagebreak,
+    "premise": _build_premise,
+}
+
+
+def build_element(d: Any) -> Node:
+    if not isinstance(d, dict):
+        return Stray(d)
+    t = d.get("type")
+    tag = str(d.get("tag", "?"))
+    src = d.get("src")
+    builder = _BUILDERS.get(t)
+    if builder is None:
+        return Unknown(str(d.get("type", "?")), tag, src, data=d)
+    return builder(t, tag, src, d)
+
+
+def build_content(items: Any) -> tuple[Node, ...]:
+    if not isinstance(items, list):
+        return ()
+    return tuple(build_element(x) for x in items)
+
+
+def build_cover(d: dict[str, Any]) -> Cover:
+    notes = d.get("notes")
+    if notes is None:
+        notes = d.get("instruction")  # 旧名
+    if isinstance(notes, list):
+        note_lines = tuple(_str(x) for x in notes)
+    else:
+        note_lines = tuple(_str(notes).splitlines())
+
+    return Cover(
+        title=_str(d.get("title")),
+        subject=_str(d.get("subject")),
+        fsyear=_str(d.get("fsyear")),
+        notes=note_lines,
+        tag=str(d.get("tag", "?")),
+        src=d.get("src"),
+    )
+
+
+def build_subquestion(d: dict[str, Any]) -> SubQuestion | VSpace | PageBreak:
+    # subquestions の中の vspace / pagebreak（制御だけ）
+    if d.get("type") in ("vspace", "pagebreak"):
+        return build_element(d)
+    return SubQuestion(
+        number=d.get("number", ""),
+        question=_str(d.get("question", "")),
+        content=build_content(d.get("content")),
+        tag=str(d.get("tag", "?")),
+        src=d.get("src"),
+    )
+
+
+def build_question(d: dict[str, Any]) -> Question:
+    subs = d.get("subquestions")
+    return Question(
+        qid=d.get("qid", ""),
+        number=d.get("number", ""),
+        question=_str(d.get("question", "")),
+        content=build_content(d.get("content")),
+        subquestions=tuple(build_subquestion(s) for s in subs if isinstance(s, dict)) if isinstance(subs, list) else (),
+        tag=str(d.get("tag", "?")),
+        src=d.get("src"),
+    )
+
+
+def build_top(d: dict[str, Any]) -> TopNode:
+    t = d.get("type")
+    if t == "cover":
+        return build_cover(d)
+    if t in _BUILDERS:
+        return build_element(d)
+    if "question" in d or "subquestions" in d:
+        return build_question(d)
+    return build_element(d)
+
+
+def build_exam_version(block: dict[str, Any]) -> ExamVersion:
+    """versions[] の1要素（または load_exam_version の戻り値）からモデルを作る。"""
+    questions = block.get("questions") or []
+    return ExamVersion(
+        version=str(block.get("version") or "A"),
+        metainfo=block.get("metainfo") or {},
+        questions=tuple(build_top(q) for q in questions if isinstance(q, dict)),
+    )
+
+
+# ============================================================
+# 使っている機能
+# ============================================================
+# templates/latex/preamble.tex の \ExamIfFeature と同じ名前・順序
+FEATURES = ("code", "premise", "math", "image", "ruby")
+
+# \( \) / \[ \] / $ と、[[...]] の生TeXに書かれた数式環境
+_MATH_RE = re.compile(r"\\[(\[]|(?<!\\)\$|\\begin\{(?:align|equation|gather|multline)")
+_RUBY_RE = re.compile(r"\\(?:ltj)?ruby(?![A-Za-z])")
+
+
+def _node_texts(node: Node, found: set[str]) -> Iterable[str]:
+    """要素の本文（数式・ルビを探す文字列）を返し、要素の種類で分かる機能は found に入れる。"""
+    if isinstance(node, Stray):
+        yield _str(node.value)
+    elif isinstance(node, Text):
+        yield node.value or ""
+        yield from node.values
+    elif isinstance(node, Lines):
+        yield from node.values
+    elif isinstance(node, Choices):
+        yield from (o.text for o in node.options)
+    elif isinstance(node, Code):
+        # コードは listings にそのまま渡すので $ などは数式ではない
+        found.add("code")
+    elif isinstance(node, Image):
+        found.add("image")
+    elif isinstance(node, Premise):
+        found.add("premise")
+        yield node.title
+        for sub in node.content:
+            yield from _node_texts(sub, found)
+
+
+def exam_features(ev: ExamVersion) -> tuple[str, ...]:
+    """版が使っている機能を FEATURES の順で返す。"""
+    found: set[str] = set()
+    texts: list[str] = []
+    for top in ev.questions:
+        if isinstance(top, Cover):
+            texts.append(top.title)
+            texts.extend(top.notes)
+        elif isinstance(top, Question):
+            texts.append(top.question)
+            for node in top.content:
+                texts.extend(_node_texts(node, found))
+            for sub in top.subquestions:
+                if isinstance(sub, SubQuestion):
+                    texts.append(sub.question)
+                    for node in sub.content:
+                        texts.extend(_node_texts(node, found))
+        else:
+            texts.extend(_node_texts(top, found))
+
+    joined = "\n".join(texts)
+    if _MATH_RE.search(joined):
+        found.add("math")
+    if _RUBY_RE.search(joined):
+        found.add("ruby")
+    return tuple(f for f in FEATURES if f in found)
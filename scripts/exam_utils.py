@@ -5,16 +5,26 @@ from __future__ import annotations
 
 from pathlib import Path
 from dataclasses import dataclass
+import copy
 from typing import Any
 import argparse
+import filecmp
 import hashlib
 import json
+import os
 import re
+import shutil
 import sys
 
 import openpyxl
 import yaml
 
+try:
+    # 任意。入っていれば試験JSONの --compact 読み書きに使う
+    import orjson
+except ImportError:
+    orjson = None
+
 
 # ============================================================
 # Common @TTC utils
@@ -358,6 +368,21 @@ def calc_excel_hash(sheet) -> str:
 
     return hashlib.md5("\n".join(content).encode("utf-8")).hexdigest()
 
+def shuffle_column(version: str) -> int:
+    """
+    select / subselect / answer / subanswer 行で、
+    指定版のシャッフル番号・変換後正解番号を置く列番号（1始まり）を返す。
+
+      B版 -> G列(7), C版 -> H列(8), D版 -> I列(9), ...
+
+    A版は元の並びなので対象外。
+    """
+    v = str(version).strip().upper()
+    if len(v) != 1 or not ("B" <= v <= "Z"):
+        raise ValueError(f"シャッフル列のない版です: {version}")
+    return 7 + (ord(v) - ord("B"))
+
+
 def get_qpattern(sheet) -> str:
     """
     Worksheet から qpattern を取得する。
@@ -540,6 +565,324 @@ def save_json(path: str | Path, data: Any) -> None:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
 
+# ------------------------------------------------------------
+# 再現可能な PDF 出力
+#
+# 同じ入力から同じバイト列の PDF を作るため、作成日時は SOURCE_DATE_EPOCH
+# （無ければ ReportLab の invariant と同じ 2000-01-01）に固定する。
+# 書き出し先と中身が同じなら置き換えない（mtime も変わらない）。
+# ------------------------------------------------------------
+DEFAULT_SOURCE_DATE_EPOCH = 946684800
+
+
+def source_date_epoch() -> int:
+    value = os.environ.get("SOURCE_DATE_EPOCH", "").strip()
+    return int(value) if value.isdigit() else DEFAULT_SOURCE_DATE_EPOCH
+
+
+def pdf_document_id(*parts: str) -> str:
+    """PDF の /ID 用の 32 桁の16進（source_excel_hash と版などから作る）。"""
+    return hashlib.md5("\0".join(parts).encode("utf-8")).hexdigest().upper()
+
+
+def replace_if_changed(tmp: str | Path, dest: str | Path) -> bool:
+    """tmp を dest に置き換える。中身が同じなら tmp を消して False。"""
+    tmp, dest = Path(tmp), Path(dest)
+    if dest.is_file() and filecmp.cmp(tmp, dest, shallow=False):
+        tmp.unlink()
+        return False
+    os.replace(tmp, dest)
+    return True
+
+
+def copy_if_changed(src: str | Path, dest: str | Path) -> bool:
+    """src を dest にコピーする。中身が同じならコピーせず False。"""
+    src, dest = Path(src), Path(dest)
+    if dest.is_file() and filecmp.cmp(src, dest, shallow=False):
+        return False
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    shutil.copy2(src, dest)
+    return True
+
+
+# ------------------------------------------------------------
+# 試験JSON（make_json の出力）
+#
+# --compact では改行・インデントなしで書き出し、各要素の tag / src を
+# <subject>.srcmap.json に分離する。要素には通し番号 id を付け、
+# srcmap の elements[id] が {"tag", "src"} になる。
+# 本体JSONの "srcmap" キーにサイドカーのファイル名を入れておき、
+# load_exam_json(with_trace=True) のときだけ読み込んで元に戻す。
+# ------------------------------------------------------------
+SRCMAP_SUFFIX = ".srcmap.json"
+TRACE_KEYS = ("tag", "src")
+
+
+def srcmap_path_for(json_path: str | Path) -> Path:
+    """
+    試験JSONに対応する srcmap サイドカーのパスを返す。
+    """
+    json_path = Path(json_path)
+    return json_path.with_name(f"{json_path.stem}{SRCMAP_SUFFIX}")
+
+
+def split_trace(doc: Any) -> list[dict[str, Any]]:
+    """
+    doc 内の tag / src を持つ dict から、それらを取り除いて id を付ける。
+    取り除いた tag / src を id 順のリストで返す（doc はその場で変更する）。
+    """
+    elements: list[dict[str, Any]] = []
+    stack = [doc]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if "tag" in node or "src" in node:
+                entry = {k: node.pop(k) for k in TRACE_KEYS if k in node}
+                node["id"] = len(elements)
+                elements.append(entry)
+            stack.extend(v for v in node.values() if isinstance(v, (dict, list)))
+        elif isinstance(node, list):
+            stack.extend(v for v in node if isinstance(v, (dict, list)))
+    return elements
+
+
+def attach_trace(doc: Any, elements: list[dict[str, Any]]) -> None:
+    """
+    split_trace の逆。id を持つ dict に tag / src を戻し、id を取り除く。
+    """
+    stack = [doc]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            eid = node.get("id")
+            if isinstance(eid, int) and 0 <= eid < len(elements):
+                del node["id"]
+                node.update(elements[eid])
+            stack.extend(v for v in node.values() if isinstance(v, (dict, list)))
+        elif isinstance(node, list):
+            stack.extend(v for v in node if isinstance(v, (dict, list)))
+
+
+def strip_trace_ids(doc: Any) -> None:
+    """
+    split_trace で付けた id だけを取り除く（srcmap を読まないとき用）。
+    """
+    stack = [doc]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if isinstance(node.get("id"), int):
+                del node["id"]
+            stack.extend(v for v in node.values() if isinstance(v, (dict, list)))
+        elif isinstance(node, list):
+            stack.extend(v for v in node if isinstance(v, (dict, list)))
+
+
+def _dumps_compact(data: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _loads(raw: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode("utf-8"))
+
+
+def save_exam_json(path: str | Path, doc: dict[str, Any], *, compact: bool = False) -> Path | None:
+    """
+    試験JSONを保存する。
+
+    compact=False: 従来どおり indent=2 で保存し、古い srcmap があれば削除する。
+    compact=True : tag / src を srcmap サイドカーへ分離し、本体もサイドカーも
+                   minify して保存する（doc はその場で変更される）。
+    戻り値は srcmap のパス（compact=False のときは None）。
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    sidecar = srcmap_path_for(path)
+
+    if not compact:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, ensure_ascii=False, indent=2)
+        if sidecar.exists():
+            sidecar.unlink()
+        return None
+
+    elements = split_trace(doc)
+    doc["srcmap"] = sidecar.name
+    path.write_bytes(_dumps_compact(doc))
+    sidecar.write_bytes(_dumps_compact({"json": path.name, "elements": elements}))
+    return sidecar
+
+
+def load_exam_json(path: str | Path, *, with_trace: bool = True) -> Any:
+    """
+    試験JSONを読み込む。
+
+    --compact で保存されたJSONの場合、with_trace=True のときだけ
+    srcmap サイドカーを読み込み、各要素に tag / src を戻す。
+    with_trace=False ではサイドカーを読まず、要素の id も取り除く（tag / src の無い要素になる）。
+    """
+    path = Path(path)
+
+    if not path.exists():
+        raise FileNotFoundError(f"JSONファイルが見つかりません: {path}")
+
+    data = _loads(path.read_bytes())
+
+    if isinstance(data, dict) and "srcmap" in data:
+        sidecar = path.with_name(str(data.pop("srcmap")))
+        if with_trace:
+            if not sidecar.exists():
+                raise FileNotFoundError(
+                    f"srcmap が見つかりません。make_json.py を再実行してください: {sidecar}"
+                )
+            attach_trace(data, _loads(sidecar.read_bytes()).get("elements") or [])
+        else:
+            strip_trace_ids(data)
+
+    return data
+
+
+# ------------------------------------------------------------
+# 版別シャード
+#
+# make_json は単一の <subject>.json に加えて、
+#   work/<subject>/<version>.json  … 版ごとの {version, questions, metainfo}
+#   work/<subject>/index.json      … versionmode と版ごとの hash / metainfo
+# を出力する。hash や版一覧だけが必要な処理は index だけを、
+# 本文が必要な処理は必要な版のシャードだけを読む。
+# シャードが無い・単一ファイルより古い場合は単一ファイルから読む（旧形式互換）。
+# ------------------------------------------------------------
+EXAM_INDEX_NAME = "index.json"
+
+
+def exam_shard_dir(json_path: str | Path) -> Path:
+    """
+    work/<subject>.json に対応するシャードフォルダ work/<subject>/ を返す。
+    """
+    return Path(json_path).with_suffix("")
+
+
+def _use_shards(json_path: Path) -> bool:
+    index_path = exam_shard_dir(json_path) / EXAM_INDEX_NAME
+    if not index_path.exists():
+        return False
+    if json_path.exists() and json_path.stat().st_mtime > index_path.stat().st_mtime:
+        return False
+    return True
+
+
+def exam_json_exists(json_path: str | Path) -> bool:
+    """
+    単一ファイルまたはシャードの index のどちらかがあれば True。
+    """
+    json_path = Path(json_path)
+    return json_path.exists() or (exam_shard_dir(json_path) / EXAM_INDEX_NAME).exists()
+
+
+def save_exam_shards(json_path: str | Path, doc: dict[str, Any], *, compact: bool = False) -> Path:
+    """
+    doc を版ごとのシャードと index に分けて保存し、index のパスを返す。
+    前回の実行で残った、今回の版に無いシャードは削除する。
+    compact=True のときはシャードごとに srcmap を分離する（doc は変更しない）。
+    """
+    shard_dir = exam_shard_dir(json_path)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    keep = {EXAM_INDEX_NAME}
+    entries: list[dict[str, Any]] = []
+
+    for block in doc.get("versions") or []:
+        version = str(block.get("version") or "A")
+        shard_path = shard_dir / f"{version}.json"
+
+        save_exam_json(shard_path, copy.deepcopy(block) if compact else block, compact=compact)
+        keep.add(shard_path.name)
+        keep.add(srcmap_path_for(shard_path).name)
+
+        metainfo = block.get("metainfo", {}) or {}
+        entries.append({
+            "version": version,
+            "shard": shard_path.name,
+            "source_excel_hash": metainfo.get("source_excel_hash") or metainfo.get("hash"),
+            "metainfo": metainfo,
+        })
+
+    for old in shard_dir.glob("*.json"):
+        if old.name not in keep:
+            old.unlink()
+
+    index_path = shard_dir / EXAM_INDEX_NAME
+    save_json(index_path, {"versionmode": doc.get("versionmode"), "versions": entries})
+    return index_path
+
+
+def load_exam_index(json_path: str | Path) -> dict[str, Any]:
+    """
+    versionmode と版ごとの metainfo だけを持つ軽量な dict を返す。
+    形は試験JSONと同じ {"versionmode", "versions": [{"version", "metainfo", ...}]}
+    なので、versions / metainfo だけを見る既存の関数にそのまま渡せる。
+    """
+    json_path = Path(json_path)
+
+    if _use_shards(json_path):
+        return load_json(exam_shard_dir(json_path) / EXAM_INDEX_NAME)
+
+    data = load_exam_json(json_path, with_trace=False)
+    return {
+        "versionmode": data.get("versionmode"),
+        "versions": [
+            {"version": block.get("version"), "metainfo": block.get("metainfo", {}) or {}}
+            for block in data.get("versions") or []
+        ],
+    }
+
+
+def load_exam_version(json_path: str | Path, version: str, *, with_trace: bool = True) -> dict[str, Any]:
+    """
+    指定版の {version, questions, metainfo} を返す。
+    シャードがあればその版のシャードだけを読む。
+    """
+    json_path = Path(json_path)
+    shard_path = exam_shard_dir(json_path) / f"{version}.json"
+
+    if _use_shards(json_path) and shard_path.exists():
+        return load_exam_json(shard_path, with_trace=with_trace)
+
+    data = load_exam_json(json_path, with_trace=with_trace)
+    for block in data.get("versions") or []:
+        if str(block.get("version")) == str(version):
+            return block
+    raise ValueError(f"version {version} not found: {json_path}")
+
+
+# ------------------------------------------------------------
+# LaTeX 大問断片
+#   work/latex/<ver>/<sheet>_<ver>_body.tex は大問ごとの断片
+#   work/latex/<ver>/q/<qid>.tex を \input{q/<qid>} で読み込む。
+#   make_pdf は body.tex と一緒に q/ をビルドフォルダへ置く。
+# ------------------------------------------------------------
+LATEX_FRAGMENT_DIR_NAME = "q"
+
+
+def latex_fragment_dir(body_path: str | Path) -> Path:
+    """body.tex と同じフォルダの断片フォルダ q/ を返す。"""
+    return Path(body_path).parent / LATEX_FRAGMENT_DIR_NAME
+
+
+# 1問だけのプレビュー（make_latex --only / make_pdf --preview）
+#   work/latex/preview/<sheet>_<ver>_<qid>_body.tex
+LATEX_PREVIEW_DIR_NAME = "preview"
+
+
+def preview_body_path(work_dir: str | Path, sheetname: str, version: str, qid: str) -> Path:
+    safe_qid = re.sub(r"[^0-9A-Za-z_-]", "_", str(qid)) or "q"
+    return Path(work_dir) / "latex" / LATEX_PREVIEW_DIR_NAME / f"{sheetname}_{version}_{safe_qid}_body.tex"
+
+
 def load_yaml(path: str | Path) -> dict[str, Any]:
     """
     examtools内で必要な場合の簡易YAMLロード。
@@ -0,0 +1,185 @@
+# scripts/imageprep.py
+"""
+印刷解像度に合わせた画像の前処理とそのキャッシュ（make_pdf.py / make_word.py 共通）。
+
+exam_dir/images の画像（スクリーンショットは数MBあることが多い）を、
+  - 紙面での幅（JSON の width の比率 × 本文幅）× DPI のピクセル幅まで縮小し
+  - EXIF の向きを反映してからメタデータ（EXIF / ICC / テキスト）を落とし
+  - モードを PNG / JPEG がそのまま扱えるもの（RGB / RGBA / L など）にそろえて
+書き直したものを使う。拡張子（形式）は変えない（tex / docx からはファイル名で参照するため）。
+
+キャッシュは <key><拡張子> を1フォルダに並べるだけ。キーは元画像の中身の sha256・目標ピクセル幅・DPI・
+この処理のバージョン・Pillow のバージョン。合計サイズが上限を超えたら mtime の古い順に消す（LRU）。
+Pillow が無いとき、PNG / JPEG 以外のとき、処理に失敗したときは元の画像をそのまま使う。
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import math
+import os
+import re
+from pathlib import Path
+from typing import Iterable
+
+from pdfcache import body_sources
+
+DEFAULT_DPI = 300
+DEFAULT_CACHE_DIR = Path("/private/tmp/exam_build/_images")
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+# 処理内容を変えたら上げる（キャッシュのキーに入る）
+PREP_VERSION = "2"
+
+_PREP_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG"}
+_JPEG_QUALITY = 90
+
+# 画像の中身に関わる im.info のキー（これ以外はメタデータとして落とす）
+_PLAIN_INFO_KEYS = frozenset({
+    "dpi", "transparency", "gamma", "aspect",
+    "jfif", "jfif_version", "jfif_unit", "jfif_density",
+    "progressive", "progression", "adobe", "adobe_transform",
+})
+
+# make_latex.render_image: \image{<path>}{<幅の比率>}
+_IMAGE_MACRO_RE = re.compile(r"\\image\{([^}]*)\}\{\s*([0-9.]+)\s*\}")
+_TEX_ESCAPED_RE = re.compile(r"\\([&%#_{}$])")
+
+
+def pillow_available() -> bool:
+    return importlib.util.find_spec("PIL") is not None
+
+
+def target_pixels(width_ratio: float, text_width_in: float, dpi: int) -> int:
+    """紙面で width_ratio × text_width_in インチになる画像に要るピクセル幅"""
+    return max(1, math.ceil(width_ratio * text_width_in * dpi))
+
+
+def image_width_ratios(body_paths: Iterable[Path]) -> dict[str, float]:
+    """body.tex（と \\input される断片）の \\image から 画像名 -> 幅の比率（同じ画像は一番大きいもの）"""
+    ratios: dict[str, float] = {}
+    for body_path in body_paths:
+        for p in body_sources(body_path):
+            if not p.exists():
+                continue
+            for m in _IMAGE_MACRO_RE.finditer(p.read_text(encoding="utf-8")):
+                name = _TEX_ESCAPED_RE.sub(r"\1", m.group(1).strip())
+                try:
+                    ratio = float(m.group(2))
+                except ValueError:
+                    continue
+                ratios[name] = max(ratio, ratios.get(name, 0.0))
+    return ratios
+
+
+class ImagePrep:
+    def __init__(
+        self,
+        cache_dir: Path = DEFAULT_CACHE_DIR,
+        dpi: int = DEFAULT_DPI,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.dpi = dpi
+        self.max_bytes = max_bytes
+
+    def signature(self) -> str:
+        """出力を左右する設定（make_pdf の PDF キャッシュのキーにも入れる）"""
+        from PIL import __version__ as pil_version
+
+        return f"imageprep={PREP_VERSION} dpi={self.dpi} pillow={pil_version}"
+
+    def _key(self, src: Path, width_px: int) -> str:
+        h = hashlib.sha256()
+        with src.open("rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        h.update(f"\0{width_px}\0{self.signature()}".encode("utf-8"))
+        return h.hexdigest()
+
+    def prepare(self, src: Path, width_px: int) -> Path:
+        """src を width_px 幅以下にしたキャッシュ済みの画像のパス（使えなければ src）"""
+        suffix = src.suffix.lower()
+        if suffix not in _PREP_FORMATS or not src.is_file():
+            return src
+
+        dst = self.cache_dir / f"{self._key(src, width_px)}{suffix}"
+        if dst.is_file():
+            os.utime(dst)  # LRU 用に「最近使った」にする
+            return dst
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f"{dst.name}.tmp{os.getpid()}")
+        try:
+            _downsample(src, tmp, width_px, _PREP_FORMATS[suffix], self.dpi)
+            # 向きの指定もメタデータも無く、縮小不要で書き直しても小さくならない画像だけ元のバイト列を入れておく
+            if tmp.stat().st_size >= src.stat().st_size and _is_plain(src, width_px):
+                tmp.write_bytes(src.read_bytes())
+            os.replace(tmp, dst)
+        except Exception as e:
+            tmp.unlink(missing_ok=True)
+            print(f"⚠️  画像の前処理に失敗したので元の画像を使います: {src.name}: {e}")
+            return src
+
+        self.evict()
+        return dst
+
+    def evict(self) -> list[Path]:
+        entries = []
+        for p in self.cache_dir.iterdir():
+            if ".tmp" in p.suffix or not p.is_file():
+                continue
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in entries)
+
+        removed: list[Path] = []
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+            removed.append(p)
+        return removed
+
+
+def _is_plain(path: Path, width_px: int) -> bool:
+    """EXIF（向き含む）・ICC・テキストなどが無く、幅が width_px 以下ならそのまま使える。"""
+    from PIL import Image
+
+    with Image.open(path) as im:
+        if im.getexif() or set(im.info) - _PLAIN_INFO_KEYS:
+            return False
+        return im.width <= width_px
+
+
+def _downsample(src: Path, out: Path, width_px: int, fmt: str, dpi: int) -> None:
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as opened:
+        im = ImageOps.exif_transpose(opened)
+        has_alpha = im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info
+
+        # 形式がそのまま保存できるモードにそろえる（CMYK / 16bit / パレット等）
+        if fmt == "JPEG":
+            if im.mode not in ("RGB", "L"):
+                im = im.convert("RGB")
+        elif im.mode not in ("RGB", "RGBA", "L", "LA", "P", "1"):
+            im = im.convert("RGBA" if has_alpha else "RGB")
+
+        if im.width > width_px:
+            if im.mode in ("P", "1"):
+                # パレット画像は LANCZOS で縮小できない
+                im = im.convert("RGBA" if has_alpha else "RGB")
+            height = max(1, round(im.height * width_px / im.width))
+            im = im.resize((width_px, height), Image.LANCZOS)
+
+        # im.info を引き継ぐと ICC / EXIF / テキストが残るので透明色だけにしてから保存する
+        im.info = {k: v for k, v in im.info.items() if k == "transparency"}
+        if fmt == "JPEG":
+            im.save(out, "JPEG", quality=_JPEG_QUALITY, optimize=True, dpi=(dpi, dpi))
+        else:
+            im.save(out, "PNG", optimize=True, dpi=(dpi, dpi))
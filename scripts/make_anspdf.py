@@ -9,8 +9,11 @@ from exam_utils import (
     load_exam_context,
     setspace,
     calc_excel_hash,
+    shuffle_column,
     get_nenji_by_subno,
     write_exam_path_to_slideinfo,
+    exam_json_exists,
+    load_exam_index,
 )
 from versioncontrol import ensure_version_entry
 import re
@@ -58,17 +61,17 @@ def n2char(num):
 
 def load_problem_json(json_path):
     """
-    make_json.py が作成した work/{subject}.json を読み込む。
+    make_json.py が作成した work/{subject}.json の index（版一覧と metainfo）を読み込む。
+    解答用紙は Excel から作るので、問題本文は読まない。
     """
-    if not json_path.exists():
+    if not exam_json_exists(json_path):
         raise FileNotFoundError(
             f"JSONファイルが見つかりません。\n"
             f"先に make_json.py を実行してください。\n"
             f"JSON path: {json_path}"
         )
 
-    with open(json_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return load_exam_index(json_path)
 
 
 def get_source_excel_hash_from_problem_json(data: dict, json_path) -> str:
@@ -227,6 +230,9 @@ def build_answer_columns(excel_path, nenji,sh,shname, work_dir, version="A"):
             return None
         parts = re.split(r"[,\s]+", s)
         return {p for p in parts if p}
+    # A版以外のシャッフル列（B版=G列, C版=H列, ...）の0始まりindex
+    order_col = shuffle_column(version) - 1 if version != "A" else 6
+
     selflg=False
     for row in sh.iter_rows(min_row=1, max_row=sh.max_row, values_only=True):
 
@@ -313,9 +319,10 @@ def build_answer_columns(excel_path, nenji,sh,shname, work_dir, version="A"):
             sidx=0
 
         elif version != "A" and tag in ("select", "subselect"):
-            if len(row) > 6 and row[6]:
+            order_num = None
+            if len(row) > order_col and row[order_col]:
                 try:
-                    order_num = int(row[6])
+                    order_num = int(row[order_col])
                 except:
                     order_num = None
             sidx+=1
@@ -342,7 +349,7 @@ def build_answer_columns(excel_path, nenji,sh,shname, work_dir, version="A"):
             D列：3 幅,高さ 倍数 (w,h）
             E列：4 ラベル（番号の後につける）
             F列：5 
-            G列：6 ver2用の選択問題の問題番号（シャッフル）と対応した解答番号
+            G列：6 ver2用の選択問題の問題番号（シャッフル）と対応した解答番号（B版。C版以降は H列, I列, ...）
             '''
             # … 通常の answer 登録処理 …
 #            ans_text = row[1] if len(row) > 1 else ""
@@ -355,7 +362,7 @@ def build_answer_columns(excel_path, nenji,sh,shname, work_dir, version="A"):
 #------------------------------------------------------------------------------
                 if selflg:
                     if version != "A":
-                        ans_text = row[6]  #シャッフルされた解答
+                        ans_text = row[order_col] if len(row) > order_col else None  #シャッフルされた解答
                     t=n2char(ans_text)
                     #selflg=False
 #------------------------------------------------------------------------------
@@ -606,11 +613,14 @@ def main() -> None:
         pdfout = outdir / f"{subject}_{ver}_解答用紙.pdf"
 
         if outjson["versionmode"] == "single":
-            make_pdf(v["questions"], pdfout, 7)
+            changed = make_pdf(v["questions"], pdfout, 7)
         else:
-            make_pdf(v["questions"], pdfout, 7, ver)
+            changed = make_pdf(v["questions"], pdfout, 7, ver)
 
-        print(f"✅ PDF出力: {pdfout}")
+        if changed is False:
+            print(f"✅ PDF出力（前回と同じ）: {pdfout}")
+        else:
+            print(f"✅ PDF出力: {pdfout}")
 
 if __name__ == "__main__":
     try:
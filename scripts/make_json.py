@@ -3,6 +3,8 @@ import sys
 
 from exam_utils import add_subject_arg, load_exam_context, get_qpattern
 
+import copy
+import hashlib
 import json
 from pathlib import Path
 import re
@@ -18,11 +20,15 @@ from exam_utils import (
     setspace,
     parse_with_number,
     calc_excel_hash,
+    shuffle_column,
     write_exam_path_to_slideinfo,
+    save_exam_json,
+    save_exam_shards,
 )
 from versioncontrol_yaml import ensure_version_entry
 
-from contract import normalize_document, validate_document, ContractError
+from contract import process_document, ContractError
+from texconv import conv_text
 
 
 # ============================================================
@@ -126,103 +132,6 @@ def require_validated_excel(ws, *, work_dir: Path, subject_no: str, sheetname: s
 # v2: qpattern は b_exam ブロックの qpattern 行から取得（v1同様）
 current_premise = None
 current_preline = None
-def escape_tex_outside_inline_math(s: str) -> str:
-    r"""
-    \(...\) / \[...\] の中はそのまま、
-    それ以外の部分だけ { } & をエスケープする。
-    """
-    out = []
-    i = 0
-    in_math = False
-    end_token = None  # r"\)" or r"\]"
-
-    while i < len(s):
-        if not in_math:
-            # math start: \(  or \[
-            if s.startswith(r"\(", i):
-                in_math = True
-                end_token = r"\)"
-                out.append(r"\(")
-                i += 2
-                continue
-            if s.startswith(r"\[", i):
-                in_math = True
-                end_token = r"\]"
-                out.append(r"\[")
-                i += 2
-                continue
-
-            ch = s[i]
-            if ch == "{":
-                out.append(r"\{")
-            elif ch == "}":
-                out.append(r"\}")
-            elif ch == "&":
-                out.append(r"\&")
-            else:
-                out.append(ch)
-            i += 1
-        else:
-            # math end
-            if end_token and s.startswith(end_token, i):
-                in_math = False
-                out.append(end_token)
-                i += 2
-                end_token = None
-                continue
-
-            # 数式中は一切触らない
-            out.append(s[i])
-            i += 1
-
-    return "".join(out)
-
-# -------------------------
-# v2: Backslash display conversion
-# -------------------------
-# Excelセル中に「\0」など「バックスラッシュ + 数字」が含まれる場合、
-# LaTeX表示でバックスラッシュ記号として出すために
-# \textbackslash 0 のように変換する（JSON段階で整形）
-_BACKSLASH_DIGIT_RE = re.compile(r"\\(?=\d)")
-
-# 追加：クォート内の \n \t \r \0 など（\ + 英数字）を対象にする
-_BACKSLASH_IN_QUOTES_RE = re.compile(r"(?<=[\'\"])\\(?=[A-Za-z0-9])")
-_RAW_TEX_RE = re.compile(r"\[\[(.+?)\]\]", re.DOTALL)
-
-def _conv_plain_segment(seg: str) -> str:
-    # safety: real NUL
-    seg = seg.replace("\x00", r"\textbackslash 0")
-    # '\n' や "\n" のようなクォート内の \n \t \r \0 など
-    seg = _BACKSLASH_IN_QUOTES_RE.sub(r"\\textbackslash ", seg)
-    # \0, \12 ...（バックスラッシュ + 数字）
-    seg = _BACKSLASH_DIGIT_RE.sub(r"\\textbackslash ", seg)
-    # 数式 \( ... \) の外側だけ { } & をエスケープ
-    seg = escape_tex_outside_inline_math(seg)
-    return seg
-
-def conv_text(v) -> str:
-    if v is None:
-        return ""
-    s = str(v).strip()
-    if s == "":
-        return ""
-
-    out = []
-    last = 0
-    for m in _RAW_TEX_RE.finditer(s):
-        # 通常部分は変換
-        out.append(_conv_plain_segment(s[last:m.start()]))
-
-        # [[...]] の中は「そのまま」通す（[[ ]] 自体は剥がす）
-        out.append(f"[[{m.group(1)}]]")
-
-        last = m.end()
-
-    # 残り
-    out.append(_conv_plain_segment(s[last:]))
-
-    return "".join(out)
-
 
 def _parse_select_style(style_raw: str):
     """
@@ -413,6 +322,20 @@ def excel_to_json_v2(ws, version="A"):
 #    global qpattern
 
     sheetname = getattr(ws, "title", "") or ""
+    rows = ((row_i, [c.value for c in row_cells]) for row_i, row_cells in enumerate(ws.iter_rows(), start=1))
+
+    cover, questions_raw = _collect_questions(rows, sheetname, version)
+    return _assemble_questions(cover, questions_raw, sheetname, version)
+
+
+def _collect_questions(rows, sheetname: str, version: str, *, q_number: int = 0):
+    """
+    excel_to_json_v2 の前半。(行番号, 行の値リスト) を順に読み、
+    cover と大問・前提条件の並び（並べ替え・問番号付け前）を返す。
+    q_number はこの rows より前にある大問の数（エラー表示の元番号用）。
+    """
+    # select / subselect の並び順（A版以外）：B版=G列, C版=H列, ...
+    order_col = shuffle_column(version) - 1 if version != "A" else None
 
 #    def make_src(row: int, row_end: int): # | None = None):
 #    def make_src(row: int, row_end=None):
@@ -434,13 +357,11 @@ def excel_to_json_v2(ws, version="A"):
     current_premise = None
     current_preline = None
 
-    q_number = 0
     sub_number = 0
 
     questions_raw = []  # 大問だけを集める（並べ替え対象）
 
-    for row_i, row_cells in enumerate(ws.iter_rows(), start=1):
-        row = [c.value for c in row_cells]
+    for row_i, row in rows:
         if not row or not row[0]:
             continue
 
@@ -707,9 +628,9 @@ def excel_to_json_v2(ws, version="A"):
 
         elif tag == "select" and current_select is not None:
             order_num = None
-            if len(row) > 6 and row[6]:
+            if order_col is not None and len(row) > order_col and row[order_col]:
                 try:
-                    order_num = int(row[6])
+                    order_num = int(row[order_col])
                 except:
                     order_num = None
 
@@ -728,7 +649,7 @@ def excel_to_json_v2(ws, version="A"):
                 v.get("label") for v in values if isinstance(v, dict)
             ])
 
-            # Shuffle for versions other than A, using Excel G column (order)
+            # Shuffle for versions other than A, using the version's shuffle column (B=G, C=H, ...)
             if version != "A":
                 order_list = [v.get("order") for v in values if isinstance(v, dict)]
                 if any(x is not None for x in order_list):
@@ -956,9 +877,9 @@ def excel_to_json_v2(ws, version="A"):
 
         elif tag == "subselect" and current_select is not None:
             order_num = None
-            if len(row) > 6 and row[6]:
+            if order_col is not None and len(row) > order_col and row[order_col]:
                 try:
-                    order_num = int(row[6])
+                    order_num = int(row[order_col])
                 except:
                     order_num = None
 
@@ -977,7 +898,7 @@ def excel_to_json_v2(ws, version="A"):
                 v.get("label") for v in values if isinstance(v, dict)
             ])
 
-            # Shuffle for versions other than A, using Excel G column (order)
+            # Shuffle for versions other than A, using the version's shuffle column (B=G, C=H, ...)
             if version != "A":
                 order_list = [v.get("order") for v in values if isinstance(v, dict)]
                 if any(x is not None for x in order_list):
@@ -1117,6 +1038,14 @@ def excel_to_json_v2(ws, version="A"):
     if cover is None and current_exam is not None:
         cover = current_exam
 
+    return cover, questions_raw
+
+
+def _assemble_questions(cover, questions_raw: list, sheetname: str, version: str) -> list:
+    """
+    excel_to_json_v2 の後半。qid 重複チェック、版ごとの並べ替え、
+    問番号の振り直し、PB/LS after の挿入を行い、questions 配列を返す。
+    """
     # -------------------------
     # version別の並び替えと、PB/LS after の挿入
     # -------------------------
@@ -1191,6 +1120,151 @@ def excel_to_json_v2(ws, version="A"):
     return results
 
 
+# ============================================================
+# 大問単位の変換キャッシュ
+#
+# b_question〜e_question / b_premise〜e_premise の各ブロックについて、
+#   key = sha256(変換コードのhash, 版, ブロック内の全セルの値)
+# → 変換結果（並べ替え・問番号付け前の大問 dict）を
+# work/<subject>.qcache.json に保存する。
+# src の行番号はブロック先頭からの相対値で保存し、取り出すときに戻すので、
+# 上に行を挿入してもキャッシュは有効。並べ替え・問番号・after の挿入は
+# 毎回 _assemble_questions で行うため、結果はキャッシュなしと同じになる。
+# ============================================================
+QCACHE_SUFFIX = ".qcache.json"
+
+_BLOCK_END = {"b_question": "e_question", "b_premise": "e_premise"}
+
+_code_hash_cache: list = []
+
+
+def _converter_code_hash() -> str:
+    """変換コード（make_json.py / texconv.py / texescape.py / exam_utils.py）の hash。変更されたらキャッシュを使わない。"""
+    if not _code_hash_cache:
+        h = hashlib.sha256()
+        for name in ("make_json.py", "texconv.py", "texescape.py", "exam_utils.py"):
+            h.update((Path(__file__).resolve().parent / name).read_bytes())
+        _code_hash_cache.append(h.hexdigest())
+    return _code_hash_cache[0]
+
+
+def split_question_blocks(rows: list):
+    """
+    (行番号, 値リスト) の並びを、ブロック外の行と、
+    大問・前提条件ブロック [(開始行番号, ブロックの行リスト), ...] に分ける。
+    閉じていないブロックがある場合は None を返す（キャッシュを使わない）。
+    """
+    outer = []
+    blocks = []
+    current = None
+    end_tag = None
+
+    for row_i, row in rows:
+        tag = str(row[0]).strip() if row and row[0] else ""
+        if current is None:
+            if tag in _BLOCK_END:
+                current = [(row_i, row)]
+                end_tag = _BLOCK_END[tag]
+            else:
+                outer.append((row_i, row))
+            continue
+
+        current.append((row_i, row))
+        if tag == end_tag:
+            blocks.append((current[0][0], current))
+            current = None
+
+    if current is not None:
+        return None
+    return outer, blocks
+
+
+def _block_key(block_rows: list, version: str) -> str:
+    payload = json.dumps(
+        [_converter_code_hash(), version, [row for _, row in block_rows]],
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _shift_src(obj, delta: int, sheetname: Optional[str] = None) -> None:
+    """obj 内の src / _src の行番号を delta だけずらす（sheetname 指定時はシート名も置き換える）。"""
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if k in ("src", "_src") and isinstance(v, dict):
+                for rk in ("row", "row_end"):
+                    if isinstance(v.get(rk), int):
+                        v[rk] += delta
+                if sheetname is not None:
+                    v["sheet"] = sheetname
+            else:
+                _shift_src(v, delta, sheetname)
+    elif isinstance(obj, list):
+        for v in obj:
+            _shift_src(v, delta, sheetname)
+
+
+def load_question_cache(path: Path) -> dict:
+    """キャッシュファイルを読み込む。無い・壊れている場合は空。"""
+    try:
+        return json.loads(path.read_text(encoding="utf-8")).get("entries") or {}
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_question_cache(path: Path, entries: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps({"entries": entries}, ensure_ascii=False, separators=(",", ":")),
+        encoding="utf-8",
+    )
+
+
+def excel_to_json_v2_cached(ws, version: str, cache: dict, used: dict, stats: dict) -> list:
+    """
+    excel_to_json_v2 と同じ結果を、変わっていないブロックはキャッシュから作る。
+
+    cache : load_question_cache で読んだ既存エントリ
+    used  : 今回使ったエントリを入れる（save_question_cache に渡す。使わなかったものは捨てる）
+    stats : "hit" / "miss" の件数を加算する
+    """
+    sheetname = getattr(ws, "title", "") or ""
+    rows = [(row_i, list(row)) for row_i, row in enumerate(ws.iter_rows(values_only=True), start=1)]
+
+    split = split_question_blocks(rows)
+    if split is None:
+        return excel_to_json_v2(ws, version=version)
+    outer, blocks = split
+
+    cover, _ = _collect_questions(outer, sheetname, version)
+
+    questions_raw = []
+    q_number = 0
+    for start, block_rows in blocks:
+        key = _block_key(block_rows, version)
+        delta = start - 1
+
+        if key in cache:
+            items = json.loads(cache[key])
+            _shift_src(items, delta, sheetname)
+            used[key] = cache[key]
+            stats["hit"] = stats.get("hit", 0) + 1
+        else:
+            _, items = _collect_questions(block_rows, sheetname, version, q_number=q_number)
+            # 共有されている src があるので、一度 JSON にしてから相対行番号にする
+            rel = json.loads(json.dumps(items, ensure_ascii=False))
+            _shift_src(rel, -delta)
+            used[key] = json.dumps(rel, ensure_ascii=False, separators=(",", ":"))
+            stats["miss"] = stats.get("miss", 0) + 1
+
+        questions_raw.extend(items)
+        if str(block_rows[0][1][0]).strip() == "b_question":
+            q_number += 1
+
+    return _assemble_questions(cover, questions_raw, sheetname, version)
+
+
 def run_json_validator(json_path: Path, strict: bool = False) -> None:
     validator = Path(__file__).resolve().parent / "validate_json_premise.py"
     cmd = [sys.executable, str(validator), str(json_path), "--warn-unknown-keys"]
@@ -1230,97 +1304,92 @@ def apply_version_suffix_to_cover_title(questions: list, version: str) -> None:
             q["title"] = f"{base}{suffix}" if base else suffix.strip()
         break   
 
-_MATH_TOKEN_RE = re.compile(r"\\\(|\\\)|\\\[|\\\]")
+# \(...\) / \[...\] を左から順に探す。閉じがない場合は末尾 (\Z) までを1つのマッチにして、
+# コールバック側でそのまま返す（旧実装と同じく、それ以降は退避しない）。
+_MATH_SEGMENT_RE = re.compile(r"\\\(.*?(?:\\\)|\Z)|\\\[.*?(?:\\\]|\Z)", re.DOTALL)
+_MATH_PLACEHOLDER_RE = re.compile(r"ZZMATH\d{6,}ZZ")
+_MATH_CLOSERS = {"(": "\\)", "[": "\\]"}
 
 def _protect_math_segments_in_str(s: str, mapping: dict, counter: list) -> str:
     r"""
     文字列中の \(...\) と \[...\] をトークンに置換して退避する。
     normalize_document 等の一律エスケープから数式を守る。
     """
-    if not s:
+    if not s or "\\" not in s:
         return s
 
-    out = []
-    i = 0
-    while i < len(s):
-        # start inline \( ... \)
-        if s.startswith(r"\(", i):
-            j = s.find(r"\)", i + 2)
-            if j == -1:
-                # 閉じがない → そのまま出す（入力ミス）
-                out.append(s[i:])
-                break
-            seg = s[i:j+2]
-            token = f"ZZMATH{counter[0]:06d}ZZ"
-            counter[0] += 1
-            mapping[token] = seg
-            out.append(token)
-            i = j + 2
-            continue
-
-        # start display \[ ... \]
-        if s.startswith(r"\[", i):
-            j = s.find(r"\]", i + 2)
-            if j == -1:
-                out.append(s[i:])
-                break
-            seg = s[i:j+2]
-            token = f"ZZMATH{counter[0]:06d}ZZ"
-            counter[0] += 1
-            mapping[token] = seg
-            out.append(token)
-            i = j + 2
-            continue
-
-        out.append(s[i])
-        i += 1
+    def repl(m: re.Match) -> str:
+        seg = m.group(0)
+        if len(seg) < 4 or not seg.endswith(_MATH_CLOSERS[seg[1]]):
+            # 閉じがない → そのまま出す（入力ミス）
+            return seg
+        token = f"ZZMATH{counter[0]:06d}ZZ"
+        counter[0] += 1
+        mapping[token] = seg
+        return token
 
-    return "".join(out)
+    return _MATH_SEGMENT_RE.sub(repl, s)
 
 def _restore_math_segments_in_str(s: str, mapping: dict) -> str:
-    if not s or not mapping:
+    if not s or not mapping or "ZZMATH" not in s:
         return s
-    # token は英数字のみなので、置換は安全
-    for token, seg in mapping.items():
-        s = s.replace(token, seg)
-    return s
+    # token は英数字のみなので、1回の走査で直接引いて戻す
+    return _MATH_PLACEHOLDER_RE.sub(lambda m: mapping.get(m.group(0), m.group(0)), s)
 
-def protect_math_segments(obj, mapping: dict, counter: list):
+def normalize_and_validate_json(outjson: dict) -> list:
     r"""
-    outjson 全体を再帰で走査し、文字列中の数式 \(...\), \[...\] を退避する
+    outjson を1回だけ走査して、要素ごとに
+    数式退避 → normalize → 数式復元 → validate を行う。
+
+    文書全体の数式退避 → normalize_document → 文書全体の数式復元 →
+    validate_document の4回の走査（旧実装。benchmark.py json で比較）と同じ JSON / Problem を返す。
+    数式の退避・復元は、normalize が読む要素直下の文字列だけに行う。
+    ContractError はそのまま送出する。
     """
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            if isinstance(v, str):
-                obj[k] = _protect_math_segments_in_str(v, mapping, counter)
-            else:
-                protect_math_segments(v, mapping, counter)
-    elif isinstance(obj, list):
-        for idx, v in enumerate(obj):
-            if isinstance(v, str):
-                obj[idx] = _protect_math_segments_in_str(v, mapping, counter)
-            else:
-                protect_math_segments(v, mapping, counter)
+    mapping: dict = {}
+    counter = [0]
 
-def restore_math_segments(obj, mapping: dict):
-    if isinstance(obj, dict):
-        for k, v in obj.items():
+    def protect(elem: dict) -> None:
+        for k, v in elem.items():
             if isinstance(v, str):
-                obj[k] = _restore_math_segments_in_str(v, mapping)
-            else:
-                restore_math_segments(v, mapping)
-    elif isinstance(obj, list):
-        for idx, v in enumerate(obj):
+                elem[k] = _protect_math_segments_in_str(v, mapping, counter)
+
+    def restore(elem: dict) -> None:
+        if not mapping:
+            return
+        for k, v in elem.items():
             if isinstance(v, str):
-                obj[idx] = _restore_math_segments_in_str(v, mapping)
-            else:
-                restore_math_segments(v, mapping)
+                elem[k] = _restore_math_segments_in_str(v, mapping)
+        mapping.clear()
+
+    return process_document(
+        outjson,
+        strict=True,
+        warn_unknown_keys=True,
+        before_normalize=protect,
+        after_normalize=restore,
+    )
 
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="試験問題.xlsxからJSONを作成します。"
     )
     add_subject_arg(parser)
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="JSONを改行なしで出力し、tag/src を <科目番号>.srcmap.json に分離する",
+    )
+    parser.add_argument(
+        "--shards-only",
+        action="store_true",
+        help="版別シャード work/<科目番号>/<版>.json と index.json だけを出力し、単一の <科目番号>.json は出力しない",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="大問単位の変換キャッシュ（work/<科目番号>.qcache.json）を使わず、全大問を変換する",
+    )
     args = parser.parse_args()
 
     exam_context = load_exam_context(args.subject, load_workbook=True)
@@ -1361,8 +1430,13 @@ def main() -> None:
         "versions": [],
     }
 
+    qcache_path = work_dir / f"{sheetname}{QCACHE_SUFFIX}"
+    qcache = {} if args.no_cache else load_question_cache(qcache_path)
+    qcache_used: dict = {}
+    qcache_stats: dict = {}
+
     for v in qp:
-        questions = excel_to_json_v2(ws, version=v)
+        questions = excel_to_json_v2_cached(ws, v, qcache, qcache_used, qcache_stats)
 
         # multi のときだけ、cover.title に " (A)" / " (B)" を付与
         if versionmode == "multi":
@@ -1390,30 +1464,30 @@ def main() -> None:
 
         outjson["versions"].append(block)
 
-    _math_map = {}
-    _counter = [0]
-
-    # 数式を一時退避（\(...\), \[...\]）
-    protect_math_segments(outjson, _math_map, _counter)
-
-    normalize_document(outjson)
-
-    # 数式を復元
-    restore_math_segments(outjson, _math_map)
+    # 今回使ったブロックだけを残す（--no-cache でも次回のために書き出す）
+    save_question_cache(qcache_path, qcache_used)
+    print(f"変換キャッシュ: hit {qcache_stats.get('hit', 0)} / miss {qcache_stats.get('miss', 0)}")
 
+    # 数式の退避・normalize・復元・validate を1回の走査で行う
     try:
-        validate_document(outjson, strict=True, warn_unknown_keys=True)
+        normalize_and_validate_json(outjson)
     except ContractError as e:
         print(e)
         raise SystemExit(2)
 
     out = work_dir / f"{sheetname}.json"
-    out.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(out, "w", encoding="utf-8") as f:
-        json.dump(outjson, f, ensure_ascii=False, indent=2)
+    # 単一ファイルは互換用。compact では tag/src を取り除くので、シャード用に元の outjson を残す
+    if not args.shards_only:
+        srcmap_path = save_exam_json(out, copy.deepcopy(outjson) if args.compact else outjson, compact=args.compact)
+
+        print(f"✅ jsonファイルを作成しました: {out}")
+        if srcmap_path is not None:
+            print(f"✅ srcmapを作成しました: {srcmap_path}")
 
-    print(f"✅ jsonファイルを作成しました: {out}")
+    # index は単一ファイルより後に書く（読み込み側は新しい方を使う）
+    index_path = save_exam_shards(out, outjson, compact=args.compact)
+    print(f"✅ 版別jsonを作成しました: {index_path.parent}")
 
     slideinfo_path = write_exam_path_to_slideinfo(
         subject_no,
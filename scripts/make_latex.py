@@ -11,6 +11,10 @@ Changes in this fixed version:
 - Emits TeX trace comments to map output back to Excel rows:
   * %% QBEGIN / %% QEND
   * %% type=... tag=... src=Sheet!R..-R..
+- Writes <name>.texmap.json next to body.tex and q/<qid>.tex (trace line -> Excel row)
+  so that make_pdf can report LaTeX errors / overfull boxes as Sheet!R<row>
+- Records the features the version uses (% features: code,premise,math,image,ruby)
+  in the body.tex header so that make_pdf loads only the preamble fragments it needs
 - Supports canonical JSON keys:
   * text: {type:"text", value:"..."}
   * vspace: {type:"vspace", value_mm:int}
@@ -19,134 +23,35 @@ Changes in this fixed version:
 
 CLI (kept compatible):
   python make_latex.py <sheetname> --version A
+  python make_latex.py <sheetname> --only Q012 [--version B]   # 1問だけのプレビュー
 
 """
 
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List
 
-from exam_utils import add_subject_arg, load_exam_context
+from exam_utils import (
+    add_subject_arg, load_exam_context, exam_json_exists, load_exam_index, load_exam_version,
+    LATEX_FRAGMENT_DIR_NAME, latex_fragment_dir, preview_body_path,
+)
+from texescape import latex_escape
+from texdiag import build_source_map, dumps_source_map, source_map_path
+from exam_model import (
+    Choices, Code, Cover, Element, ExamVersion, Image, Lines, Node, PageBreak, Premise,
+    Question, Stray, Text, Unknown, VSpace, build_exam_version, exam_features,
+)
 
 import re
 from datetime import datetime
 
-_RAW_TEX_RE = re.compile(r"\[\[(.+?)\]\]", re.DOTALL)
-
 # =========================
 # Helpers
 # =========================
-def _latex_escape_core(s: Any) -> str:
-# def latex_escape(s: Any) -> str:
-    """Escape LaTeX-special characters for plain text,
-    BUT do NOT escape inside inline/display math: \( ... \), \[ ... \].
-
-    Also avoid double-escaping already-escaped sequences like \{, \}, \&, \_ ...
-    """
-    if s is None:
-        return ""
-
-    text = str(s)
-
-    # outside-math replacements
-    rep_basic = {
-        "&": r"\&",
-        "%": r"\%",
-        "#": r"\#",
-        "_": r"\_",
-        "{": r"\{",
-        "}": r"\}",
-    }
-
-    out: list[str] = []
-    i = 0
-    in_math = False
-    end_token: str | None = None
-
-    while i < len(text):
-        if not in_math:
-            # enter math
-            if text.startswith(r"\(", i):
-                in_math = True
-                end_token = r"\)"
-                out.append(r"\(")
-                i += 2
-                continue
-            if text.startswith(r"\[", i):
-                in_math = True
-                end_token = r"\]"
-                out.append(r"\[")
-                i += 2
-                continue
-
-            ch = text[i]
-            prev = text[i - 1] if i > 0 else ""
-
-            # already escaped like \{ \} \& \_ ... -> keep as-is
-            if ch in rep_basic:
-                if prev == "\\":
-                    out.append(ch)
-                else:
-                    out.append(rep_basic[ch])
-                i += 1
-                continue
-
-            if ch == "~":
-                if prev == "\\":
-                    out.append(ch)
-                else:
-                    out.append(r"\textasciitilde{}")
-                i += 1
-                continue
-
-            if ch == "^":
-                if prev == "\\":
-                    out.append(ch)
-                else:
-                    out.append(r"\textasciicircum{}")
-                i += 1
-                continue
-
-            out.append(ch)
-            i += 1
-
-        else:
-            # exit math
-            if end_token and text.startswith(end_token, i):
-                in_math = False
-                out.append(end_token)
-                i += 2
-                end_token = None
-                continue
-
-            # inside math: do nothing (preserve \frac{...}{...}, _, ^, etc.)
-            out.append(text[i])
-            i += 1
-
-    return "".join(out)
-
-def latex_escape(s: Any) -> str:
-    if s is None:
-        return ""
-    text = str(s)
-
-    out = []
-    last = 0
-    for m in _RAW_TEX_RE.finditer(text):
-        # 通常部分：従来通りエスケープ
-        out.append(_latex_escape_core(text[last:m.start()]))
-
-        # raw部分：[[...]] の中身は生LaTeX（エスケープしない、[[ ]] は剥がす）
-        out.append(m.group(1))
-
-        last = m.end()
-
-    out.append(_latex_escape_core(text[last:]))
-    return "".join(out)
-
 def latex_escape_multiline(s: Any) -> str:
     """
     LaTeX の引数に入れる複数行テキスト用。
@@ -172,71 +77,41 @@ def _src_loc(src: Any) -> str:
     return f"{sheet}!R{row}"
 
 
-def _trace_line(obj: Dict[str, Any], prefix: str = "") -> str:
+def _trace_line(obj: Any, prefix: str = "") -> str:
     """Return a TeX comment line mapping an element back to Excel."""
-    t = obj.get("type", "?")
-    tag = obj.get("tag", "?")
-    loc = _src_loc(obj.get("src"))
     extra = (prefix + " ") if prefix else ""
-    return f"%% {extra}type={t} tag={tag} src={loc}"
-
-
-def _get_mm(item: Dict[str, Any], key_primary: str, key_fallback: Optional[str] = None, default: int = 0) -> int:
-    """Read mm value as int. Accepts legacy float/string but coerces to int."""
-    v = item.get(key_primary)
-    if v is None and key_fallback:
-        v = item.get(key_fallback)
-    if v is None:
-        return default
-    try:
-        # allow "8", 8.0 etc.
-        return int(round(float(v)))
-    except Exception:
-        return default
-
-
-def _boolish(x: Any) -> bool:
-    if isinstance(x, bool):
-        return x
-    if isinstance(x, (int, float)):
-        return x != 0
-    if isinstance(x, str):
-        return x.strip().lower() in ("1", "true", "yes", "y", "on")
-    return False
+    return f"%% {extra}type={obj.type} tag={obj.tag} src={_src_loc(obj.src)}"
 
 
 # =========================
 # Renderers (elements)
 # =========================
 
-def render_text(item: Dict[str, Any], with_trace: bool = True) -> str:
+def render_text(item: Text, with_trace: bool = True) -> str:
     # canonical: value
     # legacy: values[list[str]]
     parts: List[str] = []
     if with_trace:
         parts.append(_trace_line(item))
 
-    if "value" in item and isinstance(item.get("value"), str):
-        parts.append(rf"\sline{{{latex_escape(item.get('value'))}}}")
+    if item.value is not None:
+        parts.append(rf"\sline{{{latex_escape(item.value)}}}")
         return "\n".join(parts)
 
-    vals = item.get("values") or []
-    if isinstance(vals, list):
-        for v in vals:
-            parts.append(rf"\sline{{{latex_escape(v)}}}")
+    for v in item.values:
+        parts.append(rf"\sline{{{latex_escape(v)}}}")
     return "\n".join(parts)
 
 
-def render_vspace(item: Dict[str, Any], with_trace: bool = True) -> str:
-    mm = _get_mm(item, "value_mm", key_fallback="value", default=0)
+def render_vspace(item: VSpace, with_trace: bool = True) -> str:
     lines: List[str] = []
     if with_trace:
         lines.append(_trace_line(item))
-    lines.append(rf"\vspace*{{{mm}mm}}")
+    lines.append(rf"\vspace*{{{item.mm}mm}}")
     return "\n".join(lines)
 
 
-def render_pagebreak(item: Dict[str, Any], with_trace: bool = True) -> str:
+def render_pagebreak(item: PageBreak, with_trace: bool = True) -> str:
     lines: List[str] = []
     if with_trace:
         lines.append(_trace_line(item))
@@ -244,73 +119,51 @@ def render_pagebreak(item: Dict[str, Any], with_trace: bool = True) -> str:
     return "\n".join(lines)
 
 
-def render_image(item: Dict[str, Any], with_trace: bool = True) -> str:
+def render_image(item: Image, with_trace: bool = True) -> str:
     # canonical: path, width (ratio)
-    path = item.get("path", "")
-    width_val = item.get("width", 0.85)
-    try:
-        width_val = float(width_val)
-    except Exception:
-        width_val = 0.85
+    width_val = 0.85 if item.width is None else item.width
 
     lines: List[str] = []
     if with_trace:
         lines.append(_trace_line(item))
-    lines.append(rf"\image{{{latex_escape(path)}}}{{{width_val}}}")
+    lines.append(rf"\image{{{latex_escape(item.path)}}}{{{width_val}}}")
     return "\n".join(lines)
 
 
-def render_code(item: Dict[str, Any], with_trace: bool = True) -> str:
-    lines = item.get("lines") or []
-    if not isinstance(lines, list):
-        lines = []
-
-    linenumber = _boolish(item.get("linenumber"))
-    opt = "[linenumber=true]" if linenumber else "[linenumber=false]"
+def render_code(item: Code, with_trace: bool = True) -> str:
+    opt = "[linenumber=true]" if item.linenumber else "[linenumber=false]"
 
     out: List[str] = []
     if with_trace:
         out.append(_trace_line(item))
     out.append(rf"\begin{{code}}{opt}")
     # verbatim-like (listings). Do NOT escape.
-    out.extend([str(x) for x in lines])
+    out.extend(item.lines)
     out.append(r"\end{code}")
     return "\n".join(out)
 
 
-def render_multiline(item: Dict[str, Any], with_trace: bool = True) -> str:
-    vals = item.get("values") or []
-    if not isinstance(vals, list):
-        vals = []
-
+def render_multiline(item: Lines, with_trace: bool = True) -> str:
     out: List[str] = []
     if with_trace:
         out.append(_trace_line(item))
     out.append(r"\begin{multiline}")
-    out += [rf"\mline{{{latex_escape(v)}}}" for v in vals]
+    out += [rf"\mline{{{latex_escape(v)}}}" for v in item.values]
     out.append(r"\end{multiline}")
     return "\n".join(out)
 
-def render_preline(item: Dict[str, Any], with_trace: bool = True) -> str:
-    vals = item.get("values") or []
-    if not isinstance(vals, list):
-        vals = []
-
+def render_preline(item: Lines, with_trace: bool = True) -> str:
     out: List[str] = []
 
     if with_trace:
         out.append(_trace_line(item))
 
-    for v in vals:
+    for v in item.values:
         out.append(latex_escape(v) + r"\\")
 
     return "\n".join(out)
 
-def render_premise(item: Dict[str, Any], with_trace: bool = True) -> str:
-    content = item.get("content") or []
-    if not isinstance(content, list):
-        content = []
-
+def render_premise(item: Premise, with_trace: bool = True) -> str:
     out: List[str] = []
 
     if with_trace:
@@ -318,11 +171,11 @@ def render_premise(item: Dict[str, Any], with_trace: bool = True) -> str:
 
     out.append(r"\begin{premisebox}")
 
-    for child in content:
-        if not isinstance(child, dict):
+    for child in item.content:
+        if isinstance(child, Stray):
             continue
 
-        t = child.get("type")
+        t = child.type
 
         if t == "preline":
             out.append(render_preline(child, with_trace=with_trace))
@@ -333,32 +186,18 @@ def render_premise(item: Dict[str, Any], with_trace: bool = True) -> str:
         else:
             if with_trace:
                 out.append(_trace_line(child))
-            out.append(rf"% [WARN] unknown premise content type: {latex_escape(t)}")
+            out.append(rf"% [WARN] unknown premise content type: {latex_escape(_raw_type(child))}")
 
     out.append(r"\end{premisebox}")
 
     return "\n\n".join(out)
 
-def render_choices(item: Dict[str, Any], with_trace: bool = True) -> str:
-    style = item.get("style", "normal")
-    values = item.get("values") or []
-    if not isinstance(values, list):
-        values = []
-
-    # legacy alias: space -> sep
-    sep = item.get("sep", None)
-    if sep is None:
-        sep = item.get("space", None)
-
+def render_choices(item: Choices, with_trace: bool = True) -> str:
     opts: List[str] = []
-    if style == "inline":
+    if item.inline:
         opts.append("type=inline")
-        if sep is not None:
-            try:
-                opts.append(f"sep={int(round(float(sep)))}")
-            except Exception:
-                # leave it off; validator should have caught it
-                pass
+        if item.sep is not None:
+            opts.append(f"sep={item.sep}")
     else:
         opts.append("type=normal")
 
@@ -371,42 +210,29 @@ def render_choices(item: Dict[str, Any], with_trace: bool = True) -> str:
     out.append(rf"\begin{{choices}}{opt}")
 
     # Each option: emit trace + \citem{label}{text}
-    for v in values:
-        if isinstance(v, str):
-            # simplest representation
-            if with_trace:
-                out.append("%% type=choiceitem tag=? src=?")
-            out.append(rf"\citem{{}}{{{latex_escape(v)}}}")
-            continue
-
-        if not isinstance(v, dict):
-            if with_trace:
-                out.append("%% type=choiceitem tag=? src=?")
-            out.append(rf"\citem{{}}{{{latex_escape(str(v))}}}")
-            continue
-
+    for v in item.options:
         if with_trace:
-            out.append(_trace_line({"type": "choiceitem", "tag": v.get("tag", "select"), "src": v.get("src", {})}))
-
-        label = v.get("label", "")
-        text = v.get("text", "")
-        out.append(rf"\citem{{{latex_escape(label)}}}{{{latex_escape(text)}}}")
+            out.append(f"%% type=choiceitem tag={v.tag} src={_src_loc(v.src)}")
+        out.append(rf"\citem{{{latex_escape(v.label)}}}{{{latex_escape(v.text)}}}")
 
     out.append(r"\end{choices}")
     return "\n".join(out)
 
 
-def render_content_list(content: Any, with_trace: bool = True) -> str:
+def _raw_type(item: Element) -> Any:
+    # WARN には JSON の type をそのまま出す（trace 側は欠けていれば "?"）
+    return item.data.get("type") if isinstance(item, Unknown) else item.type
+
+
+def render_content_list(content: tuple[Node, ...], with_trace: bool = True) -> str:
     parts: List[str] = []
-    if not isinstance(content, list):
-        content = []
 
     for item in content:
-        if not isinstance(item, dict):
-            parts.append(rf"% [WARN] non-dict content item: {latex_escape(item)}")
+        if isinstance(item, Stray):
+            parts.append(rf"% [WARN] non-dict content item: {latex_escape(item.value)}")
             continue
 
-        t = item.get("type")
+        t = item.type
         if t == "choices":
             parts.append(render_choices(item, with_trace=with_trace))
         elif t == "text":
@@ -425,7 +251,7 @@ def render_content_list(content: Any, with_trace: bool = True) -> str:
             # Keep a trace even for unknown types.
             if with_trace:
                 parts.append(_trace_line(item))
-            parts.append(rf"% [WARN] unknown content type: {latex_escape(t)}")
+            parts.append(rf"% [WARN] unknown content type: {latex_escape(_raw_type(item))}")
 
     return "\n\n".join(parts)
 
@@ -456,8 +282,8 @@ def build_cover_footer(metainfo: dict) -> str:
 # Document generation
 # =========================
 
-def _q_loc(q: Dict[str, Any]) -> str:
-    return _src_loc(q.get("src"))
+def _q_loc(q: Question) -> str:
+    return _src_loc(q.src)
 
 
 _TRAILING_DROP = re.compile(
@@ -480,51 +306,110 @@ def trim_trailing_page_controls(lines: list[str]) -> None:
             continue
         break
 
+def render_question_lines(q: Question, with_trace: bool = True) -> List[str]:
+    """大問1つ分（QBEGIN〜QEND）の行。本文では "\n\n" で連結される。"""
+    out: List[str] = []
+
+    # QBEGIN trace
+    if with_trace:
+        out.append(f"%% QBEGIN qid={q.qid} no={q.number} tag={q.tag} src={_q_loc(q)}")
+
+    out.append(rf"\begin{{question}}{{{latex_escape(q.question)}}}")
+    out.append(render_content_list(q.content, with_trace=with_trace))
+
+    # subquestions container (subquestion only switches mode + indent)
+    if q.subquestions:
+        if with_trace:
+            out.append(f"%% SUBBEGIN parent_qid={q.qid} src={_q_loc(q)}")
+
+        sub_open = False
+        def open_sub() -> None:
+            nonlocal sub_open
+            if not sub_open:
+                out.append(r"\begin{subquestion}")
+                sub_open = True
+
+        def close_sub() -> None:
+            nonlocal sub_open
+            if sub_open:
+                out.append(r"\end{subquestion}")
+                sub_open = False
+
+        for sq in q.subquestions:
+            # allow controls in subquestions list
+            if isinstance(sq, VSpace):
+                open_sub()
+                out.append(render_vspace(sq, with_trace=with_trace))
+                continue
+            if isinstance(sq, PageBreak):
+                # IMPORTANT: avoid \newpage inside list env
+                close_sub()
+                out.append(render_pagebreak(sq, with_trace=with_trace))
+                continue
+
+            if not sq.question:
+                continue
+
+            open_sub()
+            if with_trace:
+                out.append(f"%% SQBEGIN tag={sq.tag} src={_src_loc(sq.src)}")
+
+            out.append(rf"\begin{{question}}{{{latex_escape(sq.question)}}}")
+            out.append(render_content_list(sq.content, with_trace=with_trace))
+            out.append(r"\end{question}")
+
+            if with_trace:
+                out.append("%% SQEND")
+
+        close_sub()
+        if with_trace:
+            out.append("%% SUBEND")
+
+    out.append(r"\end{question}")
+
+    # QEND trace
+    if with_trace:
+        out.append(f"%% QEND qid={q.qid} src={_q_loc(q)}")
+
+    return out
+
+
 def generate_version_tex(data: Dict[str, Any], version: str = "A", include_cover: bool = False, with_trace: bool = True) -> str:
     versions = data.get("versions", []) or []
     v = next((x for x in versions if x.get("version") == version), None)
     if not v:
         raise ValueError(f"version {version} not found")
 
-    out: List[str] = []
+    return render_version_tex(build_exam_version(v), include_cover=include_cover, with_trace=with_trace)
 
-    for q in v.get("questions", []) or []:
-        if not isinstance(q, dict):
-            continue
 
-        qtype = q.get("type")
+def render_version_tex(
+    ev: ExamVersion,
+    include_cover: bool = False,
+    with_trace: bool = True,
+    *,
+    question_tex: Callable[[Question, bool], List[str]] = render_question_lines,
+) -> str:
+    """
+    1版分の body.tex。question_tex は大問1つ分の行を返す
+    （既定はその場で描画。断片キャッシュ使用時は \input 行を返す）。
+    """
+    out: List[str] = []
 
+    for q in ev.questions:
         # cover
-        if qtype == "cover":
+        if isinstance(q, Cover):
             if include_cover:
                 # JSON cover -> LaTeX title page
-                title = q.get("title") or q.get("subject") or ""
-
-                notes = q.get("notes")
-                if notes is None:
-                    notes = q.get("instruction")  # legacy alias
-                if notes is None:
-                    notes = ""
-
-                items = []
-                if isinstance(notes, list):
-                    items = [str(x).strip() for x in notes if str(x).strip()]
-                else:
-                    # 改行で分割して \item 化
-                    items = [line.strip() for line in str(notes).splitlines() if line.strip()]
+                title = q.title or q.subject
 
+                # 空行を除いて \item 化
+                items = [x.strip() for x in q.notes if x.strip()]
                 notes_text = "\n".join([r"\item " + latex_escape(x) for x in items])
 
-                # if isinstance(notes, list):
-                #     notes_text = "\n".join(str(x) for x in notes)
-                # else:
-                #     notes_text = str(notes)
-
                 # ★ここ：footer_text を自動生成（JSON側に無ければ）
-                metainfo = v.get("metainfo") or {}
-                # version_no は JSON上のどこにあるかで選ぶ：
-                # 例：metainfo.verno を使う / もしくは versions の version を使う
-                footer_text = build_cover_footer(metainfo)
+                # version_no は metainfo.verno を使う
+                footer_text = build_cover_footer(ev.metainfo)
 
                 out.append(r"% --- COVER PAGE ---")
                 out.append(
@@ -535,100 +420,179 @@ def generate_version_tex(data: Dict[str, Any], version: str = "A", include_cover
 
 
         # root controls (top-level)
-        if qtype == "pagebreak":
+        if isinstance(q, PageBreak):
             out.append(render_pagebreak(q, with_trace=with_trace))
             out.append("")
             continue
-        if qtype == "vspace":
+        if isinstance(q, VSpace):
             out.append(render_vspace(q, with_trace=with_trace))
             out.append("")
             continue
 
         # premise block
-        if qtype == "premise":
+        if isinstance(q, Premise):
             out.append(render_premise(q, with_trace=with_trace))
             out.append("")
             continue
 
-        question = q.get("question", "")
-        if not question:
+        if not isinstance(q, Question) or not q.question:
             continue
 
-        # QBEGIN trace
-        if with_trace:
-            qid = q.get("qid", "")
-            no = q.get("number", "")
-            tag = q.get("tag", "?")
-            loc = _q_loc(q)
-            out.append(f"%% QBEGIN qid={qid} no={no} tag={tag} src={loc}")
-
-        out.append(rf"\begin{{question}}{{{latex_escape(question)}}}")
-        out.append(render_content_list(q.get("content", []), with_trace=with_trace))
-
-        # subquestions container (subquestion only switches mode + indent)
-        subs = q.get("subquestions", []) or []
-        if isinstance(subs, list) and subs:
-            if with_trace:
-                out.append(f"%% SUBBEGIN parent_qid={q.get('qid','')} src={_q_loc(q)}")
-
-            sub_open = False
-            def open_sub() -> None:
-                nonlocal sub_open
-                if not sub_open:
-                    out.append(r"\begin{subquestion}")
-                    sub_open = True
-
-            def close_sub() -> None:
-                nonlocal sub_open
-                if sub_open:
-                    out.append(r"\end{subquestion}")
-                    sub_open = False
-
-            for sq in subs:
-                if not isinstance(sq, dict):
-                    continue
-
-                # allow controls in subquestions list
-                if sq.get("type") == "vspace":
-                    open_sub()
-                    out.append(render_vspace(sq, with_trace=with_trace))
-                    continue
-                if sq.get("type") == "pagebreak":
-                    # IMPORTANT: avoid \newpage inside list env
-                    close_sub()
-                    out.append(render_pagebreak(sq, with_trace=with_trace))
-                    continue
-
-                sq_q = sq.get("question", "")
-                if not sq_q:
-                    continue
+        out.extend(question_tex(q, with_trace))
+        out.append("")
 
-                open_sub()
-                if with_trace:
-                    out.append(f"%% SQBEGIN tag={sq.get('tag','?')} src={_src_loc(sq.get('src'))}")
+    # ★ここで末尾の pagebreak/vspace を削除（空白最終ページ対策）
+    trim_trailing_page_controls(out)
+    return "\n\n".join(out).strip() + "\n"
 
-                out.append(rf"\begin{{question}}{{{latex_escape(sq_q)}}}")
-                out.append(render_content_list(sq.get("content", []), with_trace=with_trace))
-                out.append(r"\end{question}")
+def render_question_preview_tex(ev: ExamVersion, qid: str, with_trace: bool = True) -> str:
+    """
+    --only 用：qid の大問1つだけの body.tex。
+    番号は本番と同じになるよう qno を合わせる（cover は出さない）。
+    """
+    q = next((x for x in ev.questions if isinstance(x, Question) and str(x.qid) == str(qid)), None)
+    if q is None or not q.question:
+        raise ValueError(f"qid={qid} の大問が version {ev.version} にありません。")
 
-                if with_trace:
-                    out.append("%% SQEND")
+    out: List[str] = []
+    number = str(q.number).strip()
+    if number.isdigit() and int(number) > 0:
+        out.append(rf"\setcounter{{qno}}{{{int(number) - 1}}}")
+    out.extend(render_question_lines(q, with_trace=with_trace))
+    return "\n\n".join(out) + "\n"
 
-            close_sub()
-            if with_trace:
-                out.append("%% SUBEND")
 
-        out.append(r"\end{question}")
+# =========================
+# Question fragments (latex/<ver>/q/<qid>.tex)
+# =========================
+FRAGMENT_INDEX_NAME = "index.json"
+
+_render_code_hash_cache: list = []
+
+
+def _render_code_hash() -> str:
+    """描画コード（make_latex.py / exam_model.py / texescape.py）の hash。変更されたら断片を作り直す。"""
+    if not _render_code_hash_cache:
+        h = hashlib.sha256()
+        for name in ("make_latex.py", "exam_model.py", "texescape.py"):
+            h.update((Path(__file__).resolve().parent / name).read_bytes())
+        _render_code_hash_cache.append(h.hexdigest())
+    return _render_code_hash_cache[0]
+
+
+def question_fragment_hash(qdict: Dict[str, Any], with_trace: bool) -> str:
+    """大問の JSON（番号・src も含む）と描画コード・trace 有無から断片の hash を作る。"""
+    payload = json.dumps(
+        [_render_code_hash(), with_trace, qdict],
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _fragment_name(qid: Any, used: set) -> str:
+    # \input に渡すので英数字と _ - 以外は _ にする。重複は _2, _3 ...
+    base = re.sub(r"[^0-9A-Za-z_-]", "_", str(qid)) or "q"
+    name = base
+    n = 2
+    while name in used:
+        name = f"{base}_{n}"
+        n += 1
+    used.add(name)
+    return name
+
+
+def load_fragment_index(frag_dir: Path) -> Dict[str, str]:
+    """断片名 -> hash。無い・壊れている場合は空。"""
+    try:
+        return json.loads((frag_dir / FRAGMENT_INDEX_NAME).read_text(encoding="utf-8")).get("fragments") or {}
+    except (OSError, ValueError, AttributeError):
+        return {}
 
-        # QEND trace
-        if with_trace:
-            out.append(f"%% QEND qid={q.get('qid','')} src={_q_loc(q)}")
 
-        out.append("")
+def save_fragment_index(frag_dir: Path, index: Dict[str, str]) -> None:
+    frag_dir.mkdir(parents=True, exist_ok=True)
+    (frag_dir / FRAGMENT_INDEX_NAME).write_text(
+        json.dumps({"fragments": index}, ensure_ascii=False, indent=1),
+        encoding="utf-8",
+    )
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """内容が同じなら書かない（mtime を変えない）。書いたら True。"""
+    try:
+        if path.read_text(encoding="utf-8") == text:
+            return False
+    except OSError:
+        pass
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return True
+
+
+def write_tex_with_source_map(path: Path, text: str) -> bool:
+    """
+    .tex と、その trace コメントから作ったソースマップ <name>.texmap.json（texdiag）を書く。
+    .tex が同じでサイドカーもあれば何も書かない。書いたら True。
+    """
+    sidecar = source_map_path(path)
+    if not write_if_changed(path, text) and sidecar.exists():
+        return False
+    sidecar.write_text(dumps_source_map(path.name, build_source_map(text)), encoding="utf-8")
+    return True
+
+
+def write_question_fragments(
+    ev: ExamVersion,
+    question_dicts: List[Dict[str, Any]],
+    frag_dir: Path,
+    with_trace: bool,
+    stats: Dict[str, int],
+) -> Callable[[Question, bool], List[str]]:
+    """
+    大問ごとに frag_dir/<qid>.tex を書き、render_version_tex に渡す question_tex を返す。
+
+    question_dicts : ev.questions と同じ並びの JSON（build_exam_version に渡した dict）
+    stats          : "reused" / "written" / "removed" の件数を加算する
+
+    hash が index と同じ断片は描画も書き込みもしない（バイト単位で同じまま）。
+    """
+    old_index = load_fragment_index(frag_dir)
+    index: Dict[str, str] = {}
+    names: Dict[int, str] = {}
+    used: set = set()
+
+    for q, qdict in zip(ev.questions, question_dicts):
+        if not isinstance(q, Question) or not q.question:
+            continue
+
+        name = _fragment_name(q.qid, used)
+        names[id(q)] = name
+        h = question_fragment_hash(qdict, with_trace)
+        index[name] = h
+
+        path = frag_dir / f"{name}.tex"
+        if old_index.get(name) == h and path.exists():
+            stats["reused"] = stats.get("reused", 0) + 1
+            continue
+
+        write_tex_with_source_map(path, "\n\n".join(render_question_lines(q, with_trace=with_trace)) + "\n")
+        stats["written"] = stats.get("written", 0) + 1
+
+    # 無くなった大問の断片を消す
+    for name in old_index.keys() - index.keys():
+        (frag_dir / f"{name}.tex").unlink(missing_ok=True)
+        source_map_path(frag_dir / f"{name}.tex").unlink(missing_ok=True)
+        stats["removed"] = stats.get("removed", 0) + 1
+
+    save_fragment_index(frag_dir, index)
+
+    def question_tex(q: Question, with_trace: bool) -> List[str]:
+        return [rf"\input{{{LATEX_FRAGMENT_DIR_NAME}/{names[id(q)]}}}"]
+
+    return question_tex
 
-    # ★ここで末尾の pagebreak/vspace を削除（空白最終ページ対策）
-    trim_trailing_page_controls(out)
-    return "\n\n".join(out).strip() + "\n"
 
 # def project_root() -> Path:
 #     # scripts/ の1つ上を root とみなす
@@ -654,10 +618,10 @@ def generate_version_tex(data: Dict[str, Any], version: str = "A", include_cover
 #     return vers if vers else ["A"]
 
 def load_versions_from_json_path(json_path: Path) -> List[str]:
-    if not json_path.exists():
+    if not exam_json_exists(json_path):
         raise FileNotFoundError(f"work json not found: {json_path}")
 
-    data = json.loads(json_path.read_text(encoding="utf-8"))
+    data = load_exam_index(json_path)
     vers = []
     for v in (data.get("versions") or []):
         vv = v.get("version")
@@ -724,9 +688,10 @@ def make_tex_header_comment(
     json_path: Path,
     version: str,
     metainfo: dict,
+    features: tuple[str, ...] = (),
 ) -> str:
     """
-    TeX冒頭に生成元情報をコメントとして入れる。
+    TeX冒頭に生成元情報と、使っている機能（make_pdf がプリアンブルを選ぶ）をコメントとして入れる。
     """
     source_hash = metainfo.get("source_excel_hash") or metainfo.get("hash") or ""
 
@@ -738,6 +703,7 @@ def make_tex_header_comment(
         f"% source_json_path: {json_path}",
         f"% qpattern: {metainfo.get('qpattern', '')}",
         f"% fsyear: {metainfo.get('fsyear', '')}",
+        f"% features: {','.join(features)}",
         "",
     ])
 
@@ -746,6 +712,9 @@ def main() -> None:
     add_subject_arg(ap)
     ap.add_argument("--nocover", action="store_true", help="表紙を出力しない")
     ap.add_argument("--notrace", action="store_true", help="traceコメントを出力しない")
+    ap.add_argument("--no-fragments", action="store_true", help="大問ごとの断片（q/<qid>.tex）を使わず body.tex に全部書く")
+    ap.add_argument("--only", metavar="QID", help="指定した qid の大問だけをプレビュー用に書き出す（make_pdf --preview で確認）")
+    ap.add_argument("--version", help="この版だけを出力する（--only の既定は先頭の版）")
     args = ap.parse_args()
 
     exam_context = load_exam_context(args.subject, load_workbook=False)
@@ -762,29 +731,70 @@ def main() -> None:
     print(f"試験コマ番号: {exam_context.exam_koma_no}")
     print(f"入力JSON: {json_path}")
 
-    if not json_path.exists():
+    if not exam_json_exists(json_path):
         raise FileNotFoundError(
             f"JSONファイルが見つかりません。\n"
             f"先に make_json.py を実行してください。\n"
             f"JSON path: {json_path}"
         )
 
-    data = json.loads(json_path.read_text(encoding="utf-8"))
+    # hash・版一覧・metainfo は index だけで確認し、本文は版ごとに読む
+    data = load_exam_index(json_path)
 
     source_excel_hash = require_versions_same_source_hash(data, json_path)
     print(f"source_excel_hash: {source_excel_hash}")
 
     vers = load_versions_from_json_path(json_path)
+    if args.version:
+        if args.version not in vers:
+            raise ValueError(f"version {args.version} はJSONにありません（{','.join(vers)}）。")
+        vers = [args.version]
     print(f"出力版: {','.join(vers)}")
 
+    if args.only:
+        ver = vers[0]
+
+        ev = build_exam_version(load_exam_version(json_path, ver, with_trace=(not args.notrace)))
+        tex = make_tex_header_comment(
+            subject=subject,
+            json_path=json_path,
+            version=ver,
+            metainfo=get_metainfo_for_version(data, ver),
+            features=exam_features(ev),
+        ) + render_question_preview_tex(ev, args.only, with_trace=(not args.notrace))
+
+        outpath = preview_body_path(work_dir, sheetname, ver, args.only)
+        write_tex_with_source_map(outpath, tex)
+        print(f"✅ preview: {outpath}")
+        print(f"   python scripts/make_pdf.py {subject} --preview {args.only} --version {ver}")
+        return
+
     for ver in vers:
         outpath = work_dir / "latex" / ver / f"{sheetname}_{ver}_body.tex"
 
-        tex = generate_version_tex(
-            data,
-            ver,
+        # trace コメントを出すときだけ srcmap（--compact 時）を読み込む
+        block = load_exam_version(json_path, ver, with_trace=(not args.notrace))
+        ev = build_exam_version(block)
+
+        question_tex = render_question_lines
+        if not args.no_fragments:
+            # 変わった大問の断片だけ書き直し、body.tex からは \input する
+            question_dicts = [q for q in (block.get("questions") or []) if isinstance(q, dict)]
+            stats: Dict[str, int] = {}
+            question_tex = write_question_fragments(
+                ev, question_dicts, latex_fragment_dir(outpath), not args.notrace, stats,
+            )
+            print(
+                f"断片({ver}): 再利用 {stats.get('reused', 0)} / 書き込み {stats.get('written', 0)}"
+                f" / 削除 {stats.get('removed', 0)}"
+            )
+        del block
+
+        tex = render_version_tex(
+            ev,
             include_cover=(not args.nocover),
             with_trace=(not args.notrace),
+            question_tex=question_tex,
         )
 
         metainfo = get_metainfo_for_version(data, ver)
@@ -793,12 +803,13 @@ def main() -> None:
             json_path=json_path,
             version=ver,
             metainfo=metainfo,
+            features=exam_features(ev),
         ) + tex
 
-        outpath.parent.mkdir(parents=True, exist_ok=True)
-        outpath.write_text(tex, encoding="utf-8")
-
-        print(f"✅ wrote: {outpath}")
+        if write_tex_with_source_map(outpath, tex):
+            print(f"✅ wrote: {outpath}")
+        else:
+            print(f"✅ unchanged: {outpath}")
 
 
 if __name__ == "__main__":
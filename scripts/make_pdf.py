@@ -14,33 +14,99 @@ It only:
   - finds work/latex/{version}/{subject}_{version}_body.tex
   - checks source_excel_hash between JSON and body.tex
   - creates a temporary build directory under /private/tmp/exam_build/{subject}/
-  - copies templates/body.tex/images into the temporary build directory
-  - injects graphicspath for the temporary images directory
+    (or, with --persistent, reuses {DIR}/{subject}/ so .aux files survive between runs)
+  - links body.tex (+ question fragments q/) into the temporary build directory and exam_dir/images
+    next to it (hard links / symlinks; copies only where linking is not possible)
+  - images used by \\image are linked to cached copies downsampled to the print resolution
+    (width ratio x \\textwidth x --image-dpi, metadata stripped; imageprep.py, needs Pillow)
+  - reads templates/latex in place through TEXINPUTS (nothing is copied or rewritten)
+  - sets graphicspath for the temporary images directory in the generated main tex
+  - loads only the preamble fragments for the features the body uses (the "% features:" line that
+    make_latex writes: code / premise / math / image / ruby; all of them if the line is missing)
+  - dumps the static preamble (templates/latex) into a cached format file (one per feature set)
+    and compiles with -fmt
+    (falls back to the normal compile when the dump or the compile with it fails)
   - creates full tex in the temporary build directory
-  - runs lualatex in the temporary build directory
-  - copies only the generated PDF back to exam_dir/pdf/{version}/
+  - runs lualatex in the temporary build directory (until .aux/.toc/.out and the log say it is stable)
+  - copies only the generated PDF back to exam_dir/pdf/{version}/ (skipped when the bytes are unchanged)
+  - makes the PDF reproducible: SOURCE_DATE_EPOCH (default 2000-01-01) for the creation date and
+    a /ID derived from source_excel_hash and the version, so identical inputs give identical bytes
+  - reports errors / overfull and underfull boxes / missing images as Sheet!R<row> using the
+    source maps (*.texmap.json) written by make_latex; a failed compile gets one more pass
+    without -halt-on-error so that every error is in the same report
+  - keeps built PDFs in a content-addressed cache (body.tex + fragments, templates, graphicspath,
+    referenced images); a version whose inputs are unchanged is copied from the cache instead of compiled
 
 Usage:
   python scripts/make_pdf.py 1020201
-  python scripts/make_pdf.py 1020201 --runs 2
+  python scripts/make_pdf.py 1020201                # lualatex は .aux 等が収束するまで（最大 --max-runs 回）
+  python scripts/make_pdf.py 1020201 --runs 2       # 回数を固定する
   python scripts/make_pdf.py 1020201 --keeptemp
+  python scripts/make_pdf.py 1020201 --jobs 2      # A/B を並列にコンパイル（既定は版数とCPU数の小さい方）
+  python scripts/make_pdf.py 1020201 --batch       # A/B を1つの文書で1回コンパイルして版ごとに分割（pypdf）
+  python scripts/make_pdf.py 1020201 --no-fmt      # プリアンブルの事前ダンプ format を使わない
+  python scripts/make_pdf.py 1020201 --all-features   # body の "% features:" を無視してプリアンブルを全部読む
+  python scripts/make_pdf.py 1020201 --no-cache    # 入力が同じでも PDF キャッシュを使わずにコンパイルする
+  python scripts/make_pdf.py 1020201 --image-dpi 200   # 画像を 200dpi 相当に縮小して使う（既定 300、--no-imageprep で元のまま）
+  python scripts/make_pdf.py 1020201 --persistent  # ビルドフォルダを残して次回も使う（.aux があれば1回で済むことが多い）
+  python scripts/make_pdf.py 1020201 --persistent /dev/shm/exam_build --clean   # 置き場所を指定・作り直す
+  python scripts/make_pdf.py 1020201 --preview Q012 [--version B]   # make_latex --only の1問だけ
 """
 
 from __future__ import annotations
 
 import argparse
-import json
+import hashlib
+import importlib.util
+import os
+import re
 import shutil
 import subprocess
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from typing import List, Optional
 
-from exam_utils import add_subject_arg, load_exam_context
+from exam_utils import (
+    add_subject_arg, load_exam_context, exam_json_exists, load_exam_index, latex_fragment_dir,
+    preview_body_path, source_date_epoch, pdf_document_id, copy_if_changed, replace_if_changed,
+)
+from exam_model import FEATURES
+from imageprep import DEFAULT_DPI, ImagePrep, image_width_ratios, pillow_available, target_pixels
+from pdfcache import DEFAULT_MAX_BYTES, PdfCache, pdf_cache_key
+from texdiag import diagnose_log, format_report, source_map_path
 
 
 TEMP_BUILD_BASE = Path("/private/tmp/exam_build")
 
+# プリアンブルのダンプ format（科目をまたいで使い回すので temp_root の外に置く）
+FORMAT_CACHE_DIR = TEMP_BUILD_BASE / "_formats"
+FORMAT_NAME = "exampreamble"
+FORMAT_BROKEN_MARK = "BROKEN"
+
+# ビルド済み PDF のキャッシュ（pdfcache.py）
+PDF_CACHE_DIR = TEMP_BUILD_BASE / "_pdfcache"
+
+# 印刷解像度に縮小した画像のキャッシュ（imageprep.py）
+IMAGE_CACHE_DIR = TEMP_BUILD_BASE / "_images"
+
+# preamble.tex の geometry（A4, left/right=27.68mm）での \textwidth
+LATEX_TEXT_WIDTH_IN = (210 - 2 * 27.68) / 25.4
+
+# --persistent のビルド領域（<DIR>/<subject>/<ver>）。--clean か GC でしか消さない
+PERSISTENT_BUILD_BASE = TEMP_BUILD_BASE / "_persistent"
+PERSISTENT_MAX_AGE_DAYS = 14
+
+TEMPLATE_FILES = [
+    "main.tpl.tex", "preamble.tex", "styles.tex", "macros.tex",
+    # preamble.tex が \ExamIfFeature で必要なときだけ読む断片
+    "preamble_code.tex", "preamble_premise.tex", "preamble_math.tex", "preamble_ruby.tex",
+]
+
+# ビルドフォルダ temp_root/<ver> から temp_root/images を見る
+GRAPHICSPATH = "../images/"
+
 
 def project_root() -> Path:
     # scripts/ の1つ上を root とみなす
@@ -56,11 +122,32 @@ def write_text(p: Path, s: str) -> None:
     p.write_text(s, encoding="utf-8")
 
 
-def run_cmd(cmd: List[str], cwd: Optional[Path] = None) -> None:
-    print("▶", " ".join(cmd))
-    r = subprocess.run(cmd, cwd=str(cwd) if cwd else None)
-    if r.returncode != 0:
-        raise RuntimeError(f"Command failed (code={r.returncode}): {' '.join(cmd)}")
+def run_cmd(cmd: List[str], cwd: Optional[Path] = None, prefix: str = "", env: Optional[dict] = None) -> None:
+    """
+    コマンドを実行する。prefix があれば出力を1行ずつ prefix 付きで流す
+    （並列ビルドで版ごとのログが混ざっても読めるように）。
+    """
+    print(f"{prefix}▶", " ".join(cmd), flush=True)
+    if not prefix:
+        r = subprocess.run(cmd, cwd=str(cwd) if cwd else None, env=env)
+        returncode = r.returncode
+    else:
+        with subprocess.Popen(
+            cmd,
+            cwd=str(cwd) if cwd else None,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        ) as proc:
+            assert proc.stdout is not None
+            for line in proc.stdout:
+                print(f"{prefix}{line}", end="", flush=True)
+        returncode = proc.returncode
+    if returncode != 0:
+        raise RuntimeError(f"Command failed (code={returncode}): {' '.join(cmd)}")
 
 
 def find_body_tex(work_dir: Path, sheet: str, version: str) -> Path:
@@ -74,16 +161,17 @@ def find_body_tex(work_dir: Path, sheet: str, version: str) -> Path:
 
 def load_json_data(json_path: Path) -> dict:
     """
-    JSONファイルを読み込む。
+    JSONの index（版一覧と版ごとの metainfo）を読み込む。
+    make_pdf は hash の照合だけなので、問題本文は読まない。
     """
-    if not json_path.exists():
+    if not exam_json_exists(json_path):
         raise FileNotFoundError(
             f"JSONファイルが見つかりません。\n"
             f"先に make_json.py を実行してください。\n"
             f"JSON path: {json_path}"
         )
 
-    return json.loads(json_path.read_text(encoding="utf-8"))
+    return load_exam_index(json_path)
 
 
 def get_json_source_hash_by_version(data: dict, version: str) -> str:
@@ -132,6 +220,30 @@ def get_body_tex_source_hash(body_path: Path) -> str:
     )
 
 
+def get_body_tex_features(body_path: Path) -> Optional[tuple[str, ...]]:
+    """
+    body.tex 冒頭コメントの使っている機能（make_latex.py の "% features: code,math"）。
+    古い body.tex で行が無ければ None（プリアンブルを全部読む）。
+    """
+    for line in body_path.read_text(encoding="utf-8").splitlines()[:30]:
+        line = line.strip()
+        if line.startswith("% features:"):
+            names = {v.strip() for v in line.split(":", 1)[1].split(",")}
+            return tuple(f for f in FEATURES if f in names)
+    return None
+
+
+def merge_features(bodies: List[Path]) -> Optional[tuple[str, ...]]:
+    """複数の body.tex（A/B 版）の機能の和。1つでも分からなければ None。"""
+    found: set[str] = set()
+    for body_path in bodies:
+        features = get_body_tex_features(body_path)
+        if features is None:
+            return None
+        found.update(features)
+    return tuple(f for f in FEATURES if f in found)
+
+
 def require_body_matches_json(body_path: Path, json_data: dict, version: str) -> str:
     """
     body.tex の source_excel_hash と JSON metainfo の source_excel_hash が一致するか確認する。
@@ -152,30 +264,73 @@ def require_body_matches_json(body_path: Path, json_data: dict, version: str) ->
     return body_hash
 
 
-def copy_templates_to(build_dir: Path) -> None:
-    """
-    templates/latex を build_dir にコピー。
-    \input{preamble.tex} 等が同一ディレクトリを参照できるようにするため。
-    """
-    root = project_root()
-    tdir = root / "templates" / "latex"
+def template_dir() -> Path:
+    tdir = project_root() / "templates" / "latex"
     if not tdir.exists():
         raise FileNotFoundError(f"templates/latex not found: {tdir}")
+    for name in TEMPLATE_FILES:
+        if not (tdir / name).exists():
+            raise FileNotFoundError(f"template missing: {tdir / name}")
+    return tdir
 
-    for name in ["main.tpl.tex", "preamble.tex", "styles.tex", "macros.tex"]:
-        src = tdir / name
-        if not src.exists():
-            raise FileNotFoundError(f"template missing: {src}")
-        shutil.copy2(src, build_dir / name)
+
+def latex_env() -> dict:
+    """
+    lualatex 用の環境変数。TEXINPUTS に templates/latex を足して、
+    \\input{preamble.tex} 等をコピーせずにそのまま読ませる（ビルドフォルダが先）。
+    末尾の区切りは kpathsea の既定パスを残すため。
+    """
+    env = os.environ.copy()
+    paths = [".", str(template_dir())]
+    if env.get("TEXINPUTS"):
+        paths.append(env["TEXINPUTS"])
+    env["TEXINPUTS"] = os.pathsep.join(paths) + ("" if paths[-1].endswith(os.pathsep) else os.pathsep)
+    # PDF の CreationDate / ModDate を固定する（\today は FORCE_SOURCE_DATE が無いので今日のまま）
+    env["SOURCE_DATE_EPOCH"] = str(source_date_epoch())
+    return env
+
+
+def link_file(src: Path, dst: Path) -> None:
+    """dst を src のハードリンクにする。できなければ（別ボリューム等）シンボリックリンク、最後はコピー。"""
+    if dst.is_symlink() or dst.exists():
+        dst.unlink()
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    try:
+        dst.symlink_to(src.resolve())
+    except OSError:
+        shutil.copy2(src, dst)
 
 
-def copy_images_to_temp(exam_dir: Path, temp_root: Path) -> None:
+def link_dir(src: Path, dst: Path) -> None:
+    """dst を src へのシンボリックリンクにする。できなければコピー。"""
+    if dst.is_symlink() or dst.is_file():
+        dst.unlink()
+    elif dst.exists():
+        shutil.rmtree(dst)
+    try:
+        dst.symlink_to(src.resolve(), target_is_directory=True)
+    except OSError:
+        shutil.copytree(src, dst)
+
+
+def link_images_to_temp(
+    exam_dir: Path,
+    temp_root: Path,
+    image_prep: Optional[ImagePrep] = None,
+    width_ratios: Optional[dict[str, float]] = None,
+) -> None:
     """
-    exam_dir/images を temp_root/images にコピーする。
+    temp_root/images を exam_dir/images へのリンクにする（画像はコピーしない）。
+    image_prep があれば、\\image で使われる画像（width_ratios）は印刷解像度に縮小した
+    キャッシュへのリンクにする（フォルダごとではなくファイルごとのリンクになる）。
 
     一時ビルド構造:
       /private/tmp/exam_build/{subject}/
-        images/
+        images -> exam_dir/images
         A/
         B/
 
@@ -188,54 +343,82 @@ def copy_images_to_temp(exam_dir: Path, temp_root: Path) -> None:
         print(f"画像フォルダなし: {src_images}")
         return
 
-    if dst_images.exists():
-        shutil.rmtree(dst_images)
-
-    shutil.copytree(src_images, dst_images)
-    print(f"画像コピー: {src_images} -> {dst_images}")
+    if image_prep is None or not width_ratios:
+        link_dir(src_images, dst_images)
+        print(f"画像リンク: {dst_images} -> {src_images}")
+        return
 
+    if dst_images.is_symlink() or dst_images.is_file():
+        dst_images.unlink()
+    elif dst_images.exists():
+        shutil.rmtree(dst_images)
 
-def inject_graphicspath(build_dir: Path, graphicspath: str = "../images/") -> None:
+    prepared = 0
+    for src in sorted(src_images.rglob("*")):
+        rel = src.relative_to(src_images)
+        dst = dst_images / rel
+        if src.is_dir():
+            dst.mkdir(parents=True, exist_ok=True)
+            continue
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        use = src
+        ratio = width_ratios.get(rel.as_posix())
+        if ratio is not None:
+            use = image_prep.prepare(src, target_pixels(ratio, LATEX_TEXT_WIDTH_IN, image_prep.dpi))
+            prepared += use != src
+        link_file(use, dst)
+    print(f"画像リンク: {dst_images} -> {src_images}（{image_prep.dpi}dpi に縮小: {prepared}枚）")
+
+
+def build_full_tex(
+    build_dir: Path,
+    body_tex_filename: str,
+    out_tex_filename: str,
+    graphicspath: str = GRAPHICSPATH,
+    doc_id: str = "",
+    features: Optional[tuple[str, ...]] = None,
+) -> Path:
     """
-    preamble.tex に \graphicspath を注入する。
-
-    tempビルド構造:
-      temp_root/
-        images/
-        A/
-        B/
+    main.tpl.tex の @@BODY@@ を \\input{body_tex_filename} に差し替え、
+    \\begin{document} の直前で graphicspath（と doc_id があれば PDF の /ID）を設定した
+    compile-ready の .tex を作る。features があればプリアンブルはその機能の分だけ読む。
 
-    build_dir=A/B なので、画像フォルダへは ../images/。
+    \\csname endofdump\\endcsname から後ろはダンプ済み format を使うときも毎回実行される
+    （format を使わないときは \\relax）。
     """
-    preamble_path = build_dir / "preamble.tex"
-    if not preamble_path.exists():
-        raise FileNotFoundError(f"preamble.tex not found in build_dir: {preamble_path}")
+    out_tex = build_dir / out_tex_filename
+    write_text(
+        out_tex,
+        merge_main_tex(rf"\input{{{body_tex_filename}}}", graphicspath, trailer_id_tex(doc_id), features),
+    )
+    return out_tex
 
-    gsp = rf"\graphicspath{{{{{graphicspath}}}}}" + "\n"
 
-    preamble = read_text(preamble_path)
+def trailer_id_tex(doc_id: str) -> str:
+    """PDF の /ID を doc_id に固定する（既定では時刻とファイル名から作られる）。"""
+    if not doc_id:
+        return ""
+    return rf"\ifdefined\pdfvariable\pdfvariable trailerid {{[<{doc_id}> <{doc_id}>]}}\fi"
 
-    if "@@GRAPHICSPATH@@" in preamble:
-        preamble = preamble.replace("@@GRAPHICSPATH@@", gsp)
-    else:
-        # すでに graphicspath がある場合は二重追加しない
-        if r"\graphicspath" not in preamble:
-            preamble += "\n% --- auto inserted graphicspath ---\n" + gsp
 
-    write_text(preamble_path, preamble)
+def features_tex(features: Optional[tuple[str, ...]]) -> str:
+    """preamble.tex の \\ExamIfFeature が見る機能の一覧（None なら空 = 全部読む）。"""
+    if features is None:
+        return ""
+    return rf"\def\ExamFeatures{{{','.join(features)}}}" + "\n"
 
 
-def build_full_tex(build_dir: Path, body_tex_filename: str, out_tex_filename: str) -> Path:
+def merge_main_tex(
+    insert: str,
+    graphicspath: str = GRAPHICSPATH,
+    preamble_extra: str = "",
+    features: Optional[tuple[str, ...]] = None,
+) -> str:
     """
-    main.tpl.tex の @@BODY@@ を \input{body_tex_filename} に差し替えて
-    compile-ready の .tex を作る。
+    main.tpl.tex の @@BODY@@ を insert にして、graphicspath（と preamble_extra）を足した全文を返す。
+    features は \\documentclass の前に書く（format にもダンプされる）。
     """
-    main_tpl_path = build_dir / "main.tpl.tex"
-    if not main_tpl_path.exists():
-        raise FileNotFoundError(f"main.tpl.tex not found in build_dir: {main_tpl_path}")
-
-    main_tpl = read_text(main_tpl_path)
-    insert = rf"\input{{{body_tex_filename}}}"
+    main_tpl = features_tex(features) + read_text(template_dir() / "main.tpl.tex")
 
     if "@@BODY@@" in main_tpl:
         full = main_tpl.replace("@@BODY@@", insert)
@@ -243,21 +426,87 @@ def build_full_tex(build_dir: Path, body_tex_filename: str, out_tex_filename: st
         # 置換口が無い場合は事故回避で document 内先頭に挿入
         full = main_tpl.replace(r"\begin{document}", r"\begin{document}" + "\n" + insert + "\n")
 
-    out_tex = build_dir / out_tex_filename
-    write_text(out_tex, full)
-    return out_tex
+    gsp = rf"\graphicspath{{{{{graphicspath}}}}}"
+    return full.replace(
+        r"\begin{document}",
+        "\\csname endofdump\\endcsname\n" + gsp + "\n" + preamble_extra + "\n" + r"\begin{document}",
+        1,
+    )
+
+
+DEFAULT_MAX_RUNS = 4
+
+# 次のパスで結果が変わりうるファイル（前のパスの内容を読み込むもの）
+_RERUN_SUFFIXES = (".aux", ".toc", ".out", ".lof", ".lot")
+
+# LaTeX 本体・各パッケージの「もう一度」メッセージ
+_RERUN_RE = re.compile(
+    r"Rerun to get|Label\(s\) may have changed|Please (?:\(re\)|re)?run|Rerun LaTeX",
+    re.IGNORECASE,
+)
+
+
+def _rerun_file_hashes(build_dir: Path) -> dict[str, str]:
+    hashes: dict[str, str] = {}
+    for p in build_dir.iterdir():
+        if p.suffix in _RERUN_SUFFIXES and p.is_file():
+            hashes[p.name] = hashlib.sha256(p.read_bytes()).hexdigest()
+    return hashes
+
 
+def clear_rerun_files(build_dir: Path) -> None:
+    """前のパスの .aux 等を消す（次のコンパイルを空の状態から始める）。"""
+    for p in build_dir.iterdir():
+        if p.suffix in _RERUN_SUFFIXES:
+            p.unlink()
 
-def compile_lualatex(tex_path: Path, runs: int = 1) -> Path:
+
+def needs_rerun(tex_path: Path, before: dict[str, str], after: dict[str, str]) -> bool:
+    """
+    もう1パス必要か（latexmk と同じ考え方）。
+      - ログに Rerun 系のメッセージがある
+      - パスの前からあった .aux/.toc/.out/... の内容がパスで変わった
+    パスで新しくできたファイルだけでは回さない（内容が効く場合は LaTeX 側が
+    \\end{document} で Rerun 警告を出す）。
+    """
+    log_path = tex_path.with_suffix(".log")
+    if log_path.exists() and _RERUN_RE.search(log_path.read_text(encoding="utf-8", errors="replace")):
+        return True
+    return any(after.get(name) != h for name, h in before.items())
+
+
+def compile_lualatex(
+    tex_path: Path,
+    runs: int = 0,
+    prefix: str = "",
+    max_runs: int = DEFAULT_MAX_RUNS,
+    fmt: Optional[Path] = None,
+) -> Path:
     """
     build_dir で lualatex を回す。
+    runs > 0 ならその回数だけ、0 なら needs_rerun が False になるまで（最大 max_runs 回）。
+    fmt があればダンプ済みプリアンブルを -fmt で読み込む（本文の \\begin{document} までは読み飛ばされる）。
     """
     build_dir = tex_path.parent
-    for _ in range(max(1, runs)):
+    env = latex_env()
+    fmt_opt = [f"-fmt={fmt.with_suffix('')}"] if fmt else []
+    passes = runs if runs > 0 else max(1, max_runs)
+    for n in range(1, passes + 1):
+        before = _rerun_file_hashes(build_dir)
         run_cmd(
-            ["lualatex", "-file-line-error", "-interaction=nonstopmode", "-halt-on-error", tex_path.name],
+            ["lualatex", *fmt_opt, "-file-line-error", "-interaction=nonstopmode", "-halt-on-error", tex_path.name],
             cwd=build_dir,
+            prefix=prefix,
+            env=env,
         )
+        if runs > 0:
+            continue
+        if not needs_rerun(tex_path, before, _rerun_file_hashes(build_dir)):
+            print(f"{prefix}lualatex: {n} 回で収束", flush=True)
+            break
+    else:
+        if runs <= 0:
+            print(f"{prefix}⚠️  lualatex: {passes} 回で収束しませんでした（--max-runs）", flush=True)
 
     pdf_path = tex_path.with_suffix(".pdf")
     if not pdf_path.exists():
@@ -265,6 +514,442 @@ def compile_lualatex(tex_path: Path, runs: int = 1) -> Path:
     return pdf_path
 
 
+_PAGES_RE = re.compile(r"Output written on .*?\((\d+)\s+pages?", re.DOTALL)
+
+
+def latex_log_pages(log_path: Path) -> int | None:
+    """
+    lualatex の .log からページ数を取り出す（Overfull などは texdiag で見る）。
+    ログは79文字で折り返されるので、ページ数は改行をまたいで探す。
+    """
+    if not log_path.exists():
+        return None
+    m = _PAGES_RE.search(log_path.read_text(encoding="utf-8", errors="replace"))
+    return int(m.group(1)) if m else None
+
+
+def prepare_build_dir(build_dir: Path, body_path: Path, body_name: str) -> Path:
+    """
+    body.tex（+ 大問断片 q/）を build_dir にリンクする。templates は TEXINPUTS で読むので置かない。
+    build_dir に置いた body.tex のパスを返す。
+    """
+    build_dir.mkdir(parents=True, exist_ok=True)
+
+    dst_body = build_dir / body_name
+    link_file(body_path, dst_body)
+    if source_map_path(body_path).exists():
+        link_file(source_map_path(body_path), source_map_path(dst_body))
+
+    # body.tex が \input する大問断片 q/<qid>.tex
+    frag_dir = latex_fragment_dir(body_path)
+    if frag_dir.is_dir():
+        link_dir(frag_dir, latex_fragment_dir(dst_body))
+
+    return dst_body
+
+
+def build_preview(
+    exam_context,
+    json_data: dict,
+    qid: str,
+    version: str,
+    image_prep: Optional[ImagePrep] = None,
+) -> Path:
+    """
+    make_latex --only で書いた1問分の body.tex を、本番と同じ preamble/macros/styles で
+    1回だけコンパイルする。ページ数と Overfull を表示し、PDF のパスを返す。
+    """
+    sheet = exam_context.sheetname
+    body_path = preview_body_path(exam_context.work_dir, sheet, version, qid)
+    if not body_path.exists():
+        raise FileNotFoundError(
+            f"プレビュー用 body.tex がありません。\n"
+            f"先に make_latex.py {exam_context.subject} --only {qid} --version {version} を実行してください。\n"
+            f"body.tex: {body_path}"
+        )
+
+    source_hash = require_body_matches_json(body_path, json_data, version)
+    print(f"source_excel_hash({version}): {source_hash}")
+
+    temp_root = prepare_temp_root(f"{exam_context.subject}_preview")
+    link_images_to_temp(exam_context.exam_dir, temp_root, image_prep, image_width_ratios([body_path]))
+
+    build_dir = temp_root / version
+    prepare_build_dir(build_dir, body_path, body_path.name)
+    full_tex_path = build_full_tex(
+        build_dir,
+        body_path.name,
+        body_path.name.replace("_body.tex", ".tex"),
+        doc_id=pdf_document_id(source_hash, version, qid),
+        features=get_body_tex_features(body_path),
+    )
+
+    try:
+        temp_pdf_path = compile_lualatex(full_tex_path, runs=1)
+    except RuntimeError:
+        diagnose_failed_compile(full_tex_path)
+        raise
+
+    pages = latex_log_pages(full_tex_path.with_suffix(".log"))
+    print(f"ページ数: {pages if pages is not None else '?'}")
+    if not report_diagnostics(full_tex_path):
+        print("診断: Overfull / Underfull なし")
+
+    out_dir = exam_context.exam_dir / "pdf" / "preview"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    final_pdf_path = out_dir / temp_pdf_path.name
+    if not copy_if_changed(temp_pdf_path, final_pdf_path):
+        print(f"PDF は前回と同じです: {final_pdf_path}")
+    shutil.rmtree(temp_root, ignore_errors=True)
+    return final_pdf_path
+
+
+def report_diagnostics(tex_path: Path, prefix: str = "") -> list:
+    """ログを解析して Sheet!R.. 付きのレポートを表示し、<job>.diag.txt にも書く。"""
+    diags = diagnose_log(tex_path.with_suffix(".log"), tex_path.parent)
+    if diags:
+        report = format_report(diags)
+        write_text(tex_path.with_suffix(".diag.txt"), report + "\n")
+        for line in report.splitlines():
+            print(f"{prefix}{line}", flush=True)
+    return diags
+
+
+def diagnose_failed_compile(tex_path: Path, prefix: str = "", fmt: Optional[Path] = None) -> list:
+    """
+    -halt-on-error で止まったコンパイルを止めずにもう1回だけ回し、
+    最初のエラーより後ろのエラーもまとめてレポートする。
+    """
+    fmt_opt = [f"-fmt={fmt.with_suffix('')}"] if fmt else []
+    print(f"{prefix}🔎 エラーをまとめて探すために止めずにもう1回コンパイルします", flush=True)
+    subprocess.run(
+        ["lualatex", *fmt_opt, "-file-line-error", "-interaction=nonstopmode", tex_path.name],
+        cwd=str(tex_path.parent),
+        env=latex_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return report_diagnostics(tex_path, prefix)
+
+
+def compile_with_format_fallback(
+    tex_path: Path,
+    runs: int,
+    prefix: str,
+    max_runs: int,
+    fmt: Optional[Path],
+) -> Path:
+    """fmt 付きでコンパイルし、失敗したら fmt なしでやり直す。"""
+    try:
+        return compile_lualatex(tex_path, runs=runs, prefix=prefix, max_runs=max_runs, fmt=fmt)
+    except RuntimeError as e:
+        if fmt is None:
+            raise
+        # format 由来の失敗かもしれないので、format なしでやり直す
+        print(f"{prefix}⚠️  format でのコンパイルに失敗したので通常のコンパイルでやり直します: {e}", flush=True)
+        clear_rerun_files(tex_path.parent)
+        pdf_path = compile_lualatex(tex_path, runs=runs, prefix=prefix, max_runs=max_runs)
+        # 通常のコンパイルは通った = format のせい。次回からは使わない
+        mark_format_broken(fmt, str(e))
+        return pdf_path
+
+
+def build_version_pdf(
+    ver: str,
+    body_path: Path,
+    sheet: str,
+    temp_root: Path,
+    exam_dir: Path,
+    runs: int,
+    prefix: str = "",
+    max_runs: int = DEFAULT_MAX_RUNS,
+    fmt: Optional[Path] = None,
+    features: Optional[tuple[str, ...]] = None,
+) -> Path:
+    """
+    1版分：temp_root/<ver> を作ってコンパイルし、成功した PDF を exam_dir/pdf/<ver>/ へコピーする。
+    --jobs の並列ビルドではプロセスプールの中で呼ばれる（ビルドフォルダは版ごとに独立）。
+    """
+    # temp内のコンパイル先
+    build_dir = temp_root / ver
+    body_name = f"{sheet}_{ver}_body.tex"
+    prepare_build_dir(build_dir, body_path, body_name)
+
+    full_name = f"{sheet}_{ver}.tex"
+    doc_id = pdf_document_id(get_body_tex_source_hash(body_path), ver)
+    full_tex_path = build_full_tex(build_dir, body_name, full_name, doc_id=doc_id, features=features)
+    print(f"{prefix}✅ TeX merged: {full_tex_path}", flush=True)
+
+    try:
+        temp_pdf_path = compile_with_format_fallback(full_tex_path, runs, prefix, max_runs, fmt)
+    except RuntimeError:
+        diagnose_failed_compile(full_tex_path, prefix)
+        # 失敗したパスの .aux は次回（--persistent）の邪魔になるので消す。.log は残す
+        clear_rerun_files(build_dir)
+        raise
+    print(f"{prefix}🤩🤩🤩 PDF compiled in temp: {temp_pdf_path}", flush=True)
+    report_diagnostics(full_tex_path, prefix)
+
+    # 成功したPDFだけ元フォルダへコピーする（前回と同じバイト列ならコピーしない）
+    final_pdf_path = exam_dir / "pdf" / ver / temp_pdf_path.name
+    if copy_if_changed(temp_pdf_path, final_pdf_path):
+        print(f"{prefix}✅ PDF copied: {final_pdf_path}", flush=True)
+    else:
+        print(f"{prefix}✅ PDF unchanged: {final_pdf_path}", flush=True)
+    return final_pdf_path
+
+
+def build_versions(
+    jobs: List[tuple[str, Path]],
+    *,
+    sheet: str,
+    temp_root: Path,
+    exam_dir: Path,
+    runs: int,
+    max_workers: int,
+    max_runs: int = DEFAULT_MAX_RUNS,
+    fmt: Optional[Path] = None,
+    features: Optional[tuple[str, ...]] = None,
+) -> dict[str, Exception]:
+    """
+    版ごとのビルドを max_workers 並列で実行し、失敗した版 -> 例外 を返す。
+    1つが失敗しても残りの版は最後までビルドする。
+    """
+    failures: dict[str, Exception] = {}
+
+    if max_workers <= 1 or len(jobs) <= 1:
+        for ver, body_path in jobs:
+            try:
+                build_version_pdf(
+                    ver, body_path, sheet, temp_root, exam_dir, runs,
+                    max_runs=max_runs, fmt=fmt, features=features,
+                )
+            except Exception as e:
+                failures[ver] = e
+        return failures
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(
+                build_version_pdf, ver, body_path, sheet, temp_root, exam_dir, runs, f"[{ver}] ", max_runs, fmt, features,
+            ): ver
+            for ver, body_path in jobs
+        }
+        for fut in as_completed(futures):
+            ver = futures[fut]
+            try:
+                fut.result()
+            except Exception as e:
+                failures[ver] = e
+    return failures
+
+
+# ============================================================
+# --batch: 全版を1つの文書にまとめて1回でコンパイルし、版ごとに分割する
+# ============================================================
+BATCH_DIR_NAME = "_batch"
+
+# 版の頭で macros.tex の \ExamResetState を呼び、版の最初/最後の物理ページを .ranges に書く
+_BATCH_PREAMBLE = r"""\makeatletter
+\newwrite\ExamBatch@ranges
+\immediate\openout\ExamBatch@ranges=\jobname.ranges\relax
+\newcommand\ExamBatchBegin[1]{%
+  \ExamResetState
+  \def\input@path{{#1/}}%
+  \immediate\write\ExamBatch@ranges{begin #1 \the\numexpr\ReadonlyShipoutCounter+1\relax}%
+}
+\newcommand\ExamBatchEnd[1]{%
+  \clearpage
+  \immediate\write\ExamBatch@ranges{end #1 \the\ReadonlyShipoutCounter}%
+}
+\makeatother
+"""
+
+_BATCH_RANGE_RE = re.compile(r"^(begin|end) (\S+) (\d+)\s*$", re.MULTILINE)
+
+
+def build_batch_tex(
+    batch_dir: Path,
+    entries: List[tuple[str, str]],
+    out_tex_filename: str,
+    features: Optional[tuple[str, ...]] = None,
+) -> Path:
+    """
+    entries = [(ver, batch_dir からの body.tex の相対パス), ...] を順に並べた .tex を作る。
+    各版の q/ は \\input@path（<ver>/）で見つける。
+    """
+    lines = []
+    for ver, body_rel in entries:
+        lines.append(rf"\ExamBatchBegin{{{ver}}}")
+        lines.append(rf"\input{{{body_rel}}}")
+        lines.append(rf"\ExamBatchEnd{{{ver}}}")
+    out_tex = batch_dir / out_tex_filename
+    write_text(out_tex, merge_main_tex("\n".join(lines), GRAPHICSPATH, _BATCH_PREAMBLE, features))
+    return out_tex
+
+
+def read_batch_ranges(ranges_path: Path) -> dict[str, tuple[int, int]]:
+    """.ranges から 版 -> (最初のページ, 最後のページ)（1始まり）を読む。"""
+    begin: dict[str, int] = {}
+    ranges: dict[str, tuple[int, int]] = {}
+    for kind, ver, page in _BATCH_RANGE_RE.findall(read_text(ranges_path)):
+        if kind == "begin":
+            begin[ver] = int(page)
+        elif ver in begin:
+            ranges[ver] = (begin[ver], int(page))
+    return ranges
+
+
+def split_batch_pdf(
+    pdf_path: Path,
+    ranges: dict[str, tuple[int, int]],
+    out_paths: dict[str, Path],
+) -> dict[str, bool]:
+    """
+    版ごとの PDF を書き、版 -> 書き換えたか（前回と同じバイト列なら False）を返す。
+    pypdf は /ID も日時も書かないので、同じページからは同じバイト列になる。
+    """
+    from pypdf import PdfReader, PdfWriter
+
+    changed: dict[str, bool] = {}
+
+    reader = PdfReader(str(pdf_path))
+    for ver, out_path in out_paths.items():
+        if ver not in ranges:
+            raise RuntimeError(f"バッチPDFに版 {ver} のページ範囲がありません: {pdf_path.with_suffix('.ranges')}")
+        first, last = ranges[ver]
+        if not (1 <= first <= last <= len(reader.pages)):
+            raise RuntimeError(f"版 {ver} のページ範囲が不正です: {first}-{last}（全{len(reader.pages)}ページ）")
+        writer = PdfWriter()
+        for i in range(first - 1, last):
+            writer.add_page(reader.pages[i])
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = out_path.with_name(out_path.name + ".tmp")
+        with tmp.open("wb") as f:
+            writer.write(f)
+        changed[ver] = replace_if_changed(tmp, out_path)
+    return changed
+
+
+def build_batch(
+    jobs: List[tuple[str, Path]],
+    *,
+    sheet: str,
+    temp_root: Path,
+    exam_dir: Path,
+    runs: int,
+    max_runs: int = DEFAULT_MAX_RUNS,
+    fmt: Optional[Path] = None,
+    features: Optional[tuple[str, ...]] = None,
+) -> None:
+    """
+    全版を temp_root/_batch/<sheet>_batch.tex にまとめてコンパイルし、
+    exam_dir/pdf/<ver>/<sheet>_<ver>.pdf に分割する。失敗したら RuntimeError。
+    """
+    batch_dir = temp_root / BATCH_DIR_NAME
+    entries = []
+    for ver, body_path in jobs:
+        body_name = f"{sheet}_{ver}_body.tex"
+        prepare_build_dir(batch_dir / ver, body_path, body_name)
+        entries.append((ver, f"{ver}/{body_name}"))
+
+    full_tex_path = build_batch_tex(batch_dir, entries, f"{sheet}_batch.tex", features)
+    print(f"✅ TeX merged (batch: {','.join(v for v, _ in jobs)}): {full_tex_path}", flush=True)
+
+    try:
+        batch_pdf = compile_with_format_fallback(full_tex_path, runs, "", max_runs, fmt)
+    except RuntimeError:
+        clear_rerun_files(batch_dir)
+        raise
+    print(f"🤩🤩🤩 PDF compiled in temp: {batch_pdf}", flush=True)
+    report_diagnostics(full_tex_path)
+
+    out_paths = {ver: exam_dir / "pdf" / ver / f"{sheet}_{ver}.pdf" for ver, _ in jobs}
+    ranges = read_batch_ranges(full_tex_path.with_suffix(".ranges"))
+    changed = split_batch_pdf(batch_pdf, ranges, out_paths)
+    for ver, out_path in out_paths.items():
+        first, last = ranges[ver]
+        note = "" if changed[ver] else "（前回と同じ）"
+        print(f"✅ PDF split [{ver}] p.{first}-{last}: {out_path}{note}", flush=True)
+
+
+def lualatex_version() -> Optional[str]:
+    """lualatex --version の1行目（format のキーに入れる）。lualatex が無ければ None。"""
+    try:
+        r = subprocess.run(["lualatex", "--version"], capture_output=True, text=True, errors="replace")
+    except OSError:
+        return None
+    if r.returncode != 0 or not r.stdout:
+        return None
+    return r.stdout.splitlines()[0].strip()
+
+
+def preamble_format_key(engine: str, features: Optional[tuple[str, ...]] = None) -> str:
+    """テンプレート（TEMPLATE_FILES）・エンジンのバージョン・機能の一覧から format のキーを作る。"""
+    h = hashlib.sha256()
+    tdir = template_dir()
+    for name in TEMPLATE_FILES:
+        h.update(name.encode("utf-8") + b"\0")
+        h.update((tdir / name).read_bytes())
+    h.update(engine.encode("utf-8"))
+    h.update(features_tex(features).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def ensure_preamble_format(features: Optional[tuple[str, ...]] = None) -> Optional[Path]:
+    """
+    main.tpl.tex の \\begin{document} までを mylatexformat でダンプした format を返す。
+    読むプリアンブルの断片が変わるので、機能の組み合わせ（features）ごとに別の format になる。
+    graphicspath は build_full_tex が \\endofdump の後ろで設定するので format には入らない。
+    キャッシュにあればそれを使い、無ければ作る。作れなかった（前に作れなかった）場合は None。
+    """
+    engine = lualatex_version()
+    if engine is None:
+        return None
+
+    key_dir = FORMAT_CACHE_DIR / preamble_format_key(engine, features)
+    fmt_path = key_dir / f"{FORMAT_NAME}.fmt"
+    if (key_dir / FORMAT_BROKEN_MARK).exists():
+        return None
+    if fmt_path.exists():
+        print(f"format: {fmt_path}（キャッシュ）")
+        return fmt_path
+
+    work = key_dir.with_name(key_dir.name + f".tmp{os.getpid()}")
+    shutil.rmtree(work, ignore_errors=True)
+    work.mkdir(parents=True)
+    try:
+        # 本文を空にした main.tpl.tex。mylatexformat が \\begin{document} の手前でダンプする
+        src = work / "fmtsrc.tex"
+        write_text(src, features_tex(features) + read_text(template_dir() / "main.tpl.tex").replace("@@BODY@@", ""))
+
+        r = subprocess.run(
+            ["lualatex", "-ini", f"-jobname={FORMAT_NAME}", "-interaction=nonstopmode",
+             "&lualatex", "mylatexformat.ltx", src.name],
+            cwd=str(work),
+            env=latex_env(),
+            capture_output=True,
+            text=True,
+            errors="replace",
+        )
+        key_dir.mkdir(parents=True, exist_ok=True)
+        if r.returncode != 0 or not (work / fmt_path.name).exists():
+            write_text(key_dir / FORMAT_BROKEN_MARK, r.stdout[-4000:])
+            print(f"⚠️  format のダンプに失敗したので通常のコンパイルにします（{key_dir / FORMAT_BROKEN_MARK}）")
+            return None
+
+        os.replace(work / fmt_path.name, fmt_path)
+        print(f"format: {fmt_path}（作成）")
+        return fmt_path
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def mark_format_broken(fmt: Path, reason: str) -> None:
+    """format を使ったコンパイルが失敗した。次回からはこの format を使わない。"""
+    write_text(fmt.parent / FORMAT_BROKEN_MARK, reason)
+
+
 def get_versions_from_json_data(data: dict) -> list[str]:
     versions = []
     for block in data.get("versions", []):
@@ -289,12 +974,70 @@ def prepare_temp_root(subject: str) -> Path:
     return temp_root
 
 
+def prepare_persistent_root(base: Path, subject: str, clean: bool = False) -> Path:
+    """
+    --persistent のビルド領域 base/<subject> を返す。中身（版ごとの .aux 等）は残す。
+    clean なら作り直す。フォルダの mtime は GC 用の「最後に使った日時」。
+    """
+    root = base / subject
+    if clean and root.exists():
+        shutil.rmtree(root)
+        print(f"ビルドフォルダを作り直します: {root}")
+    root.mkdir(parents=True, exist_ok=True)
+    os.utime(root)
+    return root
+
+
+def gc_persistent_roots(base: Path, max_age_days: int = PERSISTENT_MAX_AGE_DAYS) -> list[Path]:
+    """base 直下で max_age_days 日以上使われていない科目のビルド領域を消す。"""
+    if not base.is_dir():
+        return []
+    limit = time.time() - max_age_days * 86400
+    removed = []
+    for d in base.iterdir():
+        if d.is_dir() and not d.is_symlink() and d.stat().st_mtime < limit:
+            shutil.rmtree(d, ignore_errors=True)
+            removed.append(d)
+            print(f"古いビルドフォルダを削除しました: {d}")
+    return removed
+
+
 def main() -> None:
     ap = argparse.ArgumentParser(description="LaTeX本文からPDFを作成します。")
     add_subject_arg(ap)
-    ap.add_argument("--runs", type=int, default=2, help="lualatex runs")
+    ap.add_argument("--runs", type=int, default=0, help="lualatex の回数（0: 収束するまで自動）")
+    ap.add_argument("--max-runs", type=int, default=DEFAULT_MAX_RUNS, help="--runs 0 のときの最大回数")
+    ap.add_argument("--no-fmt", action="store_true", help="プリアンブルのダンプ format を使わない")
+    ap.add_argument(
+        "--all-features",
+        action="store_true",
+        help='body.tex の "%% features:" を無視してプリアンブルの断片を全部読む',
+    )
+    ap.add_argument("--no-cache", action="store_true", help="ビルド済み PDF のキャッシュを使わない（保存もしない）")
+    ap.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=DEFAULT_MAX_BYTES // (1024 * 1024),
+        help="PDF キャッシュの上限（MB）。超えたら古いものから消す",
+    )
     ap.add_argument("--keeptemp", action="store_true", help="成功時もtempビルドフォルダを残す")
+    ap.add_argument(
+        "--persistent",
+        nargs="?",
+        const=str(PERSISTENT_BUILD_BASE),
+        metavar="DIR",
+        help=f"ビルドフォルダ DIR/<科目>/<版> を消さずに次回も使う（既定: {PERSISTENT_BUILD_BASE}。tmpfs 可）",
+    )
+    ap.add_argument("--clean", action="store_true", help="--persistent のビルドフォルダを作り直してからビルドする")
+    ap.add_argument("--preview", metavar="QID", help="make_latex --only で書いた1問だけを1回コンパイルする")
+    ap.add_argument("--version", help="この版だけをビルドする（--preview の既定は先頭の版）")
+    ap.add_argument("--jobs", type=int, default=0, help="並列にコンパイルする版の数（0: 版数とCPU数の小さい方）")
+    ap.add_argument("--batch", action="store_true", help="全版を1回のコンパイルにまとめて版ごとに分割する（pypdf が必要）")
+    ap.add_argument("--image-dpi", type=int, default=DEFAULT_DPI, help="画像を縮小するときの印刷解像度")
+    ap.add_argument("--no-imageprep", action="store_true", help="画像を縮小せずに元のファイルをそのまま使う")
     args = ap.parse_args()
+    if args.clean and not args.persistent:
+        ap.error("--clean は --persistent と一緒に指定してください")
 
     exam_context = load_exam_context(args.subject, load_workbook=False)
 
@@ -304,7 +1047,30 @@ def main() -> None:
     exam_dir = exam_context.exam_dir
 
     json_path = work_dir / f"{subject}.json"
-    temp_root = prepare_temp_root(subject)
+
+    image_prep: Optional[ImagePrep] = None
+    if not args.no_imageprep:
+        if pillow_available():
+            image_prep = ImagePrep(IMAGE_CACHE_DIR, args.image_dpi)
+        else:
+            print("⚠️  Pillow が無いので画像は縮小せずに使います（pip install pillow）")
+
+    if args.preview:
+        json_data = load_json_data(json_path)
+        versions = get_versions_from_json_data(json_data)
+        version = args.version or versions[0]
+        if version not in versions:
+            raise RuntimeError(f"version {version} はJSONにありません（{','.join(versions)}）。")
+        pdf_path = build_preview(exam_context, json_data, args.preview, version, image_prep)
+        print(f"✅ preview PDF: {pdf_path}")
+        return
+
+    if args.persistent:
+        persistent_base = Path(args.persistent).expanduser()
+        gc_persistent_roots(persistent_base)
+        temp_root = prepare_persistent_root(persistent_base, subject, clean=args.clean)
+    else:
+        temp_root = prepare_temp_root(subject)
 
     print(f"科目番号: {exam_context.subject}")
     print(f"年度: {exam_context.fsyear}")
@@ -317,54 +1083,110 @@ def main() -> None:
 
     json_data = load_json_data(json_path)
     versions = get_versions_from_json_data(json_data)
+    if args.version:
+        if args.version not in versions:
+            raise RuntimeError(f"version {args.version} はJSONにありません（{','.join(versions)}）。")
+        versions = [args.version]
 
     print(f"出力版: {','.join(versions)}")
 
-    # 画像は各versionごとではなく、temp_root/images に一度だけコピーする
-    copy_images_to_temp(exam_dir, temp_root)
-
-    try:
-        for ver in versions:
+    # hashチェック：body.tex が JSON と同じExcel由来か確認する（ビルド前にまとめて）
+    failures: dict[str, Exception] = {}
+    jobs: List[tuple[str, Path]] = []
+    for ver in versions:
+        try:
             body_path = find_body_tex(work_dir, sheet, ver)
-
-            # hashチェック：body.tex が JSON と同じExcel由来か確認する
             source_hash = require_body_matches_json(body_path, json_data, ver)
-            print(f"source_excel_hash({ver}): {source_hash}")
-
-            # temp内のコンパイル先
-            build_dir = temp_root / ver
-            build_dir.mkdir(parents=True, exist_ok=True)
-
-            copy_templates_to(build_dir)
-
-            # temp_root/images を参照する
-            inject_graphicspath(build_dir, "../images/")
-
-            body_name = f"{sheet}_{ver}_body.tex"
-            dst_body = build_dir / body_name
-            shutil.copy2(body_path, dst_body)
-
-            full_name = f"{sheet}_{ver}.tex"
-            full_tex_path = build_full_tex(build_dir, body_name, full_name)
-            print(f"✅ TeX merged: {full_tex_path}")
-
-            temp_pdf_path = compile_lualatex(full_tex_path, runs=args.runs)
-            print(f"🤩🤩🤩 PDF compiled in temp: {temp_pdf_path}")
-
-            # 成功したPDFだけ元フォルダへコピーする
-            final_out_dir = exam_dir / "pdf" / ver
-            final_out_dir.mkdir(parents=True, exist_ok=True)
-            final_pdf_path = final_out_dir / temp_pdf_path.name
-            shutil.copy2(temp_pdf_path, final_pdf_path)
-            print(f"✅ PDF copied: {final_pdf_path}")
-
-    except Exception:
+        except Exception as e:
+            failures[ver] = e
+            continue
+        print(f"source_excel_hash({ver}): {source_hash}")
+        jobs.append((ver, body_path))
+
+    # 読むプリアンブルの断片は全版で共通にする（format も --batch の1文書も1つで済む）
+    features = None if args.all_features else merge_features([p for _, p in jobs])
+    print(f"プリアンブルの機能: {','.join(features) if features is not None else '全部'}")
+
+    # 入力が前回と同じ版はキャッシュから PDF をコピーするだけ
+    cache = None if args.no_cache else PdfCache(PDF_CACHE_DIR, args.cache_max_mb * 1024 * 1024)
+    cache_keys: dict[str, str] = {}
+    if cache is not None and jobs:
+        tdir = template_dir()
+        extra = [
+            lualatex_version() or "",
+            f"runs={args.runs}",
+            f"source_date_epoch={source_date_epoch()}",
+            image_prep.signature() if image_prep else "imageprep=off",
+            features_tex(features),
+        ]
+        misses = []
+        for ver, body_path in jobs:
+            key = pdf_cache_key(body_path, [tdir / n for n in TEMPLATE_FILES], GRAPHICSPATH, exam_dir / "images", extra)
+            dest = exam_dir / "pdf" / ver / f"{sheet}_{ver}.pdf"
+            if cache.get(key, dest):
+                print(f"♻️  [{ver}] キャッシュ済みの PDF を使います: {dest}")
+                continue
+            cache_keys[ver] = key
+            misses.append((ver, body_path))
+        jobs = misses
+
+    max_workers = args.jobs if args.jobs > 0 else min(len(jobs), os.cpu_count() or 1)
+    fmt: Optional[Path] = None
+    if jobs:
+        # 画像は各versionごとではなく、temp_root/images に一度だけリンクする
+        link_images_to_temp(exam_dir, temp_root, image_prep, image_width_ratios(p for _, p in jobs))
+        fmt = None if args.no_fmt else ensure_preamble_format(features)
+        if args.batch and len(jobs) > 1:
+            if importlib.util.find_spec("pypdf") is None:
+                print("⚠️  pypdf が無いので --batch は使わず版ごとにビルドします（pip install pypdf）")
+            else:
+                try:
+                    build_batch(
+                        jobs,
+                        sheet=sheet,
+                        temp_root=temp_root,
+                        exam_dir=exam_dir,
+                        runs=args.runs,
+                        max_runs=args.max_runs,
+                        fmt=fmt,
+                        features=features,
+                    )
+                    jobs = []
+                except RuntimeError as e:
+                    # どの版が悪いかを知るために版ごとにビルドし直す
+                    print(f"⚠️  バッチビルドに失敗したので版ごとにビルドします: {e}")
+
+    if jobs:
+        print(f"並列数: {max_workers}")
+        failures.update(build_versions(
+            jobs,
+            sheet=sheet,
+            temp_root=temp_root,
+            exam_dir=exam_dir,
+            runs=args.runs,
+            max_workers=max_workers,
+            max_runs=args.max_runs,
+            fmt=fmt,
+            features=features,
+        ))
+
+    if cache is not None:
+        for ver, key in cache_keys.items():
+            if ver not in failures:
+                cache.put(key, exam_dir / "pdf" / ver / f"{sheet}_{ver}.pdf")
+
+    if failures:
         print()
         print("🙅🏻‍♂️ PDF作成中にエラーが発生しました。")
+        for ver in versions:
+            if ver in failures:
+                print(f"  [{ver}] {failures[ver]}")
         print(f"ログ確認用にtempを残します: {temp_root}")
-        raise
+        raise RuntimeError(f"PDF作成に失敗した版: {','.join(v for v in versions if v in failures)}")
 
-    if args.keeptemp:
+    if args.persistent:
+        print(f"ビルドフォルダを残しました（次回も使います）: {temp_root}")
+    elif args.keeptemp:
         print(f"tempを残しました: {temp_root}")
     else:
         shutil.rmtree(temp_root, ignore_errors=True)
@@ -16,13 +16,13 @@ make_json.py が作成した work/{subject}.json から、学校提出用の Wor
     - PDFと完全一致は目指さない
     - Wordで編集しやすい形を優先する
     - LaTeX数式は第1段階では文字列として残す
-    - 画像は可能なら貼り付ける
+    - 画像は可能なら貼り付ける（印刷解像度に縮小したキャッシュを使う。imageprep.py / --image-dpi）
 """
 
 from __future__ import annotations
 
 import argparse
-import json
+import math
 import re
 import sys
 from pathlib import Path
@@ -34,7 +34,12 @@ from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
 from docx.shared import Inches, Pt
 
-from exam_utils import add_subject_arg, load_exam_context
+from exam_utils import add_subject_arg, load_exam_context, exam_json_exists, load_exam_index, load_exam_version
+from imageprep import DEFAULT_DPI, ImagePrep, pillow_available
+from exam_model import (
+    Choices, Code, Cover, ExamVersion, Image, Lines, Node, PageBreak, Premise,
+    Question, Stray, SubQuestion, Text, VSpace, build_exam_version,
+)
 
 
 # ------------------------------------------------------------
@@ -146,14 +151,16 @@ def add_text_with_linebreaks(doc: Document, text: Any) -> None:
 # JSON読み込み・検証
 # ------------------------------------------------------------
 def load_json(json_path: Path) -> dict[str, Any]:
-    if not json_path.exists():
+    """
+    版一覧と metainfo だけの index を読み込む。本文は版ごとに load_exam_version で読む。
+    """
+    if not exam_json_exists(json_path):
         raise FileNotFoundError(
             "JSONファイルが見つかりません。\n"
             "先に make_json.py を実行してください。\n"
             f"JSON path: {json_path}"
         )
-    with json_path.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return load_exam_index(json_path)
 
 
 def get_versions(data: dict[str, Any]) -> list[dict[str, Any]]:
@@ -184,23 +191,23 @@ def find_image_path(image_name: str, exam_dir: Path) -> Path | None:
     return None
 
 
-def add_image(doc: Document, item: dict[str, Any], exam_dir: Path) -> None:
-    path_value = item.get("path") or ""
-    image_path = find_image_path(str(path_value), exam_dir)
+def add_image(doc: Document, item: Image, exam_dir: Path, image_prep: ImagePrep | None = None) -> None:
+    path_value = item.path
+    image_path = find_image_path(path_value, exam_dir)
 
     if image_path is None:
         add_normal_paragraph(doc, f"[画像が見つかりません: {path_value}]")
         return
 
-    width_ratio = item.get("width", 0.8)
-    try:
-        width_ratio = float(width_ratio)
-    except Exception:
-        width_ratio = 0.8
+    width_ratio = 0.8 if item.width is None else item.width
 
     # A4本文幅をざっくり6.5インチとして計算
     width_inches = max(1.0, min(6.5, 6.5 * width_ratio))
 
+    # 印刷解像度に縮小したキャッシュ（imageprep.py）を貼る
+    if image_prep is not None:
+        image_path = image_prep.prepare(image_path, math.ceil(width_inches * image_prep.dpi))
+
     p = doc.add_paragraph()
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
     run = p.add_run()
@@ -213,20 +220,18 @@ def add_image(doc: Document, item: dict[str, Any], exam_dir: Path) -> None:
 # ------------------------------------------------------------
 # 要素レンダリング
 # ------------------------------------------------------------
-def render_cover(doc: Document, item: dict[str, Any], version: str) -> None:
-    title = clean_text(item.get("title") or item.get("subject") or "試験問題")
+def render_cover(doc: Document, item: Cover, version: str) -> None:
+    title = clean_text(item.title or item.subject or "試験問題")
     p = doc.add_paragraph()
     p.alignment = WD_ALIGN_PARAGRAPH.CENTER
     run = p.add_run(title)
     run.bold = True
     set_run_font(run, DEFAULT_FONT, 18)
 
-    subject = item.get("subject")
-    fsyear = item.get("fsyear")
-    if subject or fsyear:
+    if item.subject or item.fsyear:
         p = doc.add_paragraph()
         p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        run = p.add_run(" / ".join(str(x) for x in [fsyear, subject] if x))
+        run = p.add_run(" / ".join(x for x in [item.fsyear, item.subject] if x))
         set_run_font(run, DEFAULT_FONT, 11)
 
     if version:
@@ -235,118 +240,104 @@ def render_cover(doc: Document, item: dict[str, Any], version: str) -> None:
         run = p.add_run(f"Version {version}")
         set_run_font(run, DEFAULT_FONT, 11)
 
-    notes = item.get("notes") or []
-    for note in notes:
+    for note in item.notes:
         add_text_with_linebreaks(doc, note)
 
     doc.add_page_break()
 
 
-def render_premise(doc: Document, item: dict[str, Any], exam_dir: Path) -> None:
-    title = item.get("title") or "前提条件"
+def render_premise(doc: Document, item: Premise, exam_dir: Path, image_prep: ImagePrep | None = None) -> None:
+    title = item.title or "前提条件"
     p = doc.add_paragraph()
     run = p.add_run(f"【{title}】")
     run.bold = True
     set_run_font(run, DEFAULT_FONT, 11)
 
-    for sub in item.get("content") or []:
-        render_content_item(doc, sub, exam_dir)
+    for sub in item.content:
+        render_content_item(doc, sub, exam_dir, image_prep)
 
     add_normal_paragraph(doc, "")
 
 
-def render_choices(doc: Document, item: dict[str, Any]) -> None:
-    values = item.get("values") or []
-    if not values:
-        return
-
-    for idx, v in enumerate(values, start=1):
-        if isinstance(v, dict):
-            label = v.get("label") or str(idx)
-            text = v.get("text") or ""
-        else:
-            label = str(idx)
-            text = str(v)
-        add_normal_paragraph(doc, f"{label}. {clean_text(text)}")
+def render_choices(doc: Document, item: Choices) -> None:
+    for idx, v in enumerate(item.options, start=1):
+        label = v.label or str(idx)
+        add_normal_paragraph(doc, f"{label}. {clean_text(v.text)}")
 
 
-def render_content_item(doc: Document, item: Any, exam_dir: Path) -> None:
-    if not isinstance(item, dict):
-        add_text_with_linebreaks(doc, item)
+def render_content_item(doc: Document, item: Node, exam_dir: Path, image_prep: ImagePrep | None = None) -> None:
+    if isinstance(item, Stray):
+        add_text_with_linebreaks(doc, item.value)
         return
 
-    typ = item.get("type")
-
-    if typ in ("text", "sline"):
-        add_text_with_linebreaks(doc, item.get("value") or "")
-
-    elif typ == "multiline":
-        for v in item.get("values") or []:
-            add_text_with_linebreaks(doc, v)
+    if isinstance(item, Text):
+        add_text_with_linebreaks(doc, item.value or "")
 
-    elif typ == "preline":
-        for v in item.get("values") or []:
+    elif isinstance(item, Lines):
+        # multiline / preline
+        for v in item.values:
             add_text_with_linebreaks(doc, v)
 
-    elif typ == "code":
-        add_code_block(doc, item.get("lines") or [])
+    elif isinstance(item, Code):
+        add_code_block(doc, item.lines)
 
-    elif typ == "choices":
+    elif isinstance(item, Choices):
         render_choices(doc, item)
 
-    elif typ == "image":
-        add_image(doc, item, exam_dir)
+    elif isinstance(item, Image):
+        add_image(doc, item, exam_dir, image_prep)
 
-    elif typ == "vspace":
+    elif isinstance(item, VSpace):
         add_normal_paragraph(doc, "")
 
-    elif typ == "pagebreak":
+    elif isinstance(item, PageBreak):
         #doc.add_page_break()
         return
 
-    elif typ == "premise":
-        render_premise(doc, item, exam_dir)
+    elif isinstance(item, Premise):
+        render_premise(doc, item, exam_dir, image_prep)
 
-    elif typ == "cover":
+    elif item.type in ("cover", "metainfo"):
         # coverはversion単位の先頭で処理するため、ここでは何もしない
         return
 
-    elif typ == "metainfo":
-        return
-
     else:
-        add_normal_paragraph(doc, f"[未対応type: {typ}] {item}")
+        add_normal_paragraph(doc, f"[未対応type: {item.data.get('type')}] {item.data}")
 
 
-def render_question(doc: Document, q: dict[str, Any], exam_dir: Path) -> None:
-    number = q.get("number") or "?"
-    qtext = clean_text(q.get("question") or "")
+def render_question(doc: Document, q: Question, exam_dir: Path, image_prep: ImagePrep | None = None) -> None:
+    number = q.number or "?"
+    qtext = clean_text(q.question)
 
     p = doc.add_paragraph()
     run = p.add_run(f"問{number}：{qtext}")
     run.bold = True
     set_run_font(run, DEFAULT_FONT, 11)
 
-    for item in q.get("content") or []:
-        render_content_item(doc, item, exam_dir)
+    for item in q.content:
+        render_content_item(doc, item, exam_dir, image_prep)
 
-    for sub in q.get("subquestions") or []:
-        render_subquestion(doc, sub, number, exam_dir)
+    for sub in q.subquestions:
+        if isinstance(sub, SubQuestion):
+            render_subquestion(doc, sub, number, exam_dir, image_prep)
+        else:
+            # 小問の間の vspace / pagebreak
+            render_content_item(doc, sub, exam_dir, image_prep)
 
     add_normal_paragraph(doc, "")
 
 
-def render_subquestion(doc: Document, sub: dict[str, Any], parent_number: str, exam_dir: Path) -> None:
-    number = sub.get("number") or "?"
-    qtext = clean_text(sub.get("question") or "")
+def render_subquestion(doc: Document, sub: SubQuestion, parent_number: str, exam_dir: Path, image_prep: ImagePrep | None = None) -> None:
+    number = sub.number or "?"
+    qtext = clean_text(sub.question)
 
     p = doc.add_paragraph()
     run = p.add_run(f"問{parent_number}-{number}：{qtext}")
     run.bold = True
     set_run_font(run, DEFAULT_FONT, 10)
 
-    for item in sub.get("content") or []:
-        render_content_item(doc, item, exam_dir)
+    for item in sub.content:
+        render_content_item(doc, item, exam_dir, image_prep)
 
 
 # ------------------------------------------------------------
@@ -355,18 +346,19 @@ def render_subquestion(doc: Document, sub: dict[str, Any], parent_number: str, e
 def build_docx_for_version(
     *,
     subject: str,
-    version_block: dict[str, Any],
+    version_block: ExamVersion,
     exam_dir: Path,
     out_path: Path,
+    image_prep: ImagePrep | None = None,
 ) -> None:
-    version = str(version_block.get("version") or "A")
-    questions = version_block.get("questions") or []
+    version = version_block.version
+    questions = version_block.questions
 
     doc = Document()
     set_document_defaults(doc)
 
     # coverは常に表示する方針
-    cover_items = [q for q in questions if isinstance(q, dict) and q.get("type") == "cover"]
+    cover_items = [q for q in questions if isinstance(q, Cover)]
     if cover_items:
         render_cover(doc, cover_items[0], version)
     else:
@@ -378,21 +370,13 @@ def build_docx_for_version(
         doc.add_page_break()
 
     for item in questions:
-        if not isinstance(item, dict):
+        if isinstance(item, Cover):
             continue
-
-        typ = item.get("type")
-        if typ == "cover":
-            continue
-        elif typ == "premise":
-            render_premise(doc, item, exam_dir)
-#        elif typ in ("vspace", "pagebreak", "text", "multiline", "code", "choices", "image"):
-        elif typ in ("vspace", "text", "multiline", "code", "choices", "image"):
-            render_content_item(doc, item, exam_dir)
-        elif "question" in item or "subquestions" in item:
-            render_question(doc, item, exam_dir)
+        elif isinstance(item, Question):
+            render_question(doc, item, exam_dir, image_prep)
         else:
-            render_content_item(doc, item, exam_dir)
+            # premise / vspace / text などのトップレベル要素
+            render_content_item(doc, item, exam_dir, image_prep)
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
     doc.save(out_path)
@@ -404,6 +388,8 @@ def build_docx_for_version(
 def main() -> None:
     parser = argparse.ArgumentParser(description="JSONから学校提出用Word(docx)を作成します。")
     add_subject_arg(parser)
+    parser.add_argument("--image-dpi", type=int, default=DEFAULT_DPI, help="画像を縮小するときの印刷解像度")
+    parser.add_argument("--no-imageprep", action="store_true", help="画像を縮小せずに元のファイルをそのまま貼る")
     args = parser.parse_args()
 
     exam_context = load_exam_context(args.subject, load_workbook=False)
@@ -420,15 +406,26 @@ def main() -> None:
     data = load_json(json_path)
     versions = get_versions(data)
 
-    for block in versions:
-        version = str(block.get("version") or "A")
+    image_prep = None
+    if not args.no_imageprep:
+        if pillow_available():
+            image_prep = ImagePrep(dpi=args.image_dpi)
+        else:
+            print("⚠️  Pillow が無いので画像は縮小せずに貼ります（pip install pillow）")
+
+    for entry in versions:
+        version = str(entry.get("version") or "A")
         out_path = word_dir / f"{subject}_{version}.docx"
 
+        # Word には trace を出さないので srcmap は読まない
+        ev = build_exam_version(load_exam_version(json_path, version, with_trace=False))
+
         build_docx_for_version(
             subject=subject,
-            version_block=block,
+            version_block=ev,
             exam_dir=exam_context.exam_dir,
             out_path=out_path,
+            image_prep=image_prep,
         )
 
         print(f"✅ Word作成: {out_path}")
@@ -13,108 +13,12 @@ from utils import calc_excel_hash, get_exam_path
 from versioncontrol_yaml import ensure_version_entry
 
 from contract import normalize_document, validate_document, ContractError
+from texconv import conv_text
 
 # v2: qpattern は b_exam ブロックの qpattern 行から取得（v1同様）
 qpattern = None
 current_premise = None
 current_preline = None
-def escape_tex_outside_inline_math(s: str) -> str:
-    r"""
-    \(...\) / \[...\] の中はそのまま、
-    それ以外の部分だけ { } & をエスケープする。
-    """
-    out = []
-    i = 0
-    in_math = False
-    end_token = None  # r"\)" or r"\]"
-
-    while i < len(s):
-        if not in_math:
-            # math start: \(  or \[
-            if s.startswith(r"\(", i):
-                in_math = True
-                end_token = r"\)"
-                out.append(r"\(")
-                i += 2
-                continue
-            if s.startswith(r"\[", i):
-                in_math = True
-                end_token = r"\]"
-                out.append(r"\[")
-                i += 2
-                continue
-
-            ch = s[i]
-            if ch == "{":
-                out.append(r"\{")
-            elif ch == "}":
-                out.append(r"\}")
-            elif ch == "&":
-                out.append(r"\&")
-            else:
-                out.append(ch)
-            i += 1
-        else:
-            # math end
-            if end_token and s.startswith(end_token, i):
-                in_math = False
-                out.append(end_token)
-                i += 2
-                end_token = None
-                continue
-
-            # 数式中は一切触らない
-            out.append(s[i])
-            i += 1
-
-    return "".join(out)
-
-# -------------------------
-# v2: Backslash display conversion
-# -------------------------
-# Excelセル中に「\0」など「バックスラッシュ + 数字」が含まれる場合、
-# LaTeX表示でバックスラッシュ記号として出すために
-# \textbackslash 0 のように変換する（JSON段階で整形）
-_BACKSLASH_DIGIT_RE = re.compile(r"\\(?=\d)")
-
-# 追加：クォート内の \n \t \r \0 など（\ + 英数字）を対象にする
-_BACKSLASH_IN_QUOTES_RE = re.compile(r"(?<=[\'\"])\\(?=[A-Za-z0-9])")
-_RAW_TEX_RE = re.compile(r"\[\[(.+?)\]\]", re.DOTALL)
-
-def _conv_plain_segment(seg: str) -> str:
-    # safety: real NUL
-    seg = seg.replace("\x00", r"\textbackslash 0")
-    # '\n' や "\n" のようなクォート内の \n \t \r \0 など
-    seg = _BACKSLASH_IN_QUOTES_RE.sub(r"\\textbackslash ", seg)
-    # \0, \12 ...（バックスラッシュ + 数字）
-    seg = _BACKSLASH_DIGIT_RE.sub(r"\\textbackslash ", seg)
-    # 数式 \( ... \) の外側だけ { } & をエスケープ
-    seg = escape_tex_outside_inline_math(seg)
-    return seg
-
-def conv_text(v) -> str:
-    if v is None:
-        return ""
-    s = str(v).strip()
-    if s == "":
-        return ""
-
-    out = []
-    last = 0
-    for m in _RAW_TEX_RE.finditer(s):
-        # 通常部分は変換
-        out.append(_conv_plain_segment(s[last:m.start()]))
-
-        # [[...]] の中は「そのまま」通す（[[ ]] 自体は剥がす）
-        out.append(f"[[{m.group(1)}]]")
-
-        last = m.end()
-
-    # 残り
-    out.append(_conv_plain_segment(s[last:]))
-
-    return "".join(out)
-
 
 def _parse_select_style(style_raw: str):
     """
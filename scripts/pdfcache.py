@@ -0,0 +1,138 @@
+# scripts/pdfcache.py
+"""
+make_pdf のビルド結果 PDF のキャッシュ（内容アドレス）。
+
+キーは「その PDF を作るのに使った入力」の sha256:
+  - body.tex と、そこから \\input{q/...} される断片
+  - templates/latex の4ファイル
+  - main tex で設定する graphicspath
+  - body / 断片から \\image{...} / \\includegraphics{...} で参照される画像ファイル
+  - その他（エンジンのバージョン、--runs など）呼び出し側が渡す文字列
+
+キャッシュは <key>.pdf を1フォルダに並べるだけ。ヒットしたら mtime を更新し、
+合計サイズが上限を超えたら mtime の古い順に消す（LRU）。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Iterable, Optional
+
+from exam_utils import LATEX_FRAGMENT_DIR_NAME, copy_if_changed
+
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024
+
+_INPUT_FRAGMENT_RE = re.compile(rf"\\input\{{({re.escape(LATEX_FRAGMENT_DIR_NAME)}/[^}}]+)\}}")
+_IMAGE_REF_RE = re.compile(r"\\(?:image|includegraphics)(?:\[[^\]]*\])?\{([^}]*)\}")
+_TEX_ESCAPED_RE = re.compile(r"\\([&%#_{}$])")
+
+# 拡張子なしで参照されたときに lualatex が探すもの
+_GRAPHICS_EXTS = ("", ".pdf", ".png", ".jpg", ".jpeg", ".eps")
+
+
+def _read(p: Path) -> str:
+    return p.read_text(encoding="utf-8")
+
+
+def body_sources(body_path: Path) -> list[Path]:
+    """body.tex と、そこから \\input される断片（q/<name>.tex）"""
+    files = [body_path]
+    for m in _INPUT_FRAGMENT_RE.finditer(_read(body_path)):
+        frag = body_path.parent / m.group(1)
+        if frag.suffix != ".tex":
+            frag = frag.with_name(frag.name + ".tex")
+        files.append(frag)
+    return files
+
+
+def referenced_images(tex_files: Iterable[Path], images_dir: Path) -> list[Path]:
+    """tex から参照される画像を images_dir から探す（見つからない名前は無視）。"""
+    found: set[Path] = set()
+    for p in tex_files:
+        if not p.exists():
+            continue
+        for m in _IMAGE_REF_RE.finditer(_read(p)):
+            name = _TEX_ESCAPED_RE.sub(r"\1", m.group(1).strip())
+            for ext in _GRAPHICS_EXTS:
+                cand = images_dir / (name + ext)
+                if cand.is_file():
+                    found.add(cand)
+    return sorted(found)
+
+
+def pdf_cache_key(
+    body_path: Path,
+    template_files: Iterable[Path],
+    graphicspath: str,
+    images_dir: Path,
+    extra: Iterable[str] = (),
+) -> str:
+    h = hashlib.sha256()
+
+    def add(label: str, data: bytes) -> None:
+        h.update(label.encode("utf-8") + b"\0" + str(len(data)).encode("ascii") + b"\0" + data)
+
+    sources = body_sources(body_path)
+    for p in sources:
+        # 断片が無い（make_latex 前）なら名前だけ入れておく
+        add(f"tex:{p.relative_to(body_path.parent)}", p.read_bytes() if p.exists() else b"<missing>")
+    for p in template_files:
+        add(f"tpl:{p.name}", p.read_bytes())
+    add("graphicspath", graphicspath.encode("utf-8"))
+    for p in referenced_images(sources, images_dir):
+        add(f"img:{p.relative_to(images_dir)}", p.read_bytes())
+    for s in extra:
+        add("extra", s.encode("utf-8"))
+    return h.hexdigest()
+
+
+class PdfCache:
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.pdf"
+
+    def get(self, key: str, dest: Path) -> bool:
+        """ヒットしたら dest にコピーして True（dest が同じバイト列ならコピーしない）。"""
+        src = self._path(key)
+        if not src.is_file():
+            return False
+        copy_if_changed(src, dest)
+        os.utime(src)  # LRU 用に「最近使った」にする
+        return True
+
+    def put(self, key: str, pdf_path: Path) -> Optional[Path]:
+        """pdf_path をキャッシュに入れて、上限を超えていれば古いものから消す。"""
+        if self.max_bytes <= 0:
+            return None
+        self.root.mkdir(parents=True, exist_ok=True)
+        dst = self._path(key)
+        tmp = dst.with_name(f"{dst.name}.tmp{os.getpid()}")
+        shutil.copyfile(pdf_path, tmp)
+        os.replace(tmp, dst)
+        self.evict()
+        return dst if dst.exists() else None
+
+    def evict(self) -> list[Path]:
+        entries = []
+        for p in self.root.glob("*.pdf"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+        total = sum(size for _, size, _ in entries)
+
+        removed: list[Path] = []
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            p.unlink(missing_ok=True)
+            total -= size
+            removed.append(p)
+        return removed
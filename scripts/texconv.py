@@ -0,0 +1,59 @@
+# scripts/texconv.py
+"""
+Excel セル文字列 → JSON 用テキストの変換（make_json.py / maketexjson.py 共通）。
+
+  - [[...]] の中は生TeXとしてそのまま通す
+  - 実NUL、クォート内の \\n など、\\ + 数字 を \\textbackslash に置き換える
+  - \\(...\\) / \\[...\\] の外側だけ { } & をエスケープする（texescape）
+
+正規表現で一度に区切り、エスケープは texescape の共通エスケーパで行う。
+選択肢ラベルや examnote など同じ文字列が版ごとに何度も来るので、
+conv_text の結果は LRU でメモ化する。
+"""
+from __future__ import annotations
+
+import re
+from functools import lru_cache
+
+from texescape import escape_tex_outside_inline_math
+
+# [[...]]（生TeX）。split すると [通常, 生TeXの中身, 通常, ...] の順になる
+_RAW_TEX_RE = re.compile(r"\[\[(.+?)\]\]", re.DOTALL)
+
+# クォート内の \n \t \r \0 など（\ + 英数字）と、\0, \12 ...（\ + 数字）
+_BACKSLASH_RE = re.compile(r"(?<=[\'\"])\\(?=[A-Za-z0-9])|\\(?=\d)")
+
+CONV_TEXT_CACHE_SIZE = 8192
+
+
+def _conv_plain_segment(seg: str) -> str:
+    # safety: real NUL
+    seg = seg.replace("\x00", r"\textbackslash 0")
+    if "\\" in seg:
+        seg = _BACKSLASH_RE.sub(r"\\textbackslash ", seg)
+    # 数式 \( ... \) の外側だけ { } & をエスケープ
+    return escape_tex_outside_inline_math(seg)
+
+
+@lru_cache(maxsize=CONV_TEXT_CACHE_SIZE)
+def _conv_text_str(s: str) -> str:
+    if "[[" not in s:
+        return _conv_plain_segment(s)
+
+    parts = _RAW_TEX_RE.split(s)
+    for i in range(len(parts)):
+        if i % 2:
+            # [[...]] の中は「そのまま」通す（[[ ]] は付け直す）
+            parts[i] = f"[[{parts[i]}]]"
+        else:
+            parts[i] = _conv_plain_segment(parts[i])
+    return "".join(parts)
+
+
+def conv_text(v) -> str:
+    if v is None:
+        return ""
+    s = str(v).strip()
+    if s == "":
+        return ""
+    return _conv_text_str(s)
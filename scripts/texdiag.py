@@ -0,0 +1,237 @@
+# scripts/texdiag.py
+"""
+lualatex のログ診断（make_latex.py / make_pdf.py 共通）。
+
+ソースマップ
+  make_latex が出す trace コメント（%% type=... src=Sheet!R..-R.. / %% QBEGIN ... src=...）を
+  「この行から先はこの Excel 行」という表にして、.tex の隣に <name>.texmap.json として置く。
+  サイドカーが無い・古いときは .tex の trace コメントから作り直す（--notrace なら空）。
+
+ログ解析
+  .log からエラー・Overfull/Underfull・見つからない画像を拾い、ファイルと行番号を
+  ソースマップで Sheet!R<row> に直して1つのレポートにする。
+  Overfull/Underfull はファイル名が出ないので、ログの "(./q/Q1.tex ... )" の入れ子から今のファイルを追う。
+"""
+from __future__ import annotations
+
+import bisect
+import json
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+TEXMAP_SUFFIX = ".texmap.json"
+
+# make_latex._trace_line ほか（%% [QBEGIN ...] type=... tag=... src=Sheet!R1-R2）
+_TRACE_RE = re.compile(r"^%% (.*?)\s*\bsrc=(\S+)")
+
+
+# ============================================================
+# ソースマップ
+# ============================================================
+def source_map_path(tex_path: str | Path) -> Path:
+    return Path(tex_path).with_suffix(TEXMAP_SUFFIX)
+
+
+def build_source_map(tex: str) -> list[list]:
+    """[[行番号(1始まり), "Sheet!R..", "type=... tag=..."], ...]（行番号の昇順）"""
+    entries: list[list] = []
+    for n, line in enumerate(tex.splitlines(), start=1):
+        if not line.startswith("%% "):
+            continue
+        m = _TRACE_RE.match(line)
+        if m and m.group(2) != "?":
+            entries.append([n, m.group(2), m.group(1)])
+    return entries
+
+
+def dumps_source_map(tex_name: str, entries: list[list]) -> str:
+    return json.dumps({"tex": tex_name, "entries": entries}, ensure_ascii=False) + "\n"
+
+
+def load_source_map(tex_path: Path) -> list[list]:
+    """サイドカーが .tex より新しければそれを、でなければ .tex から作る。"""
+    sidecar = source_map_path(tex_path)
+    try:
+        if sidecar.stat().st_mtime >= tex_path.stat().st_mtime:
+            return json.loads(sidecar.read_text(encoding="utf-8")).get("entries") or []
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        return build_source_map(tex_path.read_text(encoding="utf-8", errors="replace"))
+    except OSError:
+        return []
+
+
+def lookup_source(entries: list[list], line: int) -> Optional[list]:
+    """line 以前で一番近い trace の [行, src, 説明]。無ければ None。"""
+    i = bisect.bisect_right([e[0] for e in entries], line)
+    return entries[i - 1] if i else None
+
+
+# ============================================================
+# ログ解析
+# ============================================================
+@dataclass(slots=True)
+class Diagnostic:
+    kind: str                # "error" | "missing-image" | "overfull" | "underfull"
+    file: str                # ログに出たファイル名（./q/Q1.tex など）
+    line: Optional[int]
+    message: str
+    line_end: Optional[int] = None
+    src: str = ""            # Sheet!R..（分からなければ空）
+    what: str = ""           # trace コメントの type=... tag=...
+
+
+KIND_LABELS = {
+    "error": "エラー",
+    "missing-image": "画像なし",
+    "overfull": "Overfull",
+    "underfull": "Underfull",
+}
+
+# TeX はログを 79 文字で折り返す（max_print_line）
+_MAX_PRINT_LINE = 79
+
+_FILE_LINE_ERROR_RE = re.compile(r"^(\S.*?\.tex):(\d+): (.*)$")
+_BOX_RE = re.compile(
+    r"^(Overfull|Underfull) \\([hv])box \((.*?)\) (?:in paragraph|in alignment|detected) at lines? (\d+)(?:--(\d+))?"
+)
+_CONTEXT_RE = re.compile(r"^l\.(\d+) ?(.*)$")
+_NOT_FOUND_RE = re.compile(r"File [`'](.+?)' not found")
+_FILE_OPEN_RE = re.compile(r"\(((?:\.{0,2}/|[A-Za-z]:[/\\])?[^\s()]+\.[A-Za-z0-9]+)")
+_NON_IMAGE_EXTS = (".tex", ".sty", ".cls", ".def", ".cfg", ".fd", ".lua")
+_EMERGENCY_STOP = "Emergency stop"
+
+
+def _unwrap(lines: Iterable[str]) -> List[str]:
+    out: List[str] = []
+    buf = ""
+    for line in lines:
+        buf += line
+        if len(line) == _MAX_PRINT_LINE:
+            continue
+        out.append(buf)
+        buf = ""
+    if buf:
+        out.append(buf)
+    return out
+
+
+def _update_file_stack(stack: list[Optional[str]], line: str) -> None:
+    """"(" でファイル（でなければ None）を積み、")" で降ろす。"""
+    i = 0
+    while i < len(line):
+        c = line[i]
+        if c == "(":
+            m = _FILE_OPEN_RE.match(line, i)
+            if m:
+                stack.append(m.group(1))
+                i = m.end()
+                continue
+            stack.append(None)
+        elif c == ")" and stack:
+            stack.pop()
+        i += 1
+
+
+def _current_tex(stack: list[Optional[str]]) -> str:
+    for name in reversed(stack):
+        if name and name.endswith(".tex"):
+            return name
+    return ""
+
+
+def parse_latex_log(log_text: str) -> list[Diagnostic]:
+    diags: list[Diagnostic] = []
+    stack: list[Optional[str]] = []
+    lines = _unwrap(log_text.splitlines())
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        m = _FILE_LINE_ERROR_RE.match(line)
+        if m:
+            message = m.group(3).strip()
+            # 続きの行（l.<n> の文脈まで）をまとめる
+            j = i + 1
+            while j < len(lines) and lines[j].strip() and not _CONTEXT_RE.match(lines[j]) and j - i < 4:
+                j += 1
+            context = _CONTEXT_RE.match(lines[j]) if j < len(lines) else None
+            if context and context.group(2).strip():
+                message += f"  [l.{context.group(1)} {context.group(2).strip()}]"
+
+            nf = _NOT_FOUND_RE.search(message)
+            kind = "missing-image" if nf and not nf.group(1).endswith(_NON_IMAGE_EXTS) else "error"
+            diags.append(Diagnostic(kind, m.group(1), int(m.group(2)), message))
+            # エラーの説明文は括弧の対応を崩すので読み飛ばす
+            while j < len(lines) and lines[j].strip():
+                j += 1
+            i = j + 1
+            continue
+
+        m = _BOX_RE.match(line)
+        if m:
+            end = int(m.group(5)) if m.group(5) else None
+            diags.append(Diagnostic(
+                m.group(1).lower(),
+                _current_tex(stack),
+                int(m.group(4)),
+                f"\\{m.group(2)}box ({m.group(3)})",
+                line_end=end,
+            ))
+            # 続くボックスの中身の表示も括弧を含むので読み飛ばす
+            i += 1
+            while i < len(lines) and lines[i].strip():
+                i += 1
+            continue
+
+        _update_file_stack(stack, line)
+        i += 1
+
+    # Emergency stop は前のエラーの結果なので、ほかにエラーがあれば出さない
+    errors = [d for d in diags if d.kind != "error" or not d.message.startswith(_EMERGENCY_STOP)]
+    if any(d.kind == "error" for d in errors):
+        return errors
+    return diags
+
+
+def _resolve(build_dir: Path, name: str) -> Path:
+    p = Path(name)
+    return p if p.is_absolute() else build_dir / p
+
+
+def attach_sources(diags: list[Diagnostic], build_dir: Path) -> list[Diagnostic]:
+    """ファイル:行 をソースマップで Sheet!R.. に直す（同じファイルのマップは1回だけ読む）。"""
+    maps: dict[str, list[list]] = {}
+    for d in diags:
+        if not d.file or d.line is None:
+            continue
+        if d.file not in maps:
+            maps[d.file] = load_source_map(_resolve(build_dir, d.file))
+        hit = lookup_source(maps[d.file], d.line)
+        if hit:
+            d.src, d.what = hit[1], hit[2]
+    return diags
+
+
+def diagnose_log(log_path: Path, build_dir: Optional[Path] = None) -> list[Diagnostic]:
+    if not log_path.exists():
+        return []
+    text = log_path.read_text(encoding="utf-8", errors="replace")
+    return attach_sources(parse_latex_log(text), build_dir or log_path.parent)
+
+
+def format_report(diags: list[Diagnostic], title: str = "") -> str:
+    counts = {k: sum(1 for d in diags if d.kind == k) for k in KIND_LABELS}
+    head = " / ".join(f"{KIND_LABELS[k]} {n}" for k, n in counts.items() if n) or "問題なし"
+    out = [f"{title}診断: {head}"]
+    order = {k: n for n, k in enumerate(KIND_LABELS)}
+    for d in sorted(diags, key=lambda d: (order.get(d.kind, 9), d.src or "~", d.file, d.line or 0)):
+        where = d.file.removeprefix("./")
+        if d.line is not None:
+            where += f":{d.line}" + (f"-{d.line_end}" if d.line_end and d.line_end != d.line else "")
+        out.append(f"  [{KIND_LABELS.get(d.kind, d.kind)}] {d.src or '?'}  {where}  {d.message}")
+    return "\n".join(out)
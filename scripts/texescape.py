@@ -0,0 +1,127 @@
+# scripts/texescape.py
+"""
+LaTeX エスケープ（make_latex.py / texconv.py（make_json.py, maketexjson.py）/ makelatexv2.py 共通）。
+
+規則ごとに正規表現を1本だけコンパイルして使い回す。
+  - \\(...\\) / \\[...\\] の中はそのまま（閉じが無ければ末尾まで数式）
+  - skip_escaped=True なら直前が \\ の文字（\\{ \\& \\_ など）はエスケープ済みとして残す
+  - [[...]] は生TeX（latex_escape は [[ ]] を剥がして中身をそのまま出す）
+
+1文字ずつ startswith と直前の文字を見ていた旧実装と結果は同じ。
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Callable
+
+# 数式。閉じが無い場合は末尾までを数式として扱う
+_MATH = r"\\\(.*?(?:\\\)|\Z)|\\\[.*?(?:\\\]|\Z)"
+_MATH_SPLIT_RE = re.compile(f"({_MATH})", re.DOTALL)
+
+_RAW_TEX_RE = re.compile(r"\[\[(.+?)\]\]", re.DOTALL)
+
+# make_latex の本文用
+LATEX_SPECIALS: dict[str, str] = {
+    "&": r"\&",
+    "%": r"\%",
+    "#": r"\#",
+    "_": r"\_",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}",
+}
+
+# make_json（Excel セル -> JSON）用。残りは make_latex 側でエスケープする
+BRACE_AMP_SPECIALS: dict[str, str] = {
+    "{": r"\{",
+    "}": r"\}",
+    "&": r"\&",
+}
+
+
+def compile_escaper(
+    table: dict[str, str],
+    *,
+    skip_math: bool = True,
+    skip_escaped: bool = False,
+) -> Callable[[str], str]:
+    """
+    table の文字をエスケープする関数を作る。
+
+    skip_escaped が無い場合は数式で split して str.translate、
+    ある場合は「数式 | (?<!\\)特殊文字」の1本の正規表現で置換する。
+    """
+    trans = str.maketrans(table)
+    chars = re.escape("".join(table))
+
+    if not skip_math:
+        if not skip_escaped:
+            return lambda s: s.translate(trans)
+        pattern = re.compile(rf"(?<!\\)[{chars}]")
+    elif not skip_escaped:
+        def escape_split(s: str) -> str:
+            if "\\" not in s:
+                return s.translate(trans)
+            parts = _MATH_SPLIT_RE.split(s)
+            parts[::2] = [p.translate(trans) for p in parts[::2]]
+            return "".join(parts)
+
+        return escape_split
+    else:
+        pattern = re.compile(rf"{_MATH}|(?<!\\)[{chars}]", re.DOTALL)
+
+    special = frozenset(table)
+
+    def repl(m: re.Match[str]) -> str:
+        g = m.group()
+        # 数式はそのまま（table に \ で始まるキーは無い）
+        return table.get(g, g)
+
+    sub = pattern.sub
+
+    def escape_re(s: str) -> str:
+        if special.isdisjoint(s):
+            return s
+        return sub(repl, s)
+
+    return escape_re
+
+
+_escape_latex_text = compile_escaper(LATEX_SPECIALS, skip_escaped=True)
+
+_escape_brace_amp = compile_escaper(BRACE_AMP_SPECIALS)
+_escape_all = compile_escaper(LATEX_SPECIALS, skip_math=False)
+
+
+def escape_tex_outside_inline_math(s: str) -> str:
+    r"""
+    \(...\) / \[...\] の中はそのまま、
+    それ以外の部分だけ { } & をエスケープする。
+    """
+    return _escape_brace_amp(s)
+
+
+def latex_escape(s: Any) -> str:
+    r"""
+    本文用。\(...\) / \[...\] の中とエスケープ済みの文字はそのまま、
+    [[...]] は生TeX として中身だけを出す。
+    """
+    if s is None:
+        return ""
+    text = str(s)
+
+    if "[[" not in text:
+        return _escape_latex_text(text)
+
+    parts = _RAW_TEX_RE.split(text)
+    # split すると [通常, 生TeXの中身, 通常, ...] の順になる
+    parts[::2] = [_escape_latex_text(p) for p in parts[::2]]
+    return "".join(parts)
+
+
+def latex_escape_plain(s: Any) -> str:
+    """数式もエスケープ済みも区別せず、特殊文字をすべてエスケープする（makelatexv2 用）。"""
+    if s is None:
+        return ""
+    return _escape_all(str(s))
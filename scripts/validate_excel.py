@@ -3,6 +3,7 @@ from __future__ import annotations
 
 import argparse
 import json
+import random
 import re
 import sys
 from datetime import datetime
@@ -16,6 +17,7 @@ from openpyxl.styles import PatternFill, Font
 from exam_utils import (
     calc_excel_hash,
     get_qpattern,
+    shuffle_column,
     add_subject_arg,
     add_dryrun_arg,
     load_exam_context,
@@ -95,15 +97,70 @@ def write_validate_log(
     log_path.write_text("\n".join(lines), encoding="utf-8")
     return log_path
 
+
+def write_validate_sidecar(
+    work_dir: Path,
+    subject: str,
+    *,
+    excel_path: Path,
+    sheet_name: str,
+    qpattern: str,
+    dryrun: bool,
+    excel_hash: str | None = None,
+    errors: list[dict[str, Any]],
+    stats: dict[str, Any] | None = None,
+    point_summary: list[str] | None = None,
+) -> Path:
+    """
+    --sidecar 実行時の結果を work_dir/validate_<subject>.json に出力する。
+    Excel にコメントを書き込む代わりに、エディタやCIから行番号付きで参照する。
+    """
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    sidecar_path = work_dir / f"validate_{subject}.json"
+
+    data = {
+        "datetime": datetime.now().isoformat(timespec="seconds"),
+        "subject": subject,
+        "sheet": sheet_name,
+        "qpattern": qpattern,
+        "excel": str(excel_path),
+        "hash": excel_hash,
+        "dryrun": dryrun,
+        "ok": not errors,
+        "stats": stats or {},
+        "point_summary": list(point_summary or []),
+        "errors": [
+            {
+                "row": e.get("row"),
+                "message": e.get("message") or e.get("msg") or e.get("error") or str(e),
+            }
+            for e in errors
+        ],
+    }
+
+    sidecar_path.write_text(
+        json.dumps(data, ensure_ascii=False, indent=2, default=str),
+        encoding="utf-8",
+    )
+    return sidecar_path
+
 # ============================================================
-# B版選択肢シャッフル設定
+# 選択肢シャッフル設定
 # pattern[i] は「元の i+1 番の選択肢が、新しい何番へ移動するか」
 # 例: [2,3,4,1] = 元1→新2, 元2→新3, 元3→新4, 元4→新1
+#
+# k 択の選択肢グループ g（大問・小問それぞれ、択数ごとに0から数える。next_group_index を参照）の、
+# 版 j（B=1, C=2, ...）のパターンは巡回シフト量
+#   s = (BASE_SHIFTS[g % len(BASE_SHIFTS)] + j - 2) % (k - 1) + 1
+# で決める。B版・4択では従来の [2,3,4,1] / [3,4,1,2] の交互と同じになる。
+# 同じグループでは版ごとにシフト量が異なるので、元の各選択肢は版ごとに
+# 別の位置へ移動する（A版を含めたラテン方格。版数が k を超える場合は一巡する）。
+#
+# seed を指定した場合は、グループごとに seed から作った並び替えで
+# 選択肢を読み替えてからシフトする（再現可能なランダム化）。
 # ============================================================
-PATTERNS = [
-    [2, 3, 4, 1],
-    [3, 4, 1, 2],
-]
+BASE_SHIFTS = (1, 2)
 
 TARGET_CLEAR_TAGS = {"select", "subselect", "answer", "subanswer"}
 
@@ -221,11 +278,11 @@ def is_2digits(s: Any) -> bool:
     return re.match(pattern, s) is not None
 
 
-def parse_answer_numbers(value: Any) -> list[int]:
+def parse_answer_numbers(value: Any, max_choice: int = 4) -> list[int]:
     """
     answer / subanswer のB列にある元の正解番号を list[int] にする。
     2 / "2" / "1,3" / "1、3" / "1 3" に対応。
-    数値以外が混じる場合は [] を返す。
+    数値以外が混じる場合や 1〜max_choice の範囲外がある場合は [] を返す。
     """
     if value is None:
         return []
@@ -244,7 +301,7 @@ def parse_answer_numbers(value: Any) -> list[int]:
         if not re.fullmatch(r"\d+", p):
             return []
         n = int(p)
-        if n < 1 or n > 4:
+        if n < 1 or n > max_choice:
             return []
         nums.append(n)
     return nums
@@ -265,7 +322,7 @@ def add_error(errors: list[dict[str, Any]], row: int, message: str) -> None:
     errors.append({"row": row, "message": message})
 
 # ============================================================
-# Excel補正：C列 qid / G列シャッフル
+# Excel補正：C列 qid / G列以降シャッフル
 # ============================================================
 def fill_question_ids(ws, prefix: str = "Q") -> dict[str, int]:
     """
@@ -286,32 +343,96 @@ def fill_question_ids(ws, prefix: str = "Q") -> dict[str, int]:
     return stats
 
 
+def shuffle_versions_from_qpattern(qpattern: Any) -> list[str]:
+    """
+    qpattern からシャッフル対象の版（A以外）を取り出す。
+    A だけの場合も、従来どおり B版の列は作っておく。
+    """
+    text = str(qpattern or "A").upper().replace(" ", "")
+    versions = [v for v in text.split(",") if v and v != "A"]
+    return versions or ["B"]
+
+
 def clear_g_column(ws) -> int:
     """
-    select / subselect / answer / subanswer のG列だけをクリアする。
+    select / subselect / answer / subanswer のシャッフル列（B版=G列, C版=H列, ... Z版）をすべてクリアする。
+    qpattern から版が減ったときに、使われなくなった列の値が残らないよう、今の版に関係なくシートの最終列まで消す。
     b_question のG列は PB_B_after の可能性があるため消さない。
     """
+    first_col = shuffle_column("B")
+    last_col = min(ws.max_column, shuffle_column("Z"))
+    if last_col < first_col:
+        return 0
+
     count = 0
-    for row_no in range(1, ws.max_row + 1):
-        tag = norm_tag(ws.cell(row_no, 1).value)
-        if tag in TARGET_CLEAR_TAGS:
-            if ws.cell(row_no, 7).value is not None:
+    for row in ws.iter_rows(max_col=last_col):
+        if norm_tag(row[0].value) not in TARGET_CLEAR_TAGS:
+            continue
+        for cell in row[first_col - 1:]:
+            if cell.value is not None:
                 count += 1
-            ws.cell(row_no, 7).value = None
+                cell.value = None
     return count
 
 
-def apply_pattern_to_choice_rows(ws, rows: list[int], pattern: list[int]) -> None:
-    if len(rows) != 4:
-        raise ValueError(f"選択肢が4行ではありません: rows={rows}")
-    for row_no, value in zip(rows, pattern):
-        ws.cell(row_no, 7).value = value
+def make_shuffle_patterns(
+    k: int,
+    n_versions: int,
+    group_index: int,
+    *,
+    seed: Any = None,
+    group_kind: str = "select",
+) -> list[list[int]]:
+    """
+    k 択の選択肢グループ1つについて、版ごと（B, C, ... の n_versions 個）の pattern を返す。
+    seed=None のときは巡回シフトのみ（B版・4択は従来の [2,3,4,1] / [3,4,1,2] 交互と同じ）。
+    """
+    if k <= 1:
+        return [[1] * k for _ in range(n_versions)]
+
+    if seed is None:
+        sigma = list(range(k))
+    else:
+        rng = random.Random(f"{seed}:{group_kind}:{group_index}")
+        sigma = list(range(k))
+        rng.shuffle(sigma)
+    sigma_inv = [0] * k
+    for i, x in enumerate(sigma):
+        sigma_inv[x] = i
+
+    base = BASE_SHIFTS[group_index % len(BASE_SHIFTS)]
+    patterns: list[list[int]] = []
+    for j in range(1, n_versions + 1):
+        shift = (base + j - 2) % (k - 1) + 1
+        patterns.append([sigma_inv[(sigma[i] + shift) % k] + 1 for i in range(k)])
+    return patterns
+
+
+def next_group_index(counts: dict[int, int], k: int) -> int:
+    """
+    k 択のグループの通し番号を返し、counts を進める。
+    通し番号は択数ごとに数える。ただし旧実装は select を4行ずつ区切って4択グループとして数えていたので、
+    4択の通し番号は他の択数のグループでも k // 4 だけ進め、既存シートのB版の並びを変えないようにする。
+    """
+    index = counts.get(k, 0)
+    counts[k] = index + 1
+    if k != 4:
+        counts[4] = counts.get(4, 0) + k // 4
+    return index
 
 
-def fill_shuffle_for_sheet(ws) -> dict[str, int]:
+def fill_shuffle_for_sheet(
+    ws,
+    versions: list[str] | tuple[str, ...] = ("B",),
+    *,
+    seed: Any = None,
+) -> dict[str, int]:
     """
     b_question〜e_question、b_subquest〜e_subquest の範囲を意識して、
-    G列にB版用シャッフル番号と変換後正解番号をセットする。
+    版ごとのシャッフル列（B版=G列, C版=H列, ...）に選択肢の移動先番号と変換後正解番号をセットする。
+
+    シートは1回だけ走査し、全版の値を集めてから最後にまとめて書き込む。
+    選択肢の数は何択でもよい。
     """
     stats = {
         "question_choice_groups": 0,
@@ -322,6 +443,10 @@ def fill_shuffle_for_sheet(ws) -> dict[str, int]:
         "warnings": 0,
     }
 
+    cols = [shuffle_column(v) for v in versions]
+    n_versions = len(cols)
+    updates: dict[tuple[int, int], Any] = {}
+
     in_question = False
     in_subquest = False
     in_answer_block = False
@@ -329,86 +454,94 @@ def fill_shuffle_for_sheet(ws) -> dict[str, int]:
     answer_is_select = False
     subanswer_is_select = False
 
-    current_question_pattern: list[int] | None = None
-    current_subquest_pattern: list[int] | None = None
+    current_question_patterns: list[list[int]] | None = None
+    current_subquest_patterns: list[list[int]] | None = None
     select_rows: list[int] = []
     subselect_rows: list[int] = []
-    question_select_group_index = 0
-    subquestion_select_group_index = 0
+    # 択数ごとの通し番号（next_group_index を参照）
+    question_select_group_index: dict[int, int] = {}
+    subquestion_select_group_index: dict[int, int] = {}
 
     def warn(msg: str) -> None:
         print(f"警告: {msg}")
         stats["warnings"] += 1
 
-    def flush_select_rows(current_row: int) -> None:
-        nonlocal select_rows, current_question_pattern, question_select_group_index
+    def set_choice_rows(rows: list[int], patterns: list[list[int]]) -> None:
+        for col, pattern in zip(cols, patterns):
+            for row_no, value in zip(rows, pattern):
+                updates[(row_no, col)] = value
+
+    def flush_select_rows() -> None:
+        nonlocal select_rows, current_question_patterns
         if not select_rows:
             return
-        if len(select_rows) != 4:
-            warn(f"select が4行ではありません: rows={select_rows}, near row={current_row}")
-            select_rows = []
-            current_question_pattern = None
-            return
-        pattern = PATTERNS[question_select_group_index % len(PATTERNS)]
-        apply_pattern_to_choice_rows(ws, select_rows, pattern)
-        current_question_pattern = pattern
-        question_select_group_index += 1
+        k = len(select_rows)
+        group_index = next_group_index(question_select_group_index, k)
+        patterns = make_shuffle_patterns(k, n_versions, group_index, seed=seed, group_kind="select")
+        set_choice_rows(select_rows, patterns)
+        current_question_patterns = patterns
         stats["question_choice_groups"] += 1
-        stats["choice_rows"] += 4
+        stats["choice_rows"] += len(select_rows)
         select_rows = []
 
-    def flush_subselect_rows(current_row: int) -> None:
-        nonlocal subselect_rows, current_subquest_pattern, subquestion_select_group_index
+    def flush_subselect_rows() -> None:
+        nonlocal subselect_rows, current_subquest_patterns
         if not subselect_rows:
             return
-        if len(subselect_rows) != 4:
-            warn(f"subselect が4行ではありません: rows={subselect_rows}, near row={current_row}")
-            subselect_rows = []
-            current_subquest_pattern = None
-            return
-        pattern = PATTERNS[subquestion_select_group_index % len(PATTERNS)]
-        apply_pattern_to_choice_rows(ws, subselect_rows, pattern)
-        current_subquest_pattern = pattern
-        subquestion_select_group_index += 1
+        k = len(subselect_rows)
+        group_index = next_group_index(subquestion_select_group_index, k)
+        patterns = make_shuffle_patterns(k, n_versions, group_index, seed=seed, group_kind="subselect")
+        set_choice_rows(subselect_rows, patterns)
+        current_subquest_patterns = patterns
         stats["subquestion_choice_groups"] += 1
-        stats["choice_rows"] += 4
+        stats["choice_rows"] += len(subselect_rows)
         subselect_rows = []
 
-    for row_no in range(1, ws.max_row + 1):
-        tag = norm_tag(ws.cell(row_no, 1).value)
+    def set_answer_row(row_no: int, value: Any, patterns: list[list[int]], tag: str) -> bool:
+        old_answers = parse_answer_numbers(value, max_choice=len(patterns[0]) if patterns else 0)
+        if not old_answers:
+            warn(f"row {row_no} の {tag} は数値解答ではないため変換しません: {value}")
+            return False
+        for col, pattern in zip(cols, patterns):
+            updates[(row_no, col)] = format_answer_numbers(convert_answers(old_answers, pattern))
+        return True
+
+    for row_no, row in enumerate(ws.iter_rows(max_col=2, values_only=True), start=1):
+        tag = norm_tag(row[0] if row else None)
+        value_b = row[1] if len(row) > 1 else None
 
         if tag == "b_question":
-            flush_select_rows(row_no)
-            flush_subselect_rows(row_no)
+            flush_select_rows()
+            flush_subselect_rows()
             in_question = True
-            current_question_pattern = None
+            current_question_patterns = None
             select_rows = []
             continue
 
         if tag == "e_question":
-            flush_select_rows(row_no)
-            flush_subselect_rows(row_no)
+            flush_select_rows()
+            flush_subselect_rows()
             in_question = False
             in_answer_block = False
             answer_is_select = False
-            current_question_pattern = None
+            current_question_patterns = None
             select_rows = []
             continue
 
         if tag == "b_subquest":
-            flush_select_rows(row_no)
-            flush_subselect_rows(row_no)
+            flush_select_rows()
+            flush_subselect_rows()
             in_subquest = True
-            current_subquest_pattern = None
+            current_subquest_patterns = None
             subselect_rows = []
             continue
 
         if tag == "e_subquest":
-            flush_subselect_rows(row_no)
+            flush_subselect_rows()
             in_subquest = False
             in_subanswer_block = False
             subanswer_is_select = False
-            current_subquest_pattern = None
+            current_subquest_patterns = None
             subselect_rows = []
             continue
 
@@ -417,29 +550,24 @@ def fill_shuffle_for_sheet(ws) -> dict[str, int]:
                 warn(f"row {row_no} の select が b_question〜e_question の外にあります")
                 continue
             select_rows.append(row_no)
-            if len(select_rows) == 4:
-                flush_select_rows(row_no)
             continue
 
-        if select_rows and tag != "select":
-            flush_select_rows(row_no)
+        if select_rows:
+            flush_select_rows()
 
         if tag == "subselect":
             if not in_subquest:
                 warn(f"row {row_no} の subselect が b_subquest〜e_subquest の外にあります")
                 continue
             subselect_rows.append(row_no)
-            if len(subselect_rows) == 4:
-                flush_subselect_rows(row_no)
             continue
 
-        if subselect_rows and tag != "subselect":
-            flush_subselect_rows(row_no)
+        if subselect_rows:
+            flush_subselect_rows()
 
         if tag == "b_answer":
             in_answer_block = True
-            marker = ws.cell(row_no, 2).value
-            answer_is_select = str(marker).strip() == "#select" if marker is not None else False
+            answer_is_select = str(value_b).strip() == "#select" if value_b is not None else False
             continue
 
         if tag == "e_answer":
@@ -449,8 +577,7 @@ def fill_shuffle_for_sheet(ws) -> dict[str, int]:
 
         if tag == "b_subanswer":
             in_subanswer_block = True
-            marker = ws.cell(row_no, 2).value
-            subanswer_is_select = str(marker).strip() == "#select" if marker is not None else False
+            subanswer_is_select = str(value_b).strip() == "#select" if value_b is not None else False
             continue
 
         if tag == "e_subanswer":
@@ -461,35 +588,30 @@ def fill_shuffle_for_sheet(ws) -> dict[str, int]:
         if tag == "answer":
             if not in_answer_block or not answer_is_select:
                 continue
-            if current_question_pattern is None:
+            if current_question_patterns is None:
                 warn(f"row {row_no} の answer に対応する select が見つかりません")
                 continue
-            old_answers = parse_answer_numbers(ws.cell(row_no, 2).value)
-            if not old_answers:
-                warn(f"row {row_no} の answer は数値解答ではないため変換しません: {ws.cell(row_no, 2).value}")
-                continue
-            new_answers = convert_answers(old_answers, current_question_pattern)
-            ws.cell(row_no, 7).value = format_answer_numbers(new_answers)
-            stats["answer_rows"] += 1
+            if set_answer_row(row_no, value_b, current_question_patterns, tag):
+                stats["answer_rows"] += 1
             continue
 
         if tag == "subanswer":
             if not in_subanswer_block or not subanswer_is_select:
                 continue
-            if current_subquest_pattern is None:
+            if current_subquest_patterns is None:
                 warn(f"row {row_no} の subanswer に対応する subselect が見つかりません")
                 continue
-            old_answers = parse_answer_numbers(ws.cell(row_no, 2).value)
-            if not old_answers:
-                warn(f"row {row_no} の subanswer は数値解答ではないため変換しません: {ws.cell(row_no, 2).value}")
-                continue
-            new_answers = convert_answers(old_answers, current_subquest_pattern)
-            ws.cell(row_no, 7).value = format_answer_numbers(new_answers)
-            stats["subanswer_rows"] += 1
+            if set_answer_row(row_no, value_b, current_subquest_patterns, tag):
+                stats["subanswer_rows"] += 1
             continue
 
-    flush_select_rows(ws.max_row)
-    flush_subselect_rows(ws.max_row)
+    flush_select_rows()
+    flush_subselect_rows()
+
+    # 全版の値をまとめて書き込む
+    for (row_no, col), value in updates.items():
+        ws.cell(row_no, col).value = value
+
     return stats
 
 # ============================================================
@@ -584,86 +706,110 @@ def check_values(tag: str, row: tuple[Any, ...], rownum: int, errors: list[dict[
         if validator and not validator(cell_value):
             add_error(errors, rownum, f"'{tag}' の{col_index + 1}列目の値 '{cell_value}' が不正です。{message}")
 
-def validate_question_columns(ws, errors: list[dict[str, Any]], make_b: bool = False) -> None:
+def collect_question_keys(ws) -> list[tuple[int, Any, Any]]:
     """
-    b_question のC列 qid / D列 orderB をチェックする。
+    b_question 行の (行番号, C列 qid, D列 orderB) を1回の走査で集める。
+    ws.cell を行ごとに呼ばず、iter_rows(values_only=True) で読む。
+    """
+    entries: list[tuple[int, Any, Any]] = []
+    for row_no, row in enumerate(ws.iter_rows(max_col=4, values_only=True), start=1):
+        if not row or norm_tag(row[0]) != "b_question":
+            continue
+        qid = row[2] if len(row) > 2 else None
+        orderB = row[3] if len(row) > 3 else None
+        entries.append((row_no, qid, orderB))
+    return entries
+
+
+def _format_rows(rows: list[int]) -> str:
+    return ", ".join(str(r) for r in rows)
+
+
+def check_question_invariants(
+    entries: list[tuple[int, Any, Any]],
+    errors: list[dict[str, Any]],
+    make_b: bool = False,
+) -> None:
+    """
+    b_question の qid / orderB の全体チェックを dict で1パスに行う。
 
     qid:
-        A版/B版に関係なく必要なので常にチェックする。
+        未入力・重複をチェックする。重複は値ごとに全行を報告する。
 
     orderB:
-        B版を作る場合だけ必要なので、make_b=True のときだけチェックする。
+        make_b=True のときだけ、未入力・整数以外・重複・1〜N の連番になっているかをチェックする。
+        （N は b_question の数。B版の並べ替えはこの連番を前提にしている）
     """
-    qids: list[str] = []
-    orders: list[int] = []
-
-    for row_no in range(1, ws.max_row + 1):
-        tag = norm_tag(ws.cell(row_no, 1).value)
-        if tag != "b_question":
-            continue
+    qid_rows: dict[str, list[int]] = {}
+    order_rows: dict[int, list[int]] = {}
+    order_complete = True
 
+    for row_no, qid, orderB in entries:
         # C列 qid は常にチェック
-        qid = ws.cell(row_no, 3).value
         if qid is None or str(qid).strip() == "":
             add_error(errors, row_no, "b_question のC列(qid)が未入力です。validate_excel.pyで自動セットできます。")
         else:
-            qids.append(str(qid).strip())
+            qid_rows.setdefault(str(qid).strip(), []).append(row_no)
 
         # D列 orderB はB版を作る場合だけチェック
-        if make_b:
-            orderB = ws.cell(row_no, 4).value
-            if orderB is None or str(orderB).strip() == "":
-                add_error(errors, row_no, "b_question のD列(orderB)が未入力です。B版を作る場合は並び順を入力してください。")
-            else:
-                try:
-                    orders.append(int(str(orderB).strip()))
-                except Exception:
-                    add_error(errors, row_no, f"b_question のD列(orderB)は整数にしてください: {orderB}")
+        if not make_b:
+            continue
+        if orderB is None or str(orderB).strip() == "":
+            add_error(errors, row_no, "b_question のD列(orderB)が未入力です。B版を作る場合は並び順を入力してください。")
+            order_complete = False
+            continue
+        try:
+            ob = int(str(orderB).strip())
+        except Exception:
+            add_error(errors, row_no, f"b_question のD列(orderB)は整数にしてください: {orderB}")
+            order_complete = False
+            continue
+        order_rows.setdefault(ob, []).append(row_no)
 
     # qid の重複は常にチェック
-    dup_qids = sorted({x for x in qids if qids.count(x) > 1})
-    for qid in dup_qids:
-        add_error(errors, 1, f"qid が重複しています: {qid}")
-
-    # orderB の重複はB版を作る場合だけチェック
-    if make_b:
-        dup_orders = sorted({x for x in orders if orders.count(x) > 1})
-        for ob in dup_orders:
-            add_error(errors, 1, f"orderB が重複しています: {ob}")
+    for qid in sorted(qid_rows):
+        rows = qid_rows[qid]
+        if len(rows) > 1:
+            add_error(errors, rows[0], f"qid が重複しています: {qid}（行: {_format_rows(rows)}）")
 
+    if not make_b:
+        return
 
-def __validate_question_columns(ws, errors: list[dict[str, Any]]) -> None:
-    """b_question のC列 qid / D列 orderB をチェックする。"""
-    qids: list[str] = []
-    orders: list[int] = []
-
-    for row_no in range(1, ws.max_row + 1):
-        tag = norm_tag(ws.cell(row_no, 1).value)
-        if tag != "b_question":
-            continue
+    # orderB の重複
+    for ob in sorted(order_rows):
+        rows = order_rows[ob]
+        if len(rows) > 1:
+            add_error(errors, rows[0], f"orderB が重複しています: {ob}（行: {_format_rows(rows)}）")
+
+    # orderB が 1〜N の連番か（未入力・不正値がある場合は上のエラーで十分なので見ない）
+    n = len(entries)
+    for ob in sorted(order_rows):
+        if ob < 1 or ob > n:
+            for row_no in order_rows[ob]:
+                add_error(errors, row_no, f"b_question のD列(orderB)は 1〜{n} の範囲にしてください: {ob}")
+
+    if order_complete:
+        missing = [i for i in range(1, n + 1) if i not in order_rows]
+        if missing:
+            first_row = entries[0][0] if entries else 1
+            add_error(
+                errors,
+                first_row,
+                f"orderB が 1〜{n} の連番になっていません。欠番: {', '.join(str(i) for i in missing)}",
+            )
 
-        qid = ws.cell(row_no, 3).value
-        if qid is None or str(qid).strip() == "":
-            add_error(errors, row_no, "b_question のC列(qid)が未入力です。--fix で自動セットできます。")
-        else:
-            qids.append(str(qid).strip())
 
-        orderB = ws.cell(row_no, 4).value
-        if orderB is None or str(orderB).strip() == "":
-            add_error(errors, row_no, "b_question のD列(orderB)が未入力です。B版を作る場合は並び順を入力してください。")
-        else:
-            try:
-                orders.append(int(str(orderB).strip()))
-            except Exception:
-                add_error(errors, row_no, f"b_question のD列(orderB)は整数にしてください: {orderB}")
+def validate_question_columns(ws, errors: list[dict[str, Any]], make_b: bool = False) -> None:
+    """
+    b_question のC列 qid / D列 orderB をチェックする。
 
-    dup_qids = sorted({x for x in qids if qids.count(x) > 1})
-    for qid in dup_qids:
-        add_error(errors, 1, f"qid が重複しています: {qid}")
+    qid:
+        A版/B版に関係なく必要なので常にチェックする。
 
-    dup_orders = sorted({x for x in orders if orders.count(x) > 1})
-    for ob in dup_orders:
-        add_error(errors, 1, f"orderB が重複しています: {ob}")
+    orderB:
+        B版を作る場合だけ必要なので、make_b=True のときだけチェックする。
+    """
+    check_question_invariants(collect_question_keys(ws), errors, make_b=make_b)
 
 
 def validate_special_rows(ws, errors: list[dict[str, Any]]) -> None:
@@ -949,18 +1095,25 @@ def run_validate(
     sheetname: str,
     *,
     save: bool,
+    shuffle_seed: Any = None,
+    sidecar: bool = False,
 ) -> tuple[list[dict[str, Any]], list[str], dict[str, Any], str, str]:
     """
     統合版の実行本体。
 
     通常実行では、次を必ず行う。
       - C列 qid を毎回セット
-      - G列 shuffle / B版正解を毎回セット
+      - G列以降 shuffle / B版以降の正解を毎回セット（qpattern の版ごとに1列）
       - 既存の validate_excel コメントを削除
       - エラーコメントをA列にセット
       - Excelを保存
 
+    sidecar=True の場合は、解答行の書式・コメントには触れない。
+    qid / シャッフル列の前処理で値が実際に変わったときだけ保存する
+    （stats["data_changed"] / stats["saved"] に結果を残す）。
+
     dryrun の場合は save=False として呼び出す。
+    shuffle_seed を指定すると、選択肢シャッフルをその seed で再現可能にランダム化する。
     """
     wb = openpyxl.load_workbook(excel_path)
     if sheetname not in wb.sheetnames:
@@ -969,20 +1122,34 @@ def run_validate(
 
     stats: dict[str, Any] = {}
 
+    # sidecar モードでは前処理の前後で値のハッシュを比べ、変化の有無を判定する
+    before_hash = calc_excel_hash(ws) if sidecar else None
+
     # 毎回、前処理として値を作り直す
     stats["qid"] = fill_question_ids(ws)
+    shuffle_versions = shuffle_versions_from_qpattern(get_qpattern(ws))
+    stats["shuffle_versions"] = ",".join(shuffle_versions)
     stats["g_cleared"] = clear_g_column(ws)
-    stats["shuffle"] = fill_shuffle_for_sheet(ws)
+    stats["shuffle"] = fill_shuffle_for_sheet(ws, shuffle_versions, seed=shuffle_seed)
 
-    stats["answer_styles"] = apply_answer_styles(ws)
+    if not sidecar:
+        stats["answer_styles"] = apply_answer_styles(ws)
 
-    # コメントは毎回作り直す
-    stats["cleared_comments"] = clear_validation_comments(ws)
+        # コメントは毎回作り直す
+        stats["cleared_comments"] = clear_validation_comments(ws)
 
     errors = validate_sheet(ws)
     score_list = tokutenlst(ws)
 
-    stats["error_comments"] = apply_validation_comments(ws, errors)
+    if not sidecar:
+        stats["error_comments"] = apply_validation_comments(ws, errors)
+
+    excel_hash = calc_excel_hash(ws)
+
+    if sidecar:
+        stats["data_changed"] = excel_hash != before_hash
+        save = save and stats["data_changed"]
+    stats["saved"] = save
 
     if save:
         try:
@@ -994,7 +1161,6 @@ def run_validate(
                 f"対象ファイル: {excel_path}\n"
                 f"元のエラー: {e}"
             )
-    excel_hash = calc_excel_hash(ws)
     qpattern = get_qpattern(ws)
     return errors, score_list, stats, excel_hash, qpattern
 
@@ -1002,13 +1168,26 @@ def run_validate(
 def main() -> None:
     parser = argparse.ArgumentParser(
         description=(
-            "試験問題.xlsx をチェックし、C列qid・G列B版シャッフル・コメントを更新します。"
+            "試験問題.xlsx をチェックし、C列qid・G列以降の版別シャッフル・コメントを更新します。"
             "通常実行ではExcelを保存し、Validation OK時にstampを作成します。"
         )
     )
 
     add_subject_arg(parser)
     add_dryrun_arg(parser)
+    parser.add_argument(
+        "--shuffle-seed",
+        default=None,
+        help="選択肢シャッフルの seed。省略時は従来どおりの巡回シフト",
+    )
+    parser.add_argument(
+        "--sidecar",
+        action="store_true",
+        help=(
+            "エラーコメント・書式をExcelに書き込まず、work/validate_<科目番号>.json に出力する。"
+            "Excelは qid/シャッフル列が変わったときだけ保存する"
+        ),
+    )
 
     args = parser.parse_args()
 
@@ -1039,23 +1218,29 @@ def main() -> None:
         excel_path,
         sheetname,
         save=should_save,
+        shuffle_seed=args.shuffle_seed,
+        sidecar=args.sidecar,
     )
 
     qid_stats = stats.get("qid", {})
     print(f"b_question数: {qid_stats.get('question_count', 0)}")
     print(f"qidセット: {qid_stats.get('filled_qid', 0)} 件")
 
-    print(f"G列クリア: {stats.get('g_cleared', 0)} セル")
+    print(f"シャッフル対象版: {stats.get('shuffle_versions', '')}")
+    print(f"シャッフル列クリア: {stats.get('g_cleared', 0)} セル")
     sh = stats.get("shuffle", {})
     print(f"大問 select グループ: {sh.get('question_choice_groups', 0)}")
     print(f"小問 subselect グループ: {sh.get('subquestion_choice_groups', 0)}")
-    print(f"select/subselect G列セット: {sh.get('choice_rows', 0)} 行")
-    print(f"answer G列セット: {sh.get('answer_rows', 0)} 行")
-    print(f"subanswer G列セット: {sh.get('subanswer_rows', 0)} 行")
+    print(f"select/subselect シャッフル列セット: {sh.get('choice_rows', 0)} 行")
+    print(f"answer シャッフル列セット: {sh.get('answer_rows', 0)} 行")
+    print(f"subanswer シャッフル列セット: {sh.get('subanswer_rows', 0)} 行")
     print(f"shuffle警告: {sh.get('warnings', 0)} 件")
 
-    print(f"既存コメント削除: {stats.get('cleared_comments', 0)} 件")
-    print(f"エラーコメントセット: {stats.get('error_comments', 0)} 件")
+    if args.sidecar:
+        print(f"qid/シャッフル列の変更: {'あり' if stats.get('data_changed') else 'なし'}")
+    else:
+        print(f"既存コメント削除: {stats.get('cleared_comments', 0)} 件")
+        print(f"エラーコメントセット: {stats.get('error_comments', 0)} 件")
 
     print("点数状況:")
     for v in score_list:
@@ -1076,12 +1261,31 @@ def main() -> None:
     )
     print(f"ログ出力: {log_path}")
 
+    if args.sidecar:
+        sidecar_path = write_validate_sidecar(
+            Path(work_dir),
+            subject,
+            excel_path=Path(excel_path),
+            sheet_name=sheetname,
+            qpattern=qpattern,
+            dryrun=args.dryrun,
+            excel_hash=excel_hash,
+            errors=errors,
+            stats=stats,
+            point_summary=score_list,
+        )
+        print(f"sidecar出力: {sidecar_path}")
+
     if errors:
         print("Validation errors:")
         for e in errors:
             print(f" - Row {e['row']}: {e['message']}")
 
-        if should_save:
+        if args.sidecar:
+            saved = "保存しました" if stats.get("saved") else "変更していません"
+            print(f"エラーがあります。Excelは{saved}が、validation stamp は作成しません。")
+            print("sidecar JSON またはログを確認し、修正後に再実行してください。")
+        elif should_save:
             print("エラーがあります。Excelは保存しましたが、validation stamp は作成しません。")
             print("Excelを開いてコメントを確認し、修正後に再実行してください。")
         else:
@@ -1092,7 +1296,10 @@ def main() -> None:
     print("Validation OK!")
 
     if should_save:
-        print("Excelを保存しました。")
+        if stats.get("saved"):
+            print("Excelを保存しました。")
+        else:
+            print("qid/シャッフル列に変更がないため、Excelは保存していません。")
 
         # 保存後の内容でstampを作る
         wb2 = openpyxl.load_workbook(excel_path, data_only=False)